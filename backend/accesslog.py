@@ -0,0 +1,103 @@
+import random
+import time
+from logging import Logger
+from typing import Optional
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from log import get_logger
+
+##########################################################################################
+# Access log
+#
+# A pure ASGI middleware: it wraps receive/send instead of buffering the request or response
+# (BaseHTTPMiddleware reads the whole body and runs the endpoint in a separate task, which
+# also gets in the way of long SSE streams). One line is logged per request once the response
+# is complete, with latency, time to first byte and bytes in/out; the request body is kept up to
+# body_bytes, as it passes through. Only sample_rate of requests is logged, plus every failed one.
+# Writing is done by the queue-backed handler set up in log.init_loggers.
+
+
+class AccessLogMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        logger: Optional[Logger] = None,
+        sample_rate: float = 1.0,
+        body_bytes: int = 1024,
+    ):
+        self.app = app
+        self.logger = logger or get_logger("access")
+        self.sample_rate = sample_rate
+        self.body_bytes = body_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        started = time.perf_counter()
+        first_byte = 0.0
+        status = 0
+        bytes_in = 0
+        bytes_out = 0
+        body = bytearray()
+
+        async def receive_wrapper() -> Message:
+            nonlocal bytes_in
+            message = await receive()
+            if message["type"] == "http.request":
+                chunk = message.get("body", b"")
+                bytes_in += len(chunk)
+                if sampled and len(body) < self.body_bytes:
+                    body.extend(chunk[: self.body_bytes - len(body)])
+            return message
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, first_byte, bytes_out
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                first_byte = time.perf_counter()
+            elif message["type"] == "http.response.body":
+                bytes_out += len(message.get("body", b""))
+            await send(message)
+
+        error: Optional[BaseException] = None
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if sampled or error is not None or status >= 500:
+                self.log(scope, status, started, first_byte, bytes_in, bytes_out, body, error)
+
+    def log(
+        self,
+        scope: Scope,
+        status: int,
+        started: float,
+        first_byte: float,
+        bytes_in: int,
+        bytes_out: int,
+        body: bytearray,
+        error: Optional[BaseException],
+    ) -> None:
+        ended = time.perf_counter()
+        client = scope.get("client")
+        query = scope.get("query_string", b"")
+        path = scope["path"] + ("?" + query.decode("latin-1") if query else "")
+        self.logger.info(
+            '%s "%s %s" %d %.1fms ttfb=%.1fms in=%d out=%d%s%s',
+            client[0] if client else "-",
+            scope["method"],
+            path,
+            status or 500,
+            (ended - started) * 1000,
+            ((first_byte or ended) - started) * 1000,
+            bytes_in,
+            bytes_out,
+            f" body={bytes(body)!r}" if body else "",
+            f" error={error!r}" if error is not None else "",
+        )
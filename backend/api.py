@@ -1,39 +1,64 @@
 from datetime import datetime, timezone
 import http
-import os
-from logging import Logger
-from langchain_core.messages import AIMessageChunk
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Annotated, List, Optional
+from uuid import uuid4
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from pydantic import BaseModel
 
 
-from dotenv import load_dotenv
 from misc import format_datetime
-from errs import BaseError
-from log import get_logger
-from graph import super_graph
+from errs import BadRequest, BaseError, Conflict, NotFound
+from log import LogConfig, init_loggers
+from settings import settings
+from accesslog import AccessLogMiddleware
+from batch import get_batch_runner
+from graph import get_super_graph, run_config
+from jobs import get_job_queue
+from metrics import render_metrics
+from registry import registry
+from streaming import message_events, sse_frames
+from upload import ingest_body
 
-load_dotenv(dotenv_path=os.path.join(os.getcwd(), ".env"))
+init_loggers(LogConfig(level=settings.log_level, format=settings.log_format))
 
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    logger: Logger = get_logger("api")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Importing the API builds nothing (see registry.py); with warm_start the graphs are built
+    # while the server already accepts connections, and a question arriving first just waits.
+    # The sandbox workers start importing numpy and matplotlib at the same time.
+    warm_up = (
+        [
+            asyncio.create_task(asyncio.to_thread(get_super_graph)),
+            asyncio.create_task(asyncio.to_thread(registry.get, "sandbox")),
+        ]
+        if settings.warm_start
+        else []
+    )
+    jobs = await asyncio.to_thread(get_job_queue)
+    jobs.start()
+    yield
+    await jobs.stop()
+    await asyncio.gather(*warm_up, return_exceptions=True)
 
-    async def dispatch(self, request, call_next):
-        self.logger.info("Request body: %s", await request.body())
-        resp = await call_next(request)
-        return resp
-    
 
-fastapi_app = FastAPI(validate_responses=False)
-fastapi_app.add_middleware(LoggingMiddleware)
+fastapi_app = FastAPI(validate_responses=False, lifespan=lifespan)
+fastapi_app.add_middleware(
+    AccessLogMiddleware,
+    sample_rate=settings.access_log_sample_rate,
+    body_bytes=settings.access_log_body_bytes,
+)
 fastapi_app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], 
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Thread-Id"],
 )
 
 @fastapi_app.exception_handler(BaseError)
@@ -62,46 +87,232 @@ async def internal_exception_handler(request: Request, exc):
 
 
 ####################################################################
-async def answer_generator(question: str):
+async def answer_generator(
+    question: str, thread_id: str, namespaces: Optional[List[str]] = None, lease_owner: Optional[str] = None
+):
+    shared = registry.get("shared_state")
     try:
         question = question.strip()
+        config = run_config(thread_id)
 
-        async for messages in super_graph.astream(
-            {
+        # A thread with pending nodes is an interrupted run: pick it up after the last finished
+        # node instead of asking the question again.
+        super_graph = get_super_graph()
+        state = await super_graph.aget_state(config)
+        if state.next:
+            graph_input = None
+            await asyncio.to_thread(shared.incr, "runs:resumed")
+        else:
+            graph_input = {
                 "messages": [
                     ("user", question)
                 ],
-            },
-            {"recursion_limit": 150},
-            stream_mode="messages"
-        ):
-            
-            checkpoint_ns:str = messages[1]["checkpoint_ns"]
-            is_cared_checkpoints = checkpoint_ns.startswith("search:") or checkpoint_ns.startswith("note_taker:")
-            if True or is_cared_checkpoints:
-                for msg in messages:
-                    if isinstance(msg, AIMessageChunk):
-                        content = msg.content
-                        if content:
-                            #print(content, end="", flush=True)
-                            escaped_content = content.replace("\n", "\\n")
-                            yield f"data: {escaped_content}\n\n"
-                #await asyncio.sleep(0)
-    except Exception as e:
-        yield f"data: [Error] {str(e)}\n\n"
-    yield "data: [DONE]\n\n"
+            }
+            await asyncio.to_thread(shared.incr, "runs:started")
+
+        renew_at = time.monotonic() + settings.run_lease_ttl / 3
+        stream = super_graph.astream(graph_input, config, stream_mode="messages")
+        async for event in message_events(stream, namespaces):
+            if lease_owner and time.monotonic() > renew_at:
+                renew_at = time.monotonic() + settings.run_lease_ttl / 3
+                await asyncio.to_thread(shared.acquire, f"run:{thread_id}", lease_owner, settings.run_lease_ttl)
+            yield event
+        await asyncio.to_thread(shared.incr, "runs:completed")
+    finally:
+        try:
+            # failed, cancelled and disconnected runs too: an interrupted run finds its
+            # documents on disk when it is resumed
+            workspaces = registry.peek("workspaces")
+            if workspaces is not None:
+                await workspaces.close(thread_id)
+        finally:
+            if lease_owner:
+                await asyncio.to_thread(shared.release, f"run:{thread_id}", lease_owner)
 
 
 
 @fastapi_app.get("/rest/v1/question")
-async def submit_question(request: Request, question: str):
-    async def event_stream():
-        try:
-            async for data in answer_generator(question):
-                if await request.is_disconnected():
-                    break
-                yield data
-        except Exception as e:
-            yield f"data: [Error] {str(e)}\n\n"
-
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+async def submit_question(
+    request: Request,
+    question: str,
+    thread_id: Optional[str] = None,
+    ns: Annotated[Optional[List[str]], Query()] = None,
+):
+    """Answer a question as a server-sent event stream of JSON events (see streaming.py).
+
+    Runs are checkpointed under ``thread_id`` (a new one is generated when omitted, and returned in
+    the ``X-Thread-Id`` header). Submitting again with the id of an interrupted run resumes it.
+    ``ns`` (repeatable) keeps only the output of the given teams or workers, e.g. ``ns=search``.
+    """
+    if not thread_id:
+        thread_id = uuid4().hex
+
+    lease_owner = uuid4().hex
+    shared = registry.get("shared_state")
+    if not await asyncio.to_thread(shared.acquire, f"run:{thread_id}", lease_owner, settings.run_lease_ttl):
+        raise Conflict(f"Run {thread_id} is already in progress")
+
+    frames = sse_frames(
+        answer_generator(question, thread_id, ns, lease_owner),
+        max_chars=settings.sse_frame_chars,
+        max_delay=settings.sse_frame_delay,
+        is_disconnected=request.is_disconnected,
+        disconnect_interval=settings.sse_disconnect_interval,
+        max_pending=settings.sse_max_pending_events,
+    )
+    return StreamingResponse(frames, media_type="text/event-stream", headers={"X-Thread-Id": thread_id})
+
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    # runs of this batch at once, within the pool shared by all batches
+    concurrency: Optional[int] = None
+
+
+@fastapi_app.post("/rest/v1/batches")
+async def submit_batch(body: BatchRequest):
+    """Answer many questions at once (see batch.py). Returns the batch summary, with its ``batch_id``."""
+    questions = [q for q in body.questions if q.strip()]
+    if not questions:
+        raise BadRequest("No questions given")
+    if len(questions) > settings.batch_max_questions:
+        raise BadRequest(f"A batch holds at most {settings.batch_max_questions} questions")
+    if body.concurrency is not None and body.concurrency < 1:
+        raise BadRequest("concurrency must be at least 1")
+    return get_batch_runner().submit(questions, body.concurrency).summary()
+
+
+@fastapi_app.get("/rest/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Status, steps taken and answer of each question of a batch."""
+    return get_batch_runner().get(batch_id).summary()
+
+
+@fastapi_app.get("/rest/v1/batches/{batch_id}/events")
+async def follow_batch(request: Request, batch_id: str, offset: int = 0):
+    """Progress events of a batch as a server-sent event stream, from ``offset`` on, until the batch is done."""
+    frames = sse_frames(
+        get_batch_runner().get(batch_id).follow(offset),
+        max_chars=settings.sse_frame_chars,
+        max_delay=settings.sse_frame_delay,
+        is_disconnected=request.is_disconnected,
+        disconnect_interval=settings.sse_disconnect_interval,
+        max_pending=settings.sse_max_pending_events,
+    )
+    return StreamingResponse(frames, media_type="text/event-stream")
+
+
+@fastapi_app.delete("/rest/v1/batches/{batch_id}")
+async def cancel_batch(batch_id: str):
+    """Cancel the questions of a batch that are not done yet."""
+    return get_batch_runner().cancel(batch_id).summary()
+
+
+class JobRequest(BaseModel):
+    question: str
+
+
+@fastapi_app.post("/rest/v1/jobs")
+async def submit_job(body: JobRequest):
+    """Queue a question to be answered in the background (see jobs.py). Returns its ``job_id``."""
+    if not body.question.strip():
+        raise BadRequest("No question given")
+    job_id = await get_job_queue().submit(body.question.strip())
+    return {"job_id": job_id, "status": "queued"}
+
+
+async def _get_job(job_id: str) -> dict:
+    job = await asyncio.to_thread(get_job_queue().store.get, job_id)
+    if job is None:
+        raise NotFound(f"Job {job_id} not found")
+    return job
+
+
+@fastapi_app.get("/rest/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and answer of a job, and the names of its documents once it is done."""
+    job = await _get_job(job_id)
+    job["documents"] = sorted(await asyncio.to_thread(get_job_queue().store.documents, job_id))
+    return job
+
+
+@fastapi_app.get("/rest/v1/jobs/{job_id}/documents/{name:path}", response_class=PlainTextResponse)
+async def get_job_document(job_id: str, name: str):
+    documents = await asyncio.to_thread(get_job_queue().store.documents, job_id)
+    if name not in documents:
+        raise NotFound(f"Document {name} not found")
+    return PlainTextResponse(documents[name])
+
+
+@fastapi_app.get("/rest/v1/jobs/{job_id}/events")
+async def follow_job(request: Request, job_id: str, offset: int = 0):
+    """Events of a job as a server-sent event stream, from ``offset`` on, until the job is over.
+
+    Every event carries its "seq"; reconnect with ``offset`` one past the last one received.
+    """
+    await _get_job(job_id)
+    frames = sse_frames(
+        get_job_queue().follow(job_id, offset),
+        max_chars=settings.sse_frame_chars,
+        max_delay=settings.sse_frame_delay,
+        is_disconnected=request.is_disconnected,
+        disconnect_interval=settings.sse_disconnect_interval,
+        max_pending=settings.sse_max_pending_events,
+    )
+    return StreamingResponse(frames, media_type="text/event-stream")
+
+
+@fastapi_app.delete("/rest/v1/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job, or stop a running one (within a third of the lease time)."""
+    await _get_job(job_id)
+    if not await asyncio.to_thread(get_job_queue().store.cancel, job_id):
+        raise Conflict(f"Job {job_id} is already over")
+    return await _get_job(job_id)
+
+
+@fastapi_app.post("/rest/v1/runs/{thread_id}/uploads")
+async def upload_documents(request: Request, thread_id: str, name: str = "upload.txt"):
+    """Give a run text documents of its own, before asking it a question (see upload.py).
+
+    The body is a multipart form with any number of files, or a base64 data URL of one file named
+    ``name``. Each file is indexed for the retrieve tool as it arrives, and saved under uploads/.
+    Not while the run is in progress.
+    """
+    lease_owner = uuid4().hex
+    shared = registry.get("shared_state")
+    lease = f"run:{thread_id}"
+    if not await asyncio.to_thread(shared.acquire, lease, lease_owner, settings.run_lease_ttl):
+        raise Conflict(f"Run {thread_id} is in progress")
+
+    async def renew():
+        while True:
+            await asyncio.sleep(settings.run_lease_ttl / 3)
+            await asyncio.to_thread(shared.acquire, lease, lease_owner, settings.run_lease_ttl)
+
+    renewing = asyncio.create_task(renew())
+    workspaces = registry.get("workspaces")
+    try:
+        documents = await ingest_body(
+            workspaces.get(thread_id),
+            request.stream(),
+            request.headers.get("content-type", ""),
+            name,
+            settings.upload_max_bytes,
+        )
+    finally:
+        renewing.cancel()
+        # the run indexes the files from disk (see workspace.py); without a file system, the
+        # workspace has to stay in memory until the run
+        if workspaces.fs is not None:
+            await workspaces.close(thread_id)
+        await asyncio.to_thread(shared.release, lease, lease_owner)
+    if not documents:
+        raise BadRequest("No file given")
+    return {"thread_id": thread_id, "documents": documents}
+
+
+@fastapi_app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics of this worker (see metrics.py)."""
+    return PlainTextResponse(await render_metrics(), media_type="text/plain; version=0.0.4")
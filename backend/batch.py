@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Optional
+from uuid import uuid4
+
+from errs import NotFound
+from graph import get_super_graph, run_config
+from log import get_logger
+from registry import registry
+from settings import settings
+from streaming import message_events
+
+##########################################################################################
+# Batches of questions
+#
+# A batch runs many questions through super_graph at once, within a pool of `workers` runs
+# for all batches together (and an optional limit per batch). Its runs share a share_scope,
+# so questions sending the research team the same request get one research run between
+# them (see graph.py). Progress is kept as a list of events per batch, which callers poll as
+# a summary or follow as a stream from any offset:
+#
+#   {"seq": 3, "type": "status", "index": 0, "status": "running"}
+#   {"seq": 4, "type": "step", "index": 0, "ns": "research_team", "node": "search"}
+#   {"seq": 9, "type": "answer", "index": 0, "answer": "..."}
+#
+# Batches live in the memory of the worker process that took them; the last max_batches
+# finished ones are kept.
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+@dataclass
+class BatchItem:
+    index: int
+    question: str
+    thread_id: str
+    status: str = QUEUED
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    steps: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "index": self.index,
+            "question": self.question,
+            "thread_id": self.thread_id,
+            "status": self.status,
+            "steps": self.steps,
+            "answer": self.answer,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+@dataclass
+class Batch:
+    id: str
+    items: list[BatchItem]
+    concurrency: Optional[int] = None
+    created_at: float = field(default_factory=time.time)
+    events: list[dict[str, Any]] = field(default_factory=list)
+    tasks: list[asyncio.Task] = field(default_factory=list)
+
+    def __post_init__(self):
+        self.changed = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.concurrency) if self.concurrency else None
+
+    @property
+    def done(self) -> bool:
+        return all(item.status in (DONE, FAILED, CANCELLED) for item in self.items)
+
+    def emit(self, event: dict[str, Any]):
+        self.events.append({"seq": len(self.events), **event})
+        # wake up every follower, then give the next ones a fresh event to wait on
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[dict[str, Any]]:
+        """The events from ``offset`` on, then new ones as they come, until the batch is done."""
+        while True:
+            changed = self.changed
+            while offset < len(self.events):
+                yield self.events[offset]
+                offset += 1
+            if self.done:
+                return
+            await changed.wait()
+
+    def summary(self) -> dict[str, Any]:
+        counts: dict[str, int] = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return {
+            "batch_id": self.id,
+            "created_at": self.created_at,
+            "done": self.done,
+            "counts": counts,
+            "events": len(self.events),
+            "items": [item.summary() for item in self.items],
+        }
+
+
+class BatchRunner:
+    def __init__(self, workers: int = 8, max_batches: int = 100):
+        self.logger = get_logger("batch")
+        self.workers = workers
+        self.max_batches = max_batches
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.batches: OrderedDict[str, Batch] = OrderedDict()
+
+    def submit(self, questions: list[str], concurrency: Optional[int] = None) -> Batch:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+        batch = Batch(
+            uuid4().hex,
+            [BatchItem(i, q.strip(), uuid4().hex) for i, q in enumerate(questions)],
+            concurrency=concurrency,
+        )
+        self.batches[batch.id] = batch
+        self._evict()
+        for item in batch.items:
+            batch.emit({"type": "status", "index": item.index, "status": QUEUED, "thread_id": item.thread_id})
+        batch.tasks = [asyncio.create_task(self._run(batch, item)) for item in batch.items]
+        return batch
+
+    def get(self, batch_id: str) -> Batch:
+        batch = self.batches.get(batch_id)
+        if batch is None:
+            raise NotFound(f"Batch {batch_id} not found")
+        return batch
+
+    def cancel(self, batch_id: str) -> Batch:
+        batch = self.get(batch_id)
+        for task in batch.tasks:
+            task.cancel()
+        return batch
+
+    def _evict(self):
+        finished = [b.id for b in self.batches.values() if b.done]
+        for batch_id in finished[: max(0, len(self.batches) - self.max_batches)]:
+            del self.batches[batch_id]
+
+    def _set_status(self, batch: Batch, item: BatchItem, status: str):
+        item.status = status
+        batch.emit({"type": "status", "index": item.index, "status": status})
+
+    async def _run(self, batch: Batch, item: BatchItem):
+        try:
+            async with self.slots, batch.slots or nullcontext():
+                item.started_at = time.time()
+                self._set_status(batch, item, RUNNING)
+                await self._answer(batch, item)
+                item.finished_at = time.time()
+                self._set_status(batch, item, DONE)
+        except asyncio.CancelledError:
+            item.finished_at = time.time()
+            self._set_status(batch, item, CANCELLED)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.logger.exception("batch %s: question %d failed", batch.id, item.index)
+            item.error = str(e)
+            item.finished_at = time.time()
+            self._set_status(batch, item, FAILED)
+        finally:
+            workspaces = registry.peek("workspaces")
+            if workspaces is not None:
+                await workspaces.close(item.thread_id)
+            if batch.done:
+                registry.get("research_share").forget(batch.id)
+
+    async def _answer(self, batch: Batch, item: BatchItem):
+        graph = get_super_graph()
+        config = run_config(item.thread_id, share_scope=batch.id)
+        stream = graph.astream({"messages": [("user", item.question)]}, config, stream_mode="messages")
+        step = None
+        async for event in message_events(stream):
+            if (event["ns"], event["node"]) != step:
+                step = (event["ns"], event["node"])
+                item.steps += 1
+                batch.emit({"type": "step", "index": item.index, "ns": event["ns"], "node": event["node"]})
+        state = await graph.aget_state(config)
+        item.answer = state.values["messages"][-1].content
+        batch.emit({"type": "answer", "index": item.index, "answer": item.answer})
+
+    def metrics(self) -> dict[str, Any]:
+        r: dict[str, Any] = {"batches": len(self.batches)}
+        for batch in self.batches.values():
+            for item in batch.items:
+                r[item.status] = r.get(item.status, 0) + 1
+        return r
+
+
+registry.register("batches", lambda: BatchRunner(settings.batch_workers, settings.batch_max_batches))
+
+
+def get_batch_runner() -> BatchRunner:
+    return registry.get("batches")
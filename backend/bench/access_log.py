@@ -0,0 +1,120 @@
+"""Requests/sec through the API middleware: none, the previous BaseHTTPMiddleware that logged every
+request body, and AccessLogMiddleware writing through a queue.
+
+Requests go in-process through httpx's ASGI transport, so the numbers are framework overhead
+only. Log records are written to /dev/null.
+
+Usage (from the backend folder):
+
+    $ python -m bench.access_log --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from accesslog import AccessLogMiddleware
+
+
+class LegacyLoggingMiddleware(BaseHTTPMiddleware):
+    logger = logging.getLogger("bench.legacy")
+
+    async def dispatch(self, request, call_next):
+        self.logger.info("Request body: %s", await request.body())
+        resp = await call_next(request)
+        return resp
+
+
+def make_app(middleware: str, logger: logging.Logger, sample_rate: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.get("/stream")
+    async def stream():
+        async def frames():
+            for i in range(50):
+                yield f"data: {i}\n\n"
+        return StreamingResponse(frames(), media_type="text/event-stream")
+
+    if middleware == "legacy":
+        LegacyLoggingMiddleware.logger = logger
+        app.add_middleware(LegacyLoggingMiddleware)
+    elif middleware == "access":
+        app.add_middleware(AccessLogMiddleware, logger=logger, sample_rate=sample_rate)
+    return app
+
+
+def make_logger(name: str, queued: bool) -> tuple[logging.Logger, QueueListener | None]:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.handlers.clear()
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(open(os.devnull, "w", encoding="utf-8"))
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    if not queued:
+        logger.addHandler(handler)
+        return logger, None
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    logger.addHandler(QueueHandler(log_queue))
+    return logger, listener
+
+
+async def run(app: FastAPI, path: str, requests: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    body = b"x" * 2048
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker(n: int):
+            for _ in range(n):
+                if path == "/echo":
+                    r = await client.post(path, content=body)
+                else:
+                    r = await client.get(path)
+                r.raise_for_status()
+
+        started = time.perf_counter()
+        per_worker = requests // concurrency
+        await asyncio.gather(*(worker(per_worker) for _ in range(concurrency)))
+        return per_worker * concurrency / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sample-rate", type=float, default=1.0)
+    parser.add_argument("--rounds", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    paths = ["/ping", "/echo", "/stream"]
+    print(f"{'middleware':>12} " + " ".join(f"{p + ' (req/s)':>16}" for p in paths))
+    for middleware in ["none", "legacy", "access"]:
+        logger, listener = make_logger(middleware, queued=middleware == "access")
+        app = make_app(middleware, logger, args.sample_rate)
+        rates = [
+            max([await run(app, path, args.requests, args.concurrency) for _ in range(args.rounds)])
+            for path in paths
+        ]
+        if listener is not None:
+            listener.stop()
+        print(f"{middleware:>12} " + " ".join(f"{rate:>16.0f}" for rate in rates))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""Concurrency scaling of super_graph with a stubbed chat model.
+
+Usage (from the backend folder):
+
+    $ python -m bench.async_load --latency 0.05 --concurrency 1 10 100 300
+    $ python -m bench.async_load --blocking   # the model blocks the event loop, like a sync node would
+    $ python -m bench.async_load --start-rule # route the first hop of each supervisor without the LLM
+"""
+import argparse
+import asyncio
+import time
+
+from bench.fakes import ScriptedChatModel
+from graph import make_super_graph
+from paper_writing_team import make_paper_writing_graph
+from research_team import make_research_graph
+from routing import DEFAULT_RULES, first_member_on_start, routing_stats
+
+
+async def run_one(graph, question: str) -> float:
+    started = time.perf_counter()
+    async for _ in graph.astream(
+        {"messages": [("user", question)]},
+        {"recursion_limit": 150},
+        stream_mode="messages",
+    ):
+        pass
+    return time.perf_counter() - started
+
+
+async def run_batch(graph, n: int) -> tuple[float, list[float]]:
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(run_one(graph, f"question {i}") for i in range(n)))
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per model call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100, 300])
+    parser.add_argument("--blocking", action="store_true")
+    parser.add_argument("--start-rule", action="store_true")
+    args = parser.parse_args()
+
+    llm = ScriptedChatModel(latency=args.latency, blocking=args.blocking)
+    rules = DEFAULT_RULES + [first_member_on_start] if args.start_rule else None
+    graph = make_super_graph(llm, make_research_graph(llm, rules=rules), make_paper_writing_graph(llm), rules=rules)
+
+    print(f"{'runs':>6} {'wall(s)':>9} {'runs/s':>9} {'p50(s)':>8} {'p99(s)':>8}")
+    for n in args.concurrency:
+        wall, latencies = asyncio.run(run_batch(graph, n))
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{n:>6} {wall:>9.2f} {n / wall:>9.1f} {p50:>8.2f} {p99:>8.2f}")
+
+    print()
+    print("routing decisions:")
+    for supervisor, paths in routing_stats.snapshot().items():
+        print(f"  {supervisor}: " + ", ".join(f"{path}={count}" for path, count in paths.items()))
+
+
+if __name__ == "__main__":
+    main()
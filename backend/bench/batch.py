@@ -0,0 +1,83 @@
+"""A batch of questions with repeated research requests, with and without sharing research between them.
+
+--questions questions cycle through --topics distinct ones. "separate" runs them like so many
+single requests (same pool, nothing shared); "shared" runs them as a batch, where questions
+with the same research request share one research run.
+
+Usage (from the backend folder):
+
+    $ python -m bench.batch --questions 48 --topics 12 --workers 8
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from batch import BatchRunner
+from bench.fakes import FakeScraper, FakeSearchBackend, ScriptedChatModel
+from checkpoint import SqliteCheckpointer
+from graph import make_super_graph
+from paper_writing_team import make_paper_writing_graph
+from registry import registry
+from research_team import make_research_graph
+from search import CachedSearch
+from singleflight import SingleFlight
+from workspace import Workspaces
+
+
+async def run_batch(runner: BatchRunner, questions: list[str]) -> float:
+    started = time.perf_counter()
+    batch = runner.submit(questions)
+    async for _ in batch.follow():
+        pass
+    elapsed = time.perf_counter() - started
+    failed = [item.error for item in batch.items if item.status != "done"]
+    assert not failed, failed[:3]
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=48)
+    parser.add_argument("--topics", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="model time to first token (s)")
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--scrape-latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    questions = [f"Research topic {i % args.topics} and write a brief report." for i in range(args.questions)]
+    llm = ScriptedChatModel(latency=args.latency, tokens_per_second=200, answer_tokens=30, use_tools=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        registry.set("search", CachedSearch(FakeSearchBackend(args.search_latency), ttl=0))
+        registry.set("scraper", FakeScraper(args.scrape_latency))
+        registry.set("workspaces", Workspaces())
+        checkpointer = SqliteCheckpointer(os.path.join(tmp, "checkpoints.sqlite"))
+
+        print(f"{args.questions} questions over {args.topics} topics, {args.workers} at a time\n")
+        print(f"{'setup':>9} {'elapsed s':>10} {'questions/s':>12} {'research runs':>14} {'shared':>7}")
+        for name in ("separate", "shared"):
+            share = SingleFlight()
+            registry.set("research_share", share)
+            registry.set(
+                "super_graph",
+                make_super_graph(
+                    llm,
+                    make_research_graph(llm),
+                    make_paper_writing_graph(llm),
+                    checkpointer=checkpointer,
+                    research_share=share if name == "shared" else None,
+                ),
+            )
+            elapsed = asyncio.run(run_batch(BatchRunner(workers=args.workers), questions))
+            research_runs = share.stats["run"] if name == "shared" else args.questions
+            print(
+                f"{name:>9} {elapsed:>10.2f} {args.questions / elapsed:>12.2f} {research_runs:>14}"
+                f" {share.stats['shared']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Prompt size per routing step over a long run, with and without context compaction.
+
+Every step appends a worker report (a scraped-page-sized one every --page-every steps) and the
+supervisor then sends the conversation to the router model.
+
+Usage (from the backend folder):
+
+    $ python -m bench.context --steps 60
+"""
+import argparse
+import time
+
+from langchain_core.messages import HumanMessage
+
+from context import ContextManager, count_tokens
+
+
+def report(step: int, page: bool) -> HumanMessage:
+    size = 40000 if page else 1500
+    text = (f"Step {step} findings. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * size)[:size]
+    return HumanMessage(content=text, name="web_scraper" if page else "search")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=60)
+    parser.add_argument("--page-every", type=int, default=5)
+    parser.add_argument("--max-tokens", type=int, default=8000)
+    args = parser.parse_args()
+
+    context = ContextManager(max_tokens=args.max_tokens)
+    messages = [HumanMessage(content="Research AI agents and write a brief report about them.")]
+
+    print(f"{'step':>5} {'full prompt (tokens)':>21} {'compacted (tokens)':>19} {'compaction (ms)':>16}")
+    for step in range(1, args.steps + 1):
+        messages.append(report(step, step % args.page_every == 0))
+        started = time.perf_counter()
+        compacted = context.compact(messages)
+        elapsed = (time.perf_counter() - started) * 1000
+        if step == 1 or step % 10 == 0:
+            full = sum(count_tokens(m) for m in messages)
+            kept = sum(count_tokens(m) for m in compacted)
+            print(f"{step:>5} {full:>21,} {kept:>19,} {elapsed:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""edit_document and read_document on a large report: the former file-based tools against the document store.
+
+All apply the same edits (--inserts line inserts at random places, per edit) and range reads
+to a report of --lines lines. "store" is the workspace as it runs: it saves behind, once for
+all the edits made within its spill delay. "store, save each" saves after every edit, as it
+does when edits come more than the spill delay apart; each save rewrites the file from the
+first changed line on, so about half of it for edits at random places, like "files" does.
+
+Usage (from the backend folder):
+
+    $ python -m bench.documents --lines 50000 --edits 300
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from workspace import LocalAsyncFileSystem, Workspace, _LocalFile
+
+
+class CountingFileSystem(LocalAsyncFileSystem):
+    written = 0
+
+    def open(self, path, mode="rb", **kwargs):
+        fs = self
+
+        class File(_LocalFile):
+            async def write(self, data: bytes) -> int:
+                fs.written += len(data)
+                return await super().write(data)
+
+        return File(path, mode)
+
+
+def make_edits(lines: int, edits: int, inserts: int, seed: int = 0) -> list[dict[int, str]]:
+    rng = random.Random(seed)
+    batches = []
+    for i in range(edits):
+        batches.append({rng.randint(1, lines + 1): f"Inserted paragraph {i}.{j}." for j in range(inserts)})
+        lines += len(batches[-1])
+    return batches
+
+
+def make_reads(lines: int, reads: int, span: int, seed: int = 1) -> list[tuple[int, int]]:
+    rng = random.Random(seed)
+    return [(start, start + span) for start in (rng.randint(0, lines - span) for _ in range(reads))]
+
+
+def files_before(path: str, edits: list[dict[int, str]], reads: list[tuple[int, int]]) -> tuple[float, float, int]:
+    # what the tools did before: whole-file reads and rewrites, one list.insert per line (from
+    # the last one, so that line numbers are those before the edit, as in the document store)
+    written = 0
+    started = time.perf_counter()
+    for inserts in edits:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        for line_number, text in sorted(inserts.items(), reverse=True):
+            lines.insert(line_number - 1, text + "\n")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        written += os.path.getsize(path)
+    edit_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for start, end in reads:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        "".join(lines[start:end])
+    return edit_time, time.perf_counter() - started, written
+
+
+async def document_store(
+    root: str, run: str, text: str, edits: list[dict[int, str]], reads: list[tuple[int, int]], save_each: bool
+) -> tuple[float, float, int]:
+    fs = CountingFileSystem(asynchronous=True)
+    workspace = Workspace(run, fs, root, max_bytes=2**31)
+    workspace.write("report.md", text)
+    await workspace.spill()
+    fs.written = 0
+
+    started = time.perf_counter()
+    for inserts in edits:
+        await workspace.edit("report.md", inserts)
+        if save_each:
+            await workspace.spill()
+    # otherwise saved once, as the workspace does when edits come faster than its spill delay
+    await workspace.spill()
+    edit_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for start, end in reads:
+        (await workspace.document("report.md")).read(start, end)
+    read_time = time.perf_counter() - started
+    await workspace.close()
+    return edit_time, read_time, fs.written
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=50000)
+    parser.add_argument("--line-chars", type=int, default=80)
+    parser.add_argument("--edits", type=int, default=300)
+    parser.add_argument("--inserts", type=int, default=3, help="lines inserted per edit")
+    parser.add_argument("--reads", type=int, default=300)
+    parser.add_argument("--read-lines", type=int, default=50)
+    args = parser.parse_args()
+
+    text = "".join(f"{i:06d} " + "x" * (args.line_chars - 8) + "\n" for i in range(args.lines))
+    edits = make_edits(args.lines, args.edits, args.inserts)
+    reads = make_reads(args.lines, args.reads, args.read_lines)
+    print(f"report of {args.lines} lines, {len(text) / 2**20:.1f} MB; {args.edits} edits, {args.reads} reads\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "report.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        results = {
+            "files": files_before(path, edits, reads),
+            "store": asyncio.run(document_store(tmp, "batched", text, edits, reads, save_each=False)),
+            "store, save each": asyncio.run(document_store(tmp, "each", text, edits, reads, save_each=True)),
+        }
+        with open(path, encoding="utf-8") as f:
+            expected = f.read()
+        for run in ("each", "batched"):
+            with open(os.path.join(tmp, run, "report.md"), encoding="utf-8") as f:
+                assert f.read() == expected, "the setups ended with different reports"
+
+    print(f"{'setup':>17} {'edit ms':>8} {'edits/s':>8} {'read ms':>8} {'reads/s':>8} {'MB written':>11}")
+    for name, (edit_time, read_time, written) in results.items():
+        print(
+            f"{name:>17} {edit_time / args.edits * 1000:>8.2f} {args.edits / edit_time:>8.0f}"
+            f" {read_time / args.reads * 1000:>8.3f} {args.reads / read_time:>8.0f} {written / 2**20:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""End-to-end benchmark of super_graph with no network, for catching performance regressions.
+
+The chat model is scripted (time to first token --latency, answers of --answer-tokens words
+streamed at --tokens-per-second, agents calling their tools), search and scraping are fakes with
+fixed latencies, and checkpoints and documents go to a temporary directory. For each concurrency
+level, that many runs are started at once, --repeat times, and the report gives latency, time to
+first streamed token, supervisor round-trips per run, streamed tokens/s and memory.
+
+With --json the results are saved; with --baseline they are compared to saved results, and the
+exit status is 1 when p50 latency or throughput is worse by more than --tolerance.
+
+Usage (from the backend folder):
+
+    $ python -m bench.e2e --concurrency 1 10 50 --json bench.json
+    $ python -m bench.e2e --concurrency 1 10 50 --baseline bench.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from uuid import uuid4
+
+from langchain_core.messages import AIMessageChunk
+
+from bench.fakes import FakeScraper, FakeSearchBackend, ScriptedChatModel
+from checkpoint import SqliteCheckpointer
+from graph import make_super_graph
+from paper_writing_team import make_paper_writing_graph
+from registry import registry
+from research_team import make_research_graph
+from routing import routing_stats
+from search import CachedSearch
+from workspace import LocalAsyncFileSystem, Workspaces
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm", encoding="ascii") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+async def run_one(graph) -> tuple[float, float, int]:
+    """Latency, time to first streamed token and number of streamed tokens of one run."""
+    started = time.perf_counter()
+    first_token = None
+    tokens = 0
+    async for msg, _ in graph.astream(
+        {"messages": [("user", "Research AI agents and write a brief report about them.")]},
+        {"recursion_limit": 150, "configurable": {"thread_id": uuid4().hex}},
+        stream_mode="messages",
+    ):
+        if isinstance(msg, AIMessageChunk) and msg.content:
+            tokens += 1
+            if first_token is None:
+                first_token = time.perf_counter() - started
+    latency = time.perf_counter() - started
+    return latency, first_token or latency, tokens
+
+
+async def run_level(graph, concurrency: int, repeat: int) -> dict[str, float]:
+    latencies: list[float] = []
+    ttfts: list[float] = []
+    tokens = 0
+    routing_stats.reset()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for latency, ttft, n in await asyncio.gather(*(run_one(graph) for _ in range(concurrency))):
+            latencies.append(latency)
+            ttfts.append(ttft)
+            tokens += n
+    wall = time.perf_counter() - started
+    runs = concurrency * repeat
+    round_trips = sum(sum(paths.values()) for paths in routing_stats.snapshot().values())
+    return {
+        "runs": runs,
+        "wall": wall,
+        "runs_per_s": runs / wall,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "ttft_p50": percentile(ttfts, 0.5),
+        "round_trips_per_run": round_trips / runs,
+        "tokens_per_s": tokens / wall,
+    }
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    regressions = []
+    for level, r in results.items():
+        base = baseline.get(level)
+        if base is None:
+            continue
+        if r["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append(f"concurrency {level}: p50 {r['p50']:.2f}s, was {base['p50']:.2f}s")
+        if r["runs_per_s"] < base["runs_per_s"] * (1 - tolerance):
+            regressions.append(f"concurrency {level}: {r['runs_per_s']:.1f} runs/s, was {base['runs_per_s']:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2, help="model time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--search-latency", type=float, default=0.3)
+    parser.add_argument("--scrape-latency", type=float, default=0.5)
+    parser.add_argument("--tracemalloc", action="store_true", help="report peak Python allocations (slower)")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare with results saved by --json")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # the JSON paths are given relative to where we were started
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        registry.set("workspaces", Workspaces(LocalAsyncFileSystem(asynchronous=True), tmp))
+        registry.set("search", CachedSearch(FakeSearchBackend(args.search_latency), ttl=0))
+        registry.set("scraper", FakeScraper(args.scrape_latency))
+        llm = ScriptedChatModel(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            answer_tokens=args.answer_tokens,
+            use_tools=True,
+        )
+        checkpointer = SqliteCheckpointer(os.path.join(tmp, "checkpoints.sqlite"))
+        graph = make_super_graph(
+            llm, make_research_graph(llm), make_paper_writing_graph(llm), checkpointer=checkpointer
+        )
+
+        print(
+            f"{'runs':>5} {'conc':>5} {'runs/s':>7} {'p50(s)':>7} {'p99(s)':>7} {'ttft(s)':>8} "
+            f"{'rt/run':>7} {'tok/s':>8} {'rss(MB)':>8} {'peak(MB)':>9}"
+        )
+        for concurrency in args.concurrency:
+            if args.tracemalloc:
+                tracemalloc.start()
+            r = asyncio.run(run_level(graph, concurrency, args.repeat))
+            r["rss_mb"] = rss_mb()
+            r["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            if args.tracemalloc:
+                r["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+            results[str(concurrency)] = r
+            print(
+                f"{r['runs']:>5} {concurrency:>5} {r['runs_per_s']:>7.2f} {r['p50']:>7.2f} {r['p99']:>7.2f} "
+                f"{r['ttft_p50']:>8.2f} {r['round_trips_per_run']:>7.1f} {r['tokens_per_s']:>8.0f} "
+                f"{r['rss_mb']:>8.0f} {r.get('traced_peak_mb', 0):>9.1f}"
+            )
+        checkpointer.close()
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Offline stand-ins for the chat model and the tool backends, so the graphs can be exercised without network access."""
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from scraper import Page
+
+
+class ScriptedChatModel(BaseChatModel):
+    """A chat model that answers with a fixed script after a configurable delay.
+
+    Router calls (a bound ``Router`` or ``ParallelRouter`` tool) walk through the offered workers
+    in order, all remaining ones at once for ``ParallelRouter``, and then return FINISH; every other call returns a plain answer so react agents stop after one step.
+    With ``blocking=True`` the async path sleeps synchronously, mimicking a node that blocks the loop.
+
+    ``latency`` is the time to first token. With ``tokens_per_second``, answers are
+    ``answer_tokens`` words long and streamed at that rate. With ``use_tools``, an agent's first
+    call goes to its first tool, with arguments made up from the tool's schema. Replies report
+    token usage, counting one token per four characters, under the model name ``model``.
+    """
+
+    model: str = "scripted"
+    latency: float = 0.05
+    blocking: bool = False
+    answer: str = "Stub answer."
+    tokens_per_second: float = 0.0
+    answer_tokens: int = 0
+    use_tools: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _respond(self, messages: list[BaseMessage], tools: Optional[list[dict]]) -> AIMessage:
+        router = next((t["function"] for t in tools or [] if t["function"]["name"] in ("Router", "ParallelRouter")), None)
+        if router is None:
+            if self.use_tools and tools and not any(isinstance(m, ToolMessage) for m in messages):
+                tool = tools[0]["function"]
+                return self._with_usage(
+                    messages,
+                    AIMessage(
+                        content="",
+                        tool_calls=[{"name": tool["name"], "args": fake_args(tool["parameters"]), "id": f"call_{len(messages)}"}],
+                    ),
+                )
+            return self._with_usage(messages, AIMessage(content=self._answer()))
+
+        schema = router["parameters"]["properties"]["next"]
+        reported = {m.name for m in messages if m.name}
+        pending = [o for o in schema.get("enum") or schema["items"]["enum"] if o != "FINISH" and o not in reported]
+        if router["name"] == "ParallelRouter":
+            goto = pending or ["FINISH"]
+        else:
+            goto = pending[0] if pending else "FINISH"
+        return self._with_usage(
+            messages,
+            AIMessage(
+                content="",
+                tool_calls=[{"name": router["name"], "args": {"next": goto}, "id": f"call_{len(messages)}"}],
+            ),
+        )
+
+    def _answer(self) -> str:
+        if not self.answer_tokens:
+            return self.answer
+        words = (self.answer.split() or ["token"]) * self.answer_tokens
+        return " ".join(words[: self.answer_tokens])
+
+    @staticmethod
+    def _with_usage(messages: list[BaseMessage], message: AIMessage) -> AIMessage:
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = max(1, len(str(message.content)) // 4)
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        return message
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, kwargs.get("tools")))])
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+        message = self._respond(messages, kwargs.get("tools"))
+        if message.tool_calls or not self.tokens_per_second:
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=message.content,
+                    tool_call_chunks=[
+                        {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                        for i, c in enumerate(message.tool_calls)
+                    ],
+                    usage_metadata=message.usage_metadata,
+                )
+            )
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = AIMessageChunk(content=word if i == 0 else " " + word)
+            if i == len(words) - 1:
+                chunk.usage_metadata = message.usage_metadata
+            yield ChatGenerationChunk(message=chunk)
+
+
+def fake_args(schema: dict[str, Any]) -> dict[str, Any]:
+    """Arguments that satisfy a tool's JSON schema, for the required properties."""
+
+    def value(name: str, prop: dict[str, Any]) -> Any:
+        kind = prop.get("type")
+        if kind == "array":
+            return [value(name, prop.get("items", {}))]
+        if kind == "object":
+            return {}
+        if kind in ("integer", "number"):
+            return 1
+        if kind == "boolean":
+            return False
+        if "url" in name:
+            return "https://example.com/bench"
+        if "file" in name:
+            return "bench.txt"
+        return "bench"
+
+    props = schema.get("properties", {})
+    return {name: value(name.lower(), props[name]) for name in schema.get("required", props)}
+
+
+class FakeSearchBackend:
+    """A search backend answering every query with canned results after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.calls = 0
+
+    async def search(self, query: str, max_results: int) -> list[dict[str, str]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [
+            {"url": f"https://example.com/{i}", "content": f"Result {i} for {query}."}
+            for i in range(max_results)
+        ]
+
+
+class FakeScraper:
+    """Stands in for scraper.Scraper: every page is ``page_chars`` of text after ``latency`` seconds."""
+
+    def __init__(self, latency: float = 0.3, page_chars: int = 4000):
+        self.latency = latency
+        self.page_chars = page_chars
+        self.calls = 0
+
+    async def scrape(self, urls: list[str]) -> list[Page]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        text = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (self.page_chars // 56 + 1))[: self.page_chars]
+        return [Page(url=url, title=f"Page {i}", text=text) for i, url in enumerate(dict.fromkeys(urls))]
+
+    async def aclose(self):
+        pass
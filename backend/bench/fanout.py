@@ -0,0 +1,71 @@
+"""Wall-clock gain of the parallel fan-out supervisor over the one-worker-at-a-time router.
+
+Workers are fake nodes that sleep for ``--worker-latency`` seconds and report back, so the
+numbers isolate the routing pattern from model and tool behaviour.
+
+Usage (from the backend folder):
+
+    $ python -m bench.fanout --workers 2 3 4 --worker-latency 0.5
+"""
+import argparse
+import asyncio
+import time
+from typing import Literal
+
+from langchain_core.messages import HumanMessage
+from langgraph.graph import StateGraph, MessagesState, START
+from langgraph.types import Command
+
+from bench.fakes import ScriptedChatModel
+from tools import make_supervisor_node
+
+
+def make_sleeping_worker(name: str, latency: float):
+    async def worker_node(state: MessagesState) -> Command[Literal["supervisor"]]:
+        await asyncio.sleep(latency)
+        return Command(
+            update={"messages": [HumanMessage(content=f"{name} done", name=name)]},
+            goto="supervisor",
+        )
+
+    return worker_node
+
+
+def make_graph(n_workers: int, worker_latency: float, router_latency: float, parallel: bool):
+    members = [f"worker_{i}" for i in range(n_workers)]
+    llm = ScriptedChatModel(latency=router_latency)
+
+    builder = StateGraph(MessagesState)
+    builder.add_node("supervisor", make_supervisor_node(llm, members, parallel=parallel))
+    for member in members:
+        builder.add_node(member, make_sleeping_worker(member, worker_latency))
+    builder.add_edge(START, "supervisor")
+    return builder.compile()
+
+
+async def measure(graph) -> tuple[float, int]:
+    started = time.perf_counter()
+    result = await graph.ainvoke({"messages": [("user", "question")]}, {"recursion_limit": 150})
+    return time.perf_counter() - started, len(result["messages"]) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--worker-latency", type=float, default=0.5)
+    parser.add_argument("--router-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'sequential(s)':>14} {'parallel(s)':>12} {'speedup':>8}")
+    for n in args.workers:
+        results = {}
+        for parallel in (False, True):
+            graph = make_graph(n, args.worker_latency, args.router_latency, parallel)
+            elapsed, reports = asyncio.run(measure(graph))
+            assert reports == n, f"expected {n} worker reports, got {reports}"
+            results[parallel] = elapsed
+        print(f"{n:>7} {results[False]:>14.2f} {results[True]:>12.2f} {results[False] / results[True]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Time to first byte of a streamed answer: answer tokens only against answer tokens and tool events.
+
+Runs super_graph with a scripted model (agents calling fake search and scrape tools) through
+streaming.message_events and records, per run, when the first event of each kind reached the
+client. Before tool events, a client's first byte was the first "delta".
+
+Usage (from the backend folder):
+
+    $ python -m bench.first_event --runs 10 --latency 0.2 --search-latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from uuid import uuid4
+
+from bench.e2e import percentile
+from bench.fakes import FakeScraper, FakeSearchBackend, ScriptedChatModel
+from checkpoint import SqliteCheckpointer
+from graph import make_super_graph, run_config
+from paper_writing_team import make_paper_writing_graph
+from registry import registry
+from research_team import make_research_graph
+from search import CachedSearch
+from streaming import message_events
+from workspace import LocalAsyncFileSystem, Workspaces
+
+
+async def run_one(graph) -> dict[str, float]:
+    """Seconds to the first event of each type, and to the end of the run ("total")."""
+    started = time.perf_counter()
+    first: dict[str, float] = {}
+    stream = graph.astream(
+        {"messages": [("user", "Research AI agents and write a brief report about them.")]},
+        run_config(uuid4().hex),
+        stream_mode="messages",
+    )
+    async for event in message_events(stream):
+        first.setdefault("any", time.perf_counter() - started)
+        first.setdefault(event["type"], time.perf_counter() - started)
+    first["total"] = time.perf_counter() - started
+    return first
+
+
+async def run_all(graph, runs: int) -> list[dict[str, float]]:
+    return [await run_one(graph) for _ in range(runs)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="model time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--search-latency", type=float, default=0.5)
+    parser.add_argument("--scrape-latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    llm = ScriptedChatModel(latency=args.latency, tokens_per_second=args.tokens_per_second, use_tools=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        registry.set("search", CachedSearch(FakeSearchBackend(args.search_latency), ttl=0))
+        registry.set("scraper", FakeScraper(args.scrape_latency))
+        registry.set("workspaces", Workspaces(LocalAsyncFileSystem(asynchronous=True), tmp))
+        graph = make_super_graph(
+            llm,
+            make_research_graph(llm),
+            make_paper_writing_graph(llm),
+            checkpointer=SqliteCheckpointer(os.path.join(tmp, "checkpoints.sqlite")),
+        )
+        results = asyncio.run(run_all(graph, args.runs))
+
+    print(f"{args.runs} runs\n")
+    print(f"{'first event':>13} {'p50 s':>7} {'p95 s':>7}")
+    kinds = {"delta": "answer token", "any": "any", "tool_call": "tool_call", "tool_result": "tool_result"}
+    for kind, label in {**kinds, "total": "(run done)"}.items():
+        values = [r[kind] for r in results if kind in r]
+        print(f"{label:>13} {percentile(values, 0.5):>7.2f} {percentile(values, 0.95):>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Cold start: import time of the backend modules, and the cost of building the graphs on first use.
+
+Each module is imported in a fresh interpreter under ``python -X importtime``; the report lists
+the wall time and the packages and modules that account for most of it.
+
+Usage (from the backend folder):
+
+    $ python -m bench.importtime api graph --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+BUILD = """
+import time
+from graph import get_super_graph
+started = time.perf_counter()
+get_super_graph()
+print(time.perf_counter() - started)
+"""
+
+
+def env() -> dict[str, str]:
+    return {"OPENAI_API_KEY": "x", "TAVILY_API_KEY": "x", **os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+
+
+def import_times(module: str) -> tuple[float, list[tuple[str, int, int]]]:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env(), check=True,
+    )
+    wall = time.perf_counter() - started
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return wall, rows
+
+
+def build_time() -> float:
+    proc = subprocess.run(
+        [sys.executable, "-c", BUILD], capture_output=True, text=True, env=env(), check=True
+    )
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=["api"])
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        wall, rows = import_times(module)
+        total = sum(self_us for _, self_us, _ in rows)
+        packages: dict[str, int] = defaultdict(int)
+        for name, self_us, _ in rows:
+            packages[name.split(".")[0]] += self_us
+
+        print(f"\nimport {module}: {wall:.2f}s wall (interpreter included), {total / 1e6:.2f}s importing {len(rows)} modules")
+        print(f"  {'package':<32} {'self (ms)':>10}")
+        for name, self_us in sorted(packages.items(), key=lambda p: -p[1])[: args.top]:
+            print(f"  {name:<32} {self_us / 1000:>10.1f}")
+        print(f"  {'module':<48} {'self (ms)':>10} {'cumulative (ms)':>16}")
+        for name, self_us, cumulative_us in sorted(rows, key=lambda r: -r[1])[: args.top]:
+            print(f"  {name:<48} {self_us / 1000:>10.1f} {cumulative_us / 1000:>16.1f}")
+
+    print(f"\nfirst get_super_graph(), after import (models, tools and graphs built): {build_time():.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""What the research agents read: whole scraped pages against passages from the run's index.
+
+--pages pages of --page-chars characters of made-up text are scraped, each holding one fact.
+"pages" is what scrape_webpages returned before: every page in full. "index" is what an
+agent reads now: the scrape summary plus the --k passages retrieve returns for a question
+about each fact. Recall is the share of those questions whose fact is among the passages.
+Indexing and search speed are measured on an index of --index-mb of text.
+
+Usage (from the backend folder):
+
+    $ python -m bench.retrieval --pages 5 --page-chars 20000 --index-mb 20
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from bench.e2e import percentile
+from registry import registry
+from retrieval import RunIndex
+from scraper import Page
+from tools import retrieve, scrape_webpages
+from workspace import Workspaces
+
+CHARS_PER_TOKEN = 4
+
+
+def make_words(n: int, rng: random.Random) -> list[str]:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(n)]
+
+
+def make_text(chars: int, words: list[str], rng: random.Random) -> str:
+    # Zipf-like word frequencies, sentences of 8 to 20 words, paragraphs of 3 to 6 sentences
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+    out: list[str] = []
+    size = 0
+    while size < chars:
+        paragraph = " ".join(
+            " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(8, 20))).capitalize() + "."
+            for _ in range(rng.randint(3, 6))
+        )
+        out.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(out)[:chars]
+
+
+class BenchScraper:
+    def __init__(self, pages: dict[str, Page]):
+        self.pages = pages
+
+    async def scrape(self, urls: list[str]) -> list[Page]:
+        return [self.pages[url] for url in urls]
+
+
+async def reading(pages: dict[str, Page], facts: dict[str, str], k: int) -> tuple[int, int, float]:
+    """Tokens read with whole pages, tokens read with the index, and recall."""
+    before = "\n\n".join(
+        f'<Document name="{page.title}" url="{page.url}">\n{page.text}\n</Document>' for page in pages.values()
+    )
+    config = {"configurable": {"thread_id": "bench"}}
+    after = await scrape_webpages.ainvoke({"urls": list(pages)}, config)
+    hits = 0
+    for url, fact in facts.items():
+        # asked in other words than the fact's, as an agent would
+        words = fact.rstrip(".").split()
+        passages = await retrieve.ainvoke({"query": f"what is {words[1]} {words[2]} and {words[-1]}", "k": k}, config)
+        after += passages
+        hits += fact in passages and url in passages
+    return len(before) // CHARS_PER_TOKEN, len(after) // CHARS_PER_TOKEN, hits / len(facts)
+
+
+async def speed(text: str, searches: int, words: list[str], rng: random.Random) -> tuple[float, list[float], dict]:
+    index = RunIndex()
+    started = time.perf_counter()
+    page_chars = 20000
+    for i in range(0, len(text), page_chars):
+        index.add(f"https://example.com/{i}", f"Page {i}", text[i : i + page_chars])
+    await index.search("warm up")  # merges the postings
+    index_time = time.perf_counter() - started
+    times = []
+    for _ in range(searches):
+        query = " ".join(rng.choices(words[:2000], k=5))
+        started = time.perf_counter()
+        await index.search(query, 5)
+        times.append(time.perf_counter() - started)
+    return index_time, times, index.metrics()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--page-chars", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--index-mb", type=float, default=20)
+    parser.add_argument("--searches", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = make_words(20000, rng)
+    pages, facts = {}, {}
+    for i in range(args.pages):
+        url = f"https://example.com/page{i}"
+        fact = f"The {rng.choice(words)} {rng.choice(words)} of {url} was measured at {rng.randint(1000, 9999)} {rng.choice(words)}."
+        text = make_text(args.page_chars, words, rng)
+        cut = rng.randrange(len(text) // 2)
+        cut = text.find(". ", cut) + 2
+        pages[url] = Page(url=url, title=f"Page {i}", text=text[:cut] + fact + " " + text[cut:])
+        facts[url] = fact
+
+    registry.set("scraper", BenchScraper(pages))
+    registry.set("workspaces", Workspaces())
+    before, after, recall = asyncio.run(reading(pages, facts, args.k))
+    print(f"{args.pages} pages of {args.page_chars} characters, one question per page, k={args.k}\n")
+    print(f"{'read':>6} {'tokens':>8}")
+    print(f"{'pages':>6} {before:>8}")
+    print(f"{'index':>6} {after:>8}   ({after / before:.0%}, recall {recall:.0%})\n")
+
+    text = make_text(int(args.index_mb * 2**20), words, rng)
+    index_time, times, metrics = asyncio.run(speed(text, args.searches, words, rng))
+    print(f"index of {args.index_mb:.0f} MB: {metrics['passages']} passages, {metrics['terms']} terms, {metrics['bytes'] / 2**20:.1f} MB of arrays")
+    print(f"  indexed at {args.index_mb / index_time:.1f} MB/s; search p50 {percentile(times, 0.5) * 1000:.2f} ms, p99 {percentile(times, 0.99) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
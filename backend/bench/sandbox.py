@@ -0,0 +1,112 @@
+"""Chart code run in the server process (PythonREPL, as python_repl_tool used to) against the sandbox pool.
+
+Runs --calls chart scripts, --concurrency at a time, while a ticker measures how late the event
+loop wakes up; the lag is what every other stream served by the process would see.
+
+Usage (from the backend folder):
+
+    $ python -m bench.sandbox --calls 8 --concurrency 1 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sandbox import SandboxPool
+
+CHART = """
+import numpy as np
+import matplotlib.pyplot as plt
+
+values = np.random.default_rng({seed}).normal(size=200_000)
+total = 0.0
+for v in values[:{loop}]:
+    total += v * v
+fig, ax = plt.subplots()
+ax.hist(values, bins=100)
+ax.set_title("{seed}")
+fig.savefig("chart_{seed}.png")
+print(round(total, 3))
+"""
+
+
+async def measure(run, calls: int, concurrency: int, loop: int) -> dict:
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(seed: int):
+        async with limit:
+            started = time.perf_counter()
+            await run(CHART.format(seed=seed, loop=loop))
+            latencies.append(time.perf_counter() - started)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(seed) for seed in range(calls)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+    lags.sort()
+    latencies.sort()
+    return {
+        "elapsed": elapsed,
+        "p50": latencies[len(latencies) // 2],
+        "lag_p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000 if lags else 0.0,
+        "lag_max": lags[-1] * 1000 if lags else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--workers", type=int, default=2, help="sandbox pool size")
+    parser.add_argument("--loop", type=int, default=200_000, help="iterations of pure-Python work per script")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+
+        # as before: one REPL in the server process, called from the tool's worker thread
+        started = time.perf_counter()
+        from langchain_experimental.utilities import PythonREPL  # pylint: disable=import-outside-toplevel
+
+        repl = PythonREPL()
+        repl.run("import numpy, matplotlib.pyplot")
+        print(f"in-process REPL ready in {time.perf_counter() - started:.2f}s (imports on first use)")
+
+        started = time.perf_counter()
+        pool = SandboxPool(size=args.workers)
+        pool.run("pass", tmp)
+        print(f"sandbox pool of {args.workers} ready in {time.perf_counter() - started:.2f}s (started with the server)\n")
+
+        setups = {
+            "in-process": lambda code: asyncio.to_thread(repl.run, code),
+            "sandbox": lambda code: pool.arun(code, tmp),
+        }
+        print(f"{'setup':>11} {'concurrency':>11} {'elapsed s':>10} {'call p50 s':>10} {'lag p99 ms':>10} {'lag max ms':>10}")
+        for concurrency in args.concurrency:
+            for name, run in setups.items():
+                r = asyncio.run(measure(run, args.calls, concurrency, args.loop))
+                # concurrent PythonREPL calls swap sys.stdout under each other and can leave it captured
+                sys.stdout = sys.__stdout__
+                print(
+                    f"{name:>11} {concurrency:>11} {r['elapsed']:>10.2f} {r['p50']:>10.2f}"
+                    f" {r['lag_p99']:>10.1f} {r['lag_max']:>10.1f}"
+                )
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
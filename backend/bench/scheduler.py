@@ -0,0 +1,124 @@
+"""Latency of concurrent runs against a rate-limited provider, with and without the scheduler.
+
+The provider answers at most --provider-rpm requests per minute, enforced per second the way
+OpenAI enforces its limits, and refuses the rest with a 429.
+Like the OpenAI client, the model then retries twice with exponential backoff, and the run fails
+when the retries run out. With the scheduler in front, calls queue locally at a budget a little
+under the provider's limit instead.
+
+Usage (from the backend folder):
+
+    $ python -m bench.scheduler --runs 40 --provider-rpm 600
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Optional
+from uuid import uuid4
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+from bench.fakes import ScriptedChatModel
+from graph import make_super_graph
+from paper_writing_team import make_paper_writing_graph
+from research_team import make_research_graph
+from scheduler import Scheduler
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class Provider:
+    """Admits at most ``rpm / 60`` requests in any sliding second."""
+
+    def __init__(self, rpm: float):
+        self.per_second = max(1, int(rpm / 60))
+        self.window: deque[float] = deque()
+        self.refused = 0
+
+    def admit(self) -> bool:
+        now = time.monotonic()
+        while self.window and self.window[0] <= now - 1:
+            self.window.popleft()
+        if len(self.window) >= self.per_second:
+            self.refused += 1
+            return False
+        self.window.append(now)
+        return True
+
+
+class ThrottledChatModel(ScriptedChatModel):
+    provider: Any = None
+    max_retries: int = 2
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        for attempt in range(self.max_retries + 1):
+            if self.provider.admit():
+                return await super()._agenerate(messages, stop, run_manager, **kwargs)
+            if attempt < self.max_retries:
+                await asyncio.sleep(min(8.0, 0.5 * 2**attempt) * (1 + 0.25 * random.random()))
+        raise RateLimitError("429 Too Many Requests")
+
+
+async def run_one(graph) -> Optional[float]:
+    started = time.perf_counter()
+    try:
+        await graph.ainvoke(
+            {"messages": [("user", "Research AI agents and write a brief report about them.")]},
+            {"recursion_limit": 150, "configurable": {"thread_id": uuid4().hex}},
+        )
+    except RateLimitError:
+        return None
+    return time.perf_counter() - started
+
+
+async def run(args, scheduled: bool):
+    provider = Provider(args.provider_rpm)
+    scheduler = Scheduler("bench", requests_per_minute=args.provider_rpm * 0.9) if scheduled else None
+    llm = ThrottledChatModel(latency=args.latency, provider=provider, rate_limiter=scheduler)
+    graph = make_super_graph(llm, make_research_graph(llm), make_paper_writing_graph(llm))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_one(graph) for _ in range(args.runs)))
+    wall = time.perf_counter() - started
+    latencies = sorted(r for r in results if r is not None)
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0
+    print(
+        f"{'scheduler' if scheduled else 'none':>10} {len(latencies):>5}/{args.runs:<4} {wall:>8.1f} "
+        f"{p50:>8.1f} {p99:>8.1f} {provider.refused:>6}"
+    )
+    if scheduler is not None:
+        m = scheduler.metrics()
+        print(
+            f"{'':>10} queued {m.get('queued', 0)} of {m['admitted']} calls, max depth {m['max_queue_depth']}, "
+            f"wait p50 {m['wait_p50']:.2f}s p99 {m['wait_p99']:.2f}s, "
+            f"in-progress/new admissions {m.get('admitted_in_progress', 0)}/{m.get('admitted_new', 0)}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=40)
+    parser.add_argument("--provider-rpm", type=float, default=600)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'scheduler':>10} {'ok/runs':>10} {'wall(s)':>8} {'p50(s)':>8} {'p99(s)':>8} {'429s':>6}")
+    asyncio.run(run(args, scheduled=False))
+    asyncio.run(run(args, scheduled=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""scrape_webpages: the old sequential WebBaseLoader against the concurrent, cached Scraper.
+
+A local HTTP server stands in for the web: /slow/<i> pages answer after --slow-delay seconds,
+/large/<i> pages are several MB of markup mostly made of navigation and scripts. Every page
+carries an ETag, so a second Scraper pass is answered with 304s.
+
+Usage (from the backend folder):
+
+    $ python -m bench.scrape --slow 8 --large 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scraper import PageStore, Scraper
+
+_NAV = "<nav>" + "".join(f'<a href="/p{i}">Menu item {i}</a>' for i in range(200)) + "</nav>"
+_SCRIPT = "<script>" + "var x = 1;" * 20000 + "</script>"
+
+
+def make_page(i: int, large: bool) -> bytes:
+    paragraphs = 400 if large else 20
+    body = "".join(f"<p>Paragraph {n} of page {i}: some actual content worth reading.</p>" for n in range(paragraphs))
+    extra = (_NAV + _SCRIPT) * 10 if large else _NAV
+    return (
+        f"<html><head><title>Page {i}</title>{_SCRIPT if large else ''}</head>"
+        f"<body><header>Site header</header>{extra}<main>{body}</main><footer>Footer</footer></body></html>"
+    ).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    slow_delay = 0.5
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        kind, _, i = self.path.strip("/").partition("/")
+        etag = f'"{kind}-{i}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        if kind == "slow":
+            time.sleep(self.slow_delay)
+        body = make_page(int(i), large=kind == "large")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def run_web_base_loader(urls: list[str]) -> tuple[float, int]:
+    from langchain_community.document_loaders import WebBaseLoader  # pylint: disable=import-outside-toplevel
+
+    started = time.perf_counter()
+    docs = WebBaseLoader(urls).load()
+    return time.perf_counter() - started, sum(len(d.page_content) for d in docs)
+
+
+async def run_scraper(scraper: Scraper, urls: list[str]) -> tuple[float, int]:
+    started = time.perf_counter()
+    pages = await scraper.scrape(urls)
+    elapsed = time.perf_counter() - started
+    assert not any(p.error for p in pages), [p.error for p in pages if p.error]
+    return elapsed, sum(len(p.text) for p in pages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slow", type=int, default=8)
+    parser.add_argument("--large", type=int, default=4)
+    parser.add_argument("--slow-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    Handler.slow_delay = args.slow_delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/slow/{i}" for i in range(args.slow)] + [f"{base}/large/{i}" for i in range(args.large)]
+    os.environ["NO_PROXY"] = "127.0.0.1"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scraper = Scraper(PageStore(os.path.join(tmp, "pages.sqlite")))
+
+        async def scraper_passes():
+            cold = await run_scraper(scraper, urls)
+            warm = await run_scraper(scraper, urls)
+            await scraper.aclose()
+            return cold, warm
+
+        old = run_web_base_loader(urls)
+        cold, warm = asyncio.run(scraper_passes())
+
+    print(f"{len(urls)} pages ({args.slow} slow, {args.large} large)")
+    print(f"{'':<24} {'wall(s)':>8} {'chars returned':>15}")
+    print(f"{'WebBaseLoader':<24} {old[0]:>8.2f} {old[1]:>15,}")
+    print(f"{'Scraper (cold)':<24} {cold[0]:>8.2f} {cold[1]:>15,}")
+    print(f"{'Scraper (revalidated)':<24} {warm[0]:>8.2f} {warm[1]:>15,}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""The API with the scripted chat model and search backend in place of OpenAI and Tavily.
+
+Used by bench.workers as the app of each uvicorn worker; BENCH_LATENCY sets the seconds per
+model call.
+
+    $ WORKERS=4 python -m uvicorn bench.serve:fastapi_app --workers 4
+"""
+import os
+
+from bench.fakes import FakeSearchBackend, ScriptedChatModel
+from registry import registry
+from search import CachedSearch
+
+registry.set("llm", ScriptedChatModel(latency=float(os.environ.get("BENCH_LATENCY", "0.05"))))
+registry.set("search", CachedSearch(FakeSearchBackend()))
+
+from api import fastapi_app  # pylint: disable=wrong-import-position,unused-import
@@ -0,0 +1,97 @@
+"""Starting the research team while the top supervisor decides: latency, hit rate and waste.
+
+The scripted top supervisor sends a question to the research team first, except for a share
+--miss-rate of them, which go to the writing team first (mispredictions). Each setup runs
+--runs questions one after the other; speculation starts once --min-samples routing
+decisions have been seen.
+
+Usage (from the backend folder):
+
+    $ python -m bench.speculation --runs 30 --miss-rate 0 0.2
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from uuid import uuid4
+
+from bench.e2e import percentile
+from bench.fakes import FakeScraper, FakeSearchBackend, ScriptedChatModel
+from checkpoint import SqliteCheckpointer
+from graph import make_super_graph, run_config
+from paper_writing_team import make_paper_writing_graph
+from registry import registry
+from research_team import make_research_graph
+from routing import routing_stats
+from search import CachedSearch
+from speculation import Speculation
+from workspace import Workspaces
+
+
+class DivertingChatModel(ScriptedChatModel):
+    """Routes the first turn of the top supervisor to the writing team a share ``miss_rate`` of the time."""
+
+    miss_rate: float = 0.0
+    seed: int = 0
+
+    def _respond(self, messages, tools):
+        router = next((t["function"] for t in tools or [] if t["function"]["name"] == "Router"), None)
+        if router is not None and not any(m.name for m in messages):
+            options = router["parameters"]["properties"]["next"]["enum"]
+            # one draw per question, the same whichever setup asks
+            if "writing_team" in options and random.Random(f"{self.seed}:{messages[-1].content}").random() < self.miss_rate:
+                message = super()._respond(messages, tools)
+                message.tool_calls[0]["args"] = {"next": "writing_team"}
+                return message
+        return super()._respond(messages, tools)
+
+
+async def run_all(graph, runs: int) -> list[float]:
+    latencies = []
+    for i in range(runs):
+        started = time.perf_counter()
+        await graph.ainvoke({"messages": [("user", f"Question {i}: research AI agents and write a report.")]}, run_config(uuid4().hex))
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--miss-rate", type=float, nargs="+", default=[0.0, 0.2])
+    parser.add_argument("--router-latency", type=float, default=0.8, help="model time to first token (s)")
+    parser.add_argument("--min-samples", type=int, default=5)
+    parser.add_argument("--min-probability", type=float, default=0.7)
+    args = parser.parse_args()
+
+    print(f"{args.runs} runs; speculation after {args.min_samples} decisions at {args.min_probability:.0%} or more\n")
+    print(f"{'miss rate':>9} {'setup':>12} {'p50 s':>7} {'mean s':>7} {'started':>8} {'hit rate':>9} {'wasted s':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        registry.set("search", CachedSearch(FakeSearchBackend(0.2), ttl=0))
+        registry.set("scraper", FakeScraper(0.3))
+        registry.set("workspaces", Workspaces())
+        checkpointer = SqliteCheckpointer(os.path.join(tmp, "checkpoints.sqlite"))
+        for miss_rate in args.miss_rate:
+            llm = DivertingChatModel(latency=args.router_latency, use_tools=True, miss_rate=miss_rate)
+            for name in ("off", "speculative"):
+                routing_stats.reset()
+                speculation = Speculation(routing_stats, args.min_samples, args.min_probability)
+                graph = make_super_graph(
+                    llm,
+                    make_research_graph(llm),
+                    make_paper_writing_graph(llm),
+                    checkpointer=checkpointer,
+                    speculation=speculation if name == "speculative" else None,
+                )
+                latencies = asyncio.run(run_all(graph, args.runs))
+                m = speculation.metrics()
+                print(
+                    f"{miss_rate:>9.0%} {name:>12} {percentile(latencies, 0.5):>7.2f} {sum(latencies) / len(latencies):>7.2f}"
+                    f" {m.get('started', 0):>8} {m['hit_rate']:>9.0%} {m['wasted_seconds']:>9.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
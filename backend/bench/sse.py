@@ -0,0 +1,96 @@
+"""SSE framing cost: one frame per token (the previous answer stream) versus coalesced JSON frames.
+
+A synthetic messages stream of --tokens chunks, spread over a few graph namespaces, is produced
+at --rate tokens per second (0 = as fast as possible) and framed both ways. Both check for
+client disconnects the way they do in the API: the legacy stream on every frame, the coalesced
+stream on a timer.
+
+Usage (from the backend folder):
+
+    $ python -m bench.sse --tokens 20000 --rate 0 2000
+"""
+import argparse
+import asyncio
+import time
+
+from langchain_core.messages import AIMessageChunk
+
+from streaming import message_events, sse_frames
+
+NAMESPACES = [
+    "research_team:1f0e|search:2a9c|agent:91b0",
+    "research_team:1f0e|web_scraper:77d1|agent:03fa",
+    "writing_team:5b3a|note_taker:c01e|agent:6d2e",
+]
+
+
+def make_chunks(tokens: int):
+    chunks = []
+    for i in range(tokens):
+        ns = NAMESPACES[(i // 200) % len(NAMESPACES)]
+        meta = {"checkpoint_ns": ns.split("|")[0], "langgraph_checkpoint_ns": ns, "langgraph_node": "agent"}
+        chunks.append((AIMessageChunk(content=" token\n" if i % 20 == 19 else " token", id=ns), meta))
+    return chunks
+
+
+async def token_stream(chunks, rate: float):
+    for i, chunk in enumerate(chunks):
+        if rate and i % 10 == 0:
+            await asyncio.sleep(10 / rate)
+        yield chunk
+
+
+async def is_disconnected() -> bool:
+    # what Request.is_disconnected costs when nothing was received: a trip through the loop
+    await asyncio.sleep(0)
+    return False
+
+
+async def legacy_frames(stream):
+    async for messages in stream:
+        for msg in messages:
+            if isinstance(msg, AIMessageChunk) and msg.content:
+                if await is_disconnected():
+                    return
+                escaped_content = msg.content.replace("\n", "\\n")
+                yield f"data: {escaped_content}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+async def run(name: str, frames, tokens: int):
+    count = size = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    async for frame in frames:
+        count += 1
+        size += len(frame)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    print(
+        f"{name:>10} {count:>8} {count / wall:>11.0f} {size / 1024:>10.0f} "
+        f"{cpu / tokens * 1e6:>14.2f} {wall:>9.2f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--rate", type=float, nargs="+", default=[0, 2000])
+    parser.add_argument("--frame-chars", type=int, default=512)
+    parser.add_argument("--frame-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.tokens)
+    for rate in args.rate:
+        print(f"\n{args.tokens} tokens at {f'{rate:.0f}/s' if rate else 'full speed'}")
+        print(f"{'framing':>10} {'frames':>8} {'frames/s':>11} {'bytes (KB)':>10} {'CPU/token (us)':>14} {'wall (s)':>9}")
+        await run("legacy", legacy_frames(token_stream(chunks, rate)), args.tokens)
+        frames = sse_frames(
+            message_events(token_stream(chunks, rate)),
+            max_chars=args.frame_chars,
+            max_delay=args.frame_delay,
+            is_disconnected=is_disconnected,
+        )
+        await run("coalesced", frames, args.tokens)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""Latency and cost of super_graph runs by model tier assignment.
+
+Two scripted models stand in for the tiers: "large" (--large-latency to first token,
+--large-rate tokens/s, priced as settings.llm_model) and "small" (faster, priced as
+settings.llm_small_model). Each setup assigns the roles to tiers and runs --runs questions,
+--concurrency at a time; the last one slows the large model down to --slow-latency, past
+--slo, to show the fallback to the small tier.
+
+Usage (from the backend folder):
+
+    $ python -m bench.tiers --runs 20 --concurrency 5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from collections import defaultdict
+from uuid import uuid4
+
+from bench.e2e import percentile
+from bench.fakes import FakeScraper, FakeSearchBackend, ScriptedChatModel
+from checkpoint import SqliteCheckpointer
+from graph import make_super_graph, run_config
+from paper_writing_team import make_paper_writing_graph
+from registry import registry
+from research_team import make_research_graph
+from search import CachedSearch
+from settings import settings
+from tiers import ModelTiers, Tier
+from tracing import Tracer
+from workspace import LocalAsyncFileSystem, Workspaces
+
+ALL_LARGE = {"router": "large", "research": "large", "notes": "large", "writer": "large"}
+TIERED = {
+    "router": settings.llm_router_tier,
+    "research": settings.llm_research_tier,
+    "notes": settings.llm_notes_tier,
+    "writer": settings.llm_writer_tier,
+}
+ALL_SMALL = {"router": "small", "research": "small", "notes": "small", "writer": "small"}
+
+
+async def run_all(graph, runs: int, concurrency: int) -> list[float]:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one() -> float:
+        async with slots:
+            started = time.perf_counter()
+            # streamed, as the API runs them, so that answers take their time to generate
+            async for _ in graph.astream(
+                {"messages": [("user", "Research AI agents and write a brief report about them.")]},
+                run_config(uuid4().hex),
+                stream_mode="messages",
+            ):
+                pass
+            return time.perf_counter() - started
+
+    return await asyncio.gather(*(one() for _ in range(runs)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--large-latency", type=float, default=0.4, help="large model time to first token (s)")
+    parser.add_argument("--large-rate", type=float, default=60, help="large model tokens/s")
+    parser.add_argument("--small-latency", type=float, default=0.1)
+    parser.add_argument("--small-rate", type=float, default=200)
+    parser.add_argument("--slow-latency", type=float, default=4.0, help="large model time to first token when slowed down")
+    parser.add_argument("--slo", type=float, default=3.0, help="p90 latency SLO of model calls (s)")
+    args = parser.parse_args()
+
+    def model(name: str, latency: float, rate: float) -> ScriptedChatModel:
+        return ScriptedChatModel(model=name, latency=latency, tokens_per_second=rate, answer_tokens=60, use_tools=True)
+
+    small = model(settings.llm_small_model, args.small_latency, args.small_rate)
+    large = model(settings.llm_model, args.large_latency, args.large_rate)
+    slow = model(settings.llm_model, args.slow_latency, args.large_rate)
+    setups = [
+        ("all large", ALL_LARGE, large),
+        ("tiered", TIERED, large),
+        ("all small", ALL_SMALL, large),
+        ("tiered, slow large", TIERED, slow),
+    ]
+
+    print(f"{args.runs} runs, {args.concurrency} at a time; SLO p90 {args.slo}s\n")
+    print(
+        f"{'setup':>19} {'p50 s':>7} {'p95 s':>7} {'$/run':>9} {'fallbacks':>10}"
+        f"   {'model':<12} {'calls':>6} {'avg s':>6} {'$/run':>9}"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        registry.set("search", CachedSearch(FakeSearchBackend(0.2), ttl=0))
+        registry.set("scraper", FakeScraper(0.3))
+        registry.set("workspaces", Workspaces(LocalAsyncFileSystem(asynchronous=True), tmp))
+        checkpointer = SqliteCheckpointer(os.path.join(tmp, "checkpoints.sqlite"))
+
+        for name, roles, large_model in setups:
+            tracer = Tracer(
+                prices={
+                    settings.llm_small_model: (settings.llm_small_input_cost_per_mtok, settings.llm_small_output_cost_per_mtok),
+                    settings.llm_model: (settings.llm_input_cost_per_mtok, settings.llm_output_cost_per_mtok),
+                }
+            )
+            registry.set("tracer", tracer)
+            tiers = ModelTiers(
+                [Tier("small", small, window=10), Tier("large", large_model, window=10)],
+                roles,
+                slo_seconds=args.slo,
+                min_calls=3,
+            )
+            graph = make_super_graph(
+                tiers, make_research_graph(tiers), make_paper_writing_graph(tiers), checkpointer=checkpointer
+            )
+            latencies = asyncio.run(run_all(graph, args.runs, args.concurrency))
+
+            by_model: defaultdict[str, list[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+            for (_, _, model_name), totals in tracer.snapshot()["models"].items():
+                by_model[model_name][0] += totals.calls
+                by_model[model_name][1] += totals.seconds
+                by_model[model_name][2] += totals.cost
+            cost = sum(c for _, _, c in by_model.values()) / args.runs
+            rows = [
+                f"{m:<12} {calls:>6} {seconds / calls:>6.2f} {c / args.runs:>9.5f}"
+                for m, (calls, seconds, c) in sorted(by_model.items())
+            ]
+            print(
+                f"{name:>19} {percentile(latencies, 0.5):>7.2f} {percentile(latencies, 0.95):>7.2f} {cost:>9.5f}"
+                f" {tiers.stats['fallbacks']:>10}   {rows[0]}"
+            )
+            for row in rows[1:]:
+                print(f"{'':>56}{row}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Overhead of the tracer: runs/s of super_graph with no tracer, with the tracer, and with JSONL export.
+
+Usage (from the backend folder):
+
+    $ python -m bench.tracing --runs 100 --latency 0
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from bench.fakes import ScriptedChatModel
+from graph import make_super_graph
+from paper_writing_team import make_paper_writing_graph
+from research_team import make_research_graph
+from tracing import Tracer
+
+
+async def run_batch(graph, runs: int, callbacks: list) -> float:
+    async def one(i: int):
+        async for _ in graph.astream(
+            {"messages": [("user", f"question {i}")]},
+            {"recursion_limit": 150, "callbacks": callbacks},
+            stream_mode="messages",
+        ):
+            pass
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(runs)))
+    return runs / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per model call")
+    parser.add_argument("--rounds", type=int, default=3, help="best of")
+    args = parser.parse_args()
+
+    llm = ScriptedChatModel(latency=args.latency)
+    graph = make_super_graph(llm, make_research_graph(llm), make_paper_writing_graph(llm))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        jsonl = os.path.join(tmp, "traces.jsonl")
+        setups = {
+            "none": lambda: None,
+            "tracer": lambda: Tracer(),
+            "tracer+jsonl": lambda: Tracer(jsonl),
+        }
+        print(f"{'tracing':>14} {'runs/s':>8} {'overhead':>9}")
+        baseline = None
+        for name, make in setups.items():
+            best = 0.0
+            for _ in range(args.rounds):
+                tracer = make()
+                best = max(best, asyncio.run(run_batch(graph, args.runs, [tracer] if tracer else [])))
+                if tracer is not None:
+                    tracer.close()
+            baseline = baseline or best
+            print(f"{name:>14} {best:>8.1f} {(baseline / best - 1) * 100:>8.1f}%")
+        with open(jsonl, encoding="utf-8") as f:
+            print(f"\n{sum(1 for _ in f)} spans written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Uploading a large text document to a run: buffered against streamed ingestion.
+
+A document of --mb of made-up text (UTF-8, with accented words) is posted as a multipart body
+in chunks of --chunk-kb. "buffered" is what the misc.py helpers allowed before: the whole body
+is read, its encoding detected over the full payload, then it is decoded and indexed.
+"streamed" is the upload endpoint's pipeline (see upload.py), which detects the encoding on
+the head and indexes passages as the bytes arrive. Memory is measured with tracemalloc (which
+slows both down), over the body already in memory: "index MB" is what the run's index holds
+at the end, "peak MB" the most held at any time. For "streamed", the peak is the first search
+merging the postings of the new passages; during the upload, memory stays within a MB of
+what the index holds so far. "ready" is the time from the last byte received to the end of
+the first search.
+
+Usage (from the backend folder):
+
+    $ python -m bench.upload --mb 20
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import AsyncIterator
+
+from charset_normalizer import from_bytes
+
+from bench.retrieval import make_text, make_words
+from retrieval import RunIndex
+from upload import ingest_body
+from workspace import LocalAsyncFileSystem, Workspaces
+
+BOUNDARY = "benchboundary"
+
+
+async def body_chunks(body: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    for i in range(0, len(body), chunk_size):
+        yield body[i : i + chunk_size]
+        # a network read
+        await asyncio.sleep(0)
+
+
+async def buffered(body: bytes, chunk_size: int) -> tuple[float, RunIndex]:
+    data = b"".join([chunk async for chunk in body_chunks(body, chunk_size)])
+    received = time.perf_counter()
+    start = data.index(b"\r\n\r\n") + 4
+    payload = data[start : data.rindex(f"\r\n--{BOUNDARY}--".encode())]
+    encoding = from_bytes(payload).best().encoding
+    index = RunIndex()
+    index.add("uploads/doc.txt", "doc.txt", payload.decode(encoding))
+    await index.search("ready")
+    return received, index
+
+
+async def streamed(body: bytes, chunk_size: int, root: str) -> tuple[float, RunIndex]:
+    workspaces = Workspaces(LocalAsyncFileSystem(asynchronous=True), root)
+    workspace = workspaces.get("bench")
+    received = 0.0
+
+    async def timed() -> AsyncIterator[bytes]:
+        nonlocal received
+        async for chunk in body_chunks(body, chunk_size):
+            received = time.perf_counter()
+            yield chunk
+
+    documents = await ingest_body(workspace, timed(), f"multipart/form-data; boundary={BOUNDARY}", "doc.txt", len(body))
+    assert documents and documents[0]["passages"] > 0, documents
+    await workspace.index.search("ready")
+    return received, workspace.index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=float, default=20)
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = make_words(20000, rng) + ["café", "naïve", "Grüße", "señal", "façade"] * 50
+    text = make_text(int(args.mb * 2**20), words, rng)
+    body = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="doc.txt"\r\n'
+        f"Content-Type: text/plain\r\n\r\n{text}\r\n--{BOUNDARY}--\r\n"
+    ).encode()
+    del text
+    chunk_size = args.chunk_kb * 1024
+
+    print(f"{len(body) / 2**20:.1f} MB body in chunks of {args.chunk_kb} KB\n")
+    print(f"{'setup':>9} {'elapsed s':>10} {'MB/s':>7} {'index MB':>9} {'peak MB':>8} {'ready ms':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("buffered", "streamed"):
+            tracemalloc.start()
+            started = time.perf_counter()
+            if name == "buffered":
+                received, index = asyncio.run(buffered(body, chunk_size))
+            else:
+                received, index = asyncio.run(streamed(body, chunk_size, tmp))
+            done = time.perf_counter()
+            held, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del index
+            elapsed = done - started
+            print(
+                f"{name:>9} {elapsed:>10.2f} {len(body) / 2**20 / elapsed:>7.2f} {held / 2**20:>9.1f} {peak / 2**20:>8.1f}"
+                f" {(done - received) * 1000:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Throughput of the API by number of uvicorn workers, and how long a graceful shutdown takes.
+
+For each worker count, a server running bench.serve (scripted models, no network) is started
+on a free port and --clients clients keep asking questions for --duration seconds, reading
+each answer stream to the end. The server is then stopped with SIGTERM while a last round of
+streams is open, which it lets finish. Throughput scales with workers up to the number of cores.
+
+Usage (from the backend folder):
+
+    $ python -m bench.workers --workers 1 2 4 --clients 32 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers: int, port: int, tmp: str, latency: float) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "BENCH_LATENCY": str(latency),
+        "CHECKPOINT_DB": os.path.join(tmp, "checkpoints.sqlite"),
+        "SHARED_STATE_DB": os.path.join(tmp, "shared.sqlite"),
+        "SCRAPE_CACHE_DB": os.path.join(tmp, "pages.sqlite"),
+        "ACCESS_LOG_SAMPLE_RATE": "0",
+        "LOG_LEVEL": "WARNING",
+    }
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "bench.serve:fastapi_app",
+            "--port", str(port), "--workers", str(workers),
+            "--timeout-graceful-shutdown", "30", "--log-level", "warning",
+        ],
+        env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/docs")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError("server did not start")
+
+
+async def ask(client: httpx.AsyncClient, question: str) -> bool:
+    async with client.stream("GET", "/rest/v1/question", params={"question": question}) as resp:
+        body = b"".join([chunk async for chunk in resp.aiter_bytes()])
+    return resp.status_code == 200 and b'"type":"done"' in body
+
+
+async def load(client: httpx.AsyncClient, clients: int, duration: float) -> tuple[int, list[float]]:
+    deadline = time.monotonic() + duration
+    latencies: list[float] = []
+
+    async def worker(i: int):
+        n = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            if await ask(client, f"question {i}-{n}"):
+                latencies.append(time.perf_counter() - started)
+            n += 1
+
+    await asyncio.gather(*(worker(i) for i in range(clients)))
+    return len(latencies), sorted(latencies)
+
+
+async def drain(proc: subprocess.Popen, client: httpx.AsyncClient, clients: int) -> tuple[int, float]:
+    """Stop the server while ``clients`` streams are open; count the ones that still finish."""
+    streams = [asyncio.create_task(ask(client, f"drain {i}")) for i in range(clients)]
+    await asyncio.sleep(0.2)
+    started = time.perf_counter()
+    proc.send_signal(signal.SIGTERM)
+    results = await asyncio.gather(*streams, return_exceptions=True)
+    await asyncio.to_thread(proc.wait)
+    return sum(r is True for r in results), time.perf_counter() - started
+
+
+async def run(workers: int, args) -> None:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = start_server(workers, port, tmp, args.latency)
+        limits = httpx.Limits(max_connections=args.clients * 2)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+                await wait_ready(client)
+                await load(client, args.clients, 2)  # warm up every worker's graphs
+                runs, latencies = await load(client, args.clients, args.duration)
+                finished, drain_s = await drain(proc, client, args.clients)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    print(
+        f"{workers:>8} {runs / args.duration:>9.1f} {p50:>8.2f} "
+        f"{f'{finished}/{args.clients}':>14} {drain_s:>10.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per model call")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'runs/s':>9} {'p50(s)':>8} {'drained runs':>14} {'drain(s)':>10}")
+    for workers in args.workers:
+        asyncio.run(run(workers, args))
+
+
+if __name__ == "__main__":
+    main()
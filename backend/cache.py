@@ -0,0 +1,415 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core._api import suppress_langchain_beta_warning
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.embeddings import Embeddings
+from langchain_core.globals import set_llm_cache
+from langchain_core.load import dumps, loads
+
+from log import get_logger
+from settings import settings
+
+##########################################################################################
+# Response cache
+#
+# A LangChain LLM cache shared by every chat model in the process (see init_response_cache).
+# Lookups go through three tiers:
+#
+#   1. memory: an LRU of the most recently used entries
+#   2. disk:   a local SQLite store, which survives restarts
+#   3. semantic (optional): cosine similarity between the embedded last message and the ones
+#      cached for the same model, tool schema and preceding messages. Only the last message may
+#      differ: a similar-looking history can still need a different answer (a router whose
+#      workers reported in another order would loop on a cached decision)
+#
+# Exact keys hash the model/tool parameters together with the message list, after dropping
+# the parts that differ between otherwise identical prompts (message and tool call ids,
+# response metadata).
+#
+# The async methods, which the chat models use, look in memory on the event loop and go to
+# SQLite (reads, writes and eviction) in a thread, so a model call never waits for the disk
+# on the loop.
+
+# a missed lookup's embedding is kept this long for the update that follows (none follows a
+# failed or cancelled model call)
+PENDING_VECTOR_TTL = 600
+
+_VOLATILE_KEYS = {"tool_call_id", "response_metadata", "usage_metadata"}
+
+
+def _strip_volatile(v: Any) -> Any:
+    if isinstance(v, dict):
+        return {
+            k: _strip_volatile(x)
+            for k, x in v.items()
+            # a string "id" is a message/tool call id; the list "id" of a serialized object is its class path
+            if k not in _VOLATILE_KEYS and not (k == "id" and isinstance(x, str))
+        }
+    if isinstance(v, list):
+        return [_strip_volatile(x) for x in v]
+    if isinstance(v, str):
+        return v.strip()
+    return v
+
+
+def normalize_prompt(prompt: str) -> str:
+    try:
+        data = json.loads(prompt)
+    except ValueError:
+        return " ".join(prompt.split())
+    return json.dumps(_strip_volatile(data), sort_keys=True, separators=(",", ":"))
+
+
+def split_prompt(normalized: str) -> tuple[str, str]:
+    """Split a normalized prompt into its preceding messages and the text of the last message."""
+    try:
+        data = json.loads(normalized)
+    except ValueError:
+        return "", normalized
+    if not isinstance(data, list) or not data:
+        return "", normalized
+    last = data[-1]
+    if isinstance(last, dict) and "kwargs" in last:
+        text = last["kwargs"].get("content", "")
+        if not isinstance(text, str):
+            text = json.dumps(text, sort_keys=True)
+    else:
+        text = json.dumps(last, sort_keys=True)
+    return json.dumps(data[:-1], sort_keys=True, separators=(",", ":")), text
+
+
+def _hash(*parts: str) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class ResponseCache(BaseCache):
+    """Exact-match plus optional embedding-similarity cache, with TTL and LRU eviction."""
+
+    def __init__(
+        self,
+        path: Optional[str],
+        ttl: float = 86400,
+        max_entries: int = 10000,
+        memory_entries: int = 1000,
+        embeddings: Optional[Embeddings] = None,
+        similarity_threshold: float = 0.97,
+    ):
+        self.logger = get_logger("cache")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+
+        self.lock = threading.Lock()
+        self.memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.stats: Counter[str] = Counter()
+
+        # semantic tier: per model, tool schema and preceding messages, the cache keys and the
+        # unit-length embeddings of their last message
+        self.vectors: dict[str, tuple[list[str], np.ndarray]] = {}
+        # embeddings computed by a missed lookup, reused by the update that follows it, oldest first
+        self.pending_vectors: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+
+        self.conn: Optional[sqlite3.Connection] = None
+        if path:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY, prefix_hash TEXT NOT NULL, value TEXT NOT NULL, embedding BLOB,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at)")
+            if embeddings is not None:
+                self._load_vectors()
+
+    ####################################################################
+    # keys and (de)serialization
+
+    @staticmethod
+    def _keys(prompt: str, llm_string: str) -> tuple[str, str, str]:
+        """Return the exact key, the semantic bucket and the text to embed for a prompt."""
+        normalized = normalize_prompt(prompt)
+        llm_hash = _hash(llm_string)
+        prefix, last_text = split_prompt(normalized)
+        return _hash(llm_hash, normalized), _hash(llm_hash, prefix), last_text
+
+    @staticmethod
+    def _decode(value: str) -> RETURN_VAL_TYPE:
+        with suppress_langchain_beta_warning():
+            generations = [loads(g) for g in json.loads(value)]
+        for g in generations:
+            message = getattr(g, "message", None)
+            if message is not None:
+                # let the caller assign a fresh id, so stream consumers don't drop it as a duplicate
+                message.id = None
+                # a cached reply used no tokens; usage is what the scheduler charges against tokens/min
+                if hasattr(message, "usage_metadata"):
+                    message.usage_metadata = None
+        return generations
+
+    @staticmethod
+    def _encode(return_val: RETURN_VAL_TYPE) -> str:
+        return json.dumps([dumps(g) for g in return_val])
+
+    ####################################################################
+    # tiers
+
+    def _memory_get(self, key: str, now: float) -> Optional[str]:
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < now:
+            del self.memory[key]
+            return None
+        self.memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key: str, value: str, expires_at: float):
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        if self.conn is None:
+            return None
+        row = self.conn.execute(
+            "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at < now:
+            self.conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        self.conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self._memory_put(key, value, expires_at)
+        return value
+
+    def _load_vectors(self):
+        rows = self.conn.execute(
+            "SELECT key, prefix_hash, embedding FROM response_cache"
+            " WHERE embedding IS NOT NULL AND expires_at >= ? ORDER BY accessed_at DESC LIMIT ?",
+            (time.time(), self.max_entries),
+        ).fetchall()
+        for key, prefix_hash, embedding in rows:
+            self._add_vector(prefix_hash, key, np.frombuffer(embedding, dtype=np.float32))
+
+    def _add_vector(self, prefix_hash: str, key: str, vector: np.ndarray):
+        keys, matrix = self.vectors.get(prefix_hash, ([], np.empty((0, vector.shape[0]), dtype=np.float32)))
+        if key in keys:
+            return
+        self.vectors[prefix_hash] = (keys + [key], np.vstack([matrix, vector[None, :]]))
+
+    def _drop_vectors(self, dropped: set[str]):
+        for prefix_hash, (keys, matrix) in list(self.vectors.items()):
+            keep = [i for i, k in enumerate(keys) if k not in dropped]
+            if len(keep) != len(keys):
+                self.vectors[prefix_hash] = ([keys[i] for i in keep], matrix[keep])
+
+    def _nearest(self, prefix_hash: str, vector: np.ndarray) -> Optional[str]:
+        keys, matrix = self.vectors.get(prefix_hash, ([], None))
+        if not keys:
+            return None
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity_threshold else None
+
+    @staticmethod
+    def _unit(vector: list[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    ####################################################################
+    # BaseCache
+
+    def _lookup_memory(self, key: str) -> Optional[str]:
+        with self.lock:
+            value = self._memory_get(key, time.time())
+            if value is not None:
+                self.stats["hit_memory"] += 1
+            return value
+
+    def _lookup_disk(self, key: str) -> Optional[str]:
+        if self.conn is None:
+            return None
+        with self.lock:
+            value = self._disk_get(key, time.time())
+            if value is not None:
+                self.stats["hit_disk"] += 1
+            return value
+
+    def _lookup_exact(self, key: str) -> Optional[str]:
+        value = self._lookup_memory(key)
+        return value if value is not None else self._lookup_disk(key)
+
+    def _remember_vector(self, key: str, vector: np.ndarray, now: float):
+        self.pending_vectors[key] = (now, vector)
+        self.pending_vectors.move_to_end(key)
+        while self.pending_vectors:
+            created, _ = next(iter(self.pending_vectors.values()))
+            if created >= now - PENDING_VECTOR_TTL and len(self.pending_vectors) <= self.memory_entries:
+                break
+            self.pending_vectors.popitem(last=False)
+
+    def _lookup_semantic(self, key: str, prefix_hash: str, vector: np.ndarray) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            self._remember_vector(key, vector, now)
+            similar = self._nearest(prefix_hash, vector)
+            if similar is None:
+                return None
+            value = self._memory_get(similar, now) or self._disk_get(similar, now)
+            if value is not None:
+                self.stats["hit_semantic"] += 1
+            return value
+
+    def _miss(self) -> None:
+        with self.lock:
+            self.stats["miss"] += 1
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key, prefix_hash, last_text = self._keys(prompt, llm_string)
+        value = self._lookup_exact(key)
+        if value is None and self.embeddings is not None:
+            vector = self._unit(self.embeddings.embed_query(last_text))
+            value = self._lookup_semantic(key, prefix_hash, vector)
+        if value is None:
+            self._miss()
+            return None
+        return self._decode(value)
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key, prefix_hash, last_text = self._keys(prompt, llm_string)
+        value = self._lookup_memory(key)
+        if value is None and self.conn is not None:
+            value = await asyncio.to_thread(self._lookup_disk, key)
+        if value is None and self.embeddings is not None:
+            vector = self._unit(await self.embeddings.aembed_query(last_text))
+            value = await asyncio.to_thread(self._lookup_semantic, key, prefix_hash, vector)
+        if value is None:
+            self._miss()
+            return None
+        return self._decode(value)
+
+    def _update_memory(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> tuple:
+        """Cache in memory; returns what _update_disk needs."""
+        key, prefix_hash, _ = self._keys(prompt, llm_string)
+        value = self._encode(return_val)
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self.stats["update"] += 1
+            self._memory_put(key, value, expires_at)
+            _, vector = self.pending_vectors.pop(key, (None, None))
+            if vector is not None:
+                self._add_vector(prefix_hash, key, vector)
+            evict = self.stats["update"] % 100 == 0
+        return key, prefix_hash, value, vector, expires_at, now, evict
+
+    def _update_disk(
+        self,
+        key: str,
+        prefix_hash: str,
+        value: str,
+        vector: Optional[np.ndarray],
+        expires_at: float,
+        now: float,
+        evict: bool,
+    ):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, prefix_hash, value, vector.tobytes() if vector is not None else None, expires_at, now),
+            )
+            if evict:
+                self._evict(now)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        entry = self._update_memory(prompt, llm_string, return_val)
+        if self.conn is not None:
+            self._update_disk(*entry)
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        entry = self._update_memory(prompt, llm_string, return_val)
+        if self.conn is not None:
+            await asyncio.to_thread(self._update_disk, *entry)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        dropped = {
+            k for (k,) in self.conn.execute("SELECT key FROM response_cache WHERE expires_at < ?", (now,))
+        }
+        dropped.update(
+            k
+            for (k,) in self.conn.execute(
+                "SELECT key FROM response_cache WHERE expires_at >= ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?",
+                (now, self.max_entries),
+            )
+        )
+        if not dropped:
+            return
+        self.conn.executemany("DELETE FROM response_cache WHERE key = ?", [(k,) for k in dropped])
+        self._drop_vectors(dropped)
+        self.stats["evict"] += len(dropped)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock:
+            self.memory.clear()
+            self.vectors.clear()
+            self.pending_vectors.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM response_cache")
+
+    def metrics(self) -> dict[str, int]:
+        with self.lock:
+            r = dict(self.stats)
+            r["memory_entries"] = len(self.memory)
+        r["hits"] = r.get("hit_memory", 0) + r.get("hit_disk", 0) + r.get("hit_semantic", 0)
+        r.setdefault("miss", 0)
+        return r
+
+
+def init_response_cache() -> Optional[ResponseCache]:
+    """Install the response cache configured in settings under every chat model in the process.
+
+    Built once, as the registry's "response_cache" (see registry.py).
+    """
+    if not settings.response_cache:
+        return None
+
+    embeddings: Optional[Embeddings] = None
+    if settings.response_cache_semantic:
+        from langchain_openai import OpenAIEmbeddings  # pylint: disable=import-outside-toplevel
+
+        embeddings = OpenAIEmbeddings(model=settings.response_cache_embedding_model)
+
+    response_cache = ResponseCache(
+        settings.response_cache_db,
+        ttl=settings.response_cache_ttl,
+        max_entries=settings.response_cache_max_entries,
+        embeddings=embeddings,
+        similarity_threshold=settings.response_cache_similarity,
+    )
+    set_llm_cache(response_cache)
+    return response_cache
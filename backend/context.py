@@ -0,0 +1,173 @@
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Optional, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from settings import settings
+
+##########################################################################################
+# Context compaction
+#
+# Supervisors and agents used to send the whole conversation to the model on every turn,
+# so prompt size (and with it latency and cost) grew with every step of a long run.
+# ContextManager bounds what is sent to the model, without touching the graph state:
+#
+#   - a message larger than max_message_tokens (typically a scraped page or a long
+#     worker report) keeps its head and tail only;
+#   - the task (first human message) and the most recent messages are kept verbatim,
+#     as many as fit into max_tokens;
+#   - the older messages that no longer fit are replaced by one digest: an LLM summary
+#     when a summarizer is configured, otherwise the opening lines of each of them.
+#
+# Tokens are estimated from the text length, which is plenty for budgeting.
+
+_CHARS_PER_TOKEN = 4
+
+
+def count_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return len(content) // _CHARS_PER_TOKEN + 4
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * _CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    head = max_chars * 3 // 4
+    tail = max_chars - head
+    dropped = (len(text) - head - tail) // _CHARS_PER_TOKEN
+    return f"{text[:head]}\n[... about {dropped} tokens truncated ...]\n{text[-tail:]}"
+
+
+def _truncated(message: BaseMessage, max_tokens: int) -> BaseMessage:
+    if not isinstance(message.content, str) or count_tokens(message) <= max_tokens:
+        return message
+    return message.model_copy(update={"content": truncate_text(message.content, max_tokens)})
+
+
+def _digest_line(message: BaseMessage, max_chars: int = 200) -> str:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    content = " ".join(content.split())
+    if len(content) > max_chars:
+        content = content[:max_chars] + "..."
+    return f"- {message.name or message.type}: {content}"
+
+
+class ContextManager:
+    def __init__(
+        self,
+        max_tokens: int = 8000,
+        max_message_tokens: int = 2000,
+        summarizer: Optional[BaseChatModel] = None,
+        summary_tokens: int = 400,
+        cache_size: int = 256,
+    ):
+        self.max_tokens = max_tokens
+        self.max_message_tokens = max_message_tokens
+        self.summarizer = summarizer
+        self.summary_tokens = summary_tokens
+        self.cache_size = cache_size
+        # summaries of dropped messages, by content hash, so a run summarizes each prefix only once
+        self.summaries: OrderedDict[str, str] = OrderedDict()
+
+    def _split(self, messages: Sequence[BaseMessage]) -> tuple[list[BaseMessage], list[BaseMessage], list[BaseMessage]]:
+        """Return the pinned head (system prompt and task), the dropped middle and the kept tail."""
+        messages = [_truncated(m, self.max_message_tokens) for m in messages]
+
+        head_len = 0
+        while head_len < len(messages) and isinstance(messages[head_len], SystemMessage):
+            head_len += 1
+        if head_len < len(messages) and isinstance(messages[head_len], HumanMessage):
+            head_len += 1
+        head, rest = messages[:head_len], messages[head_len:]
+
+        # reserve room for the digest of whatever gets dropped
+        budget = self.max_tokens - sum(count_tokens(m) for m in head) - self.summary_tokens
+        start = len(rest)
+        while start > 0 and budget - count_tokens(rest[start - 1]) >= 0:
+            budget -= count_tokens(rest[start - 1])
+            start -= 1
+        if start == 0:
+            return head, [], rest
+        # never start the kept tail on a tool result whose tool call was dropped
+        while start < len(rest) and isinstance(rest[start], ToolMessage):
+            start += 1
+        if start == len(rest):
+            # always keep the latest message, with the tool call it answers
+            start = len(rest) - 1
+            while start > 0 and isinstance(rest[start], ToolMessage):
+                start -= 1
+        return head, rest[:start], rest[start:]
+
+    @staticmethod
+    def _key(dropped: list[BaseMessage]) -> str:
+        h = hashlib.sha256()
+        for m in dropped:
+            h.update(f"{m.type}\x00{m.name}\x00{m.content}\x00".encode("utf-8", errors="replace"))
+        return h.hexdigest()
+
+    def _remember(self, key: str, summary: str) -> str:
+        self.summaries[key] = summary
+        self.summaries.move_to_end(key)
+        while len(self.summaries) > self.cache_size:
+            self.summaries.popitem(last=False)
+        return summary
+
+    def _digest(self, dropped: list[BaseMessage]) -> str:
+        lines = [_digest_line(m) for m in dropped if not isinstance(m, ToolMessage)]
+        return truncate_text("\n".join(lines), self.summary_tokens)
+
+    @staticmethod
+    def _digest_message(summary: str, n: int) -> HumanMessage:
+        return HumanMessage(content=f"Summary of {n} earlier messages:\n{summary}", name="context_summary")
+
+    def compact(self, messages: Sequence[BaseMessage]) -> list[BaseMessage]:
+        """Compact without calling a model: dropped messages are replaced by their opening lines."""
+        head, dropped, tail = self._split(messages)
+        if not dropped:
+            return head + tail
+        return head + [self._digest_message(self._digest(dropped), len(dropped))] + tail
+
+    async def acompact(self, messages: Sequence[BaseMessage]) -> list[BaseMessage]:
+        head, dropped, tail = self._split(messages)
+        if not dropped:
+            return head + tail
+        if self.summarizer is None:
+            return head + [self._digest_message(self._digest(dropped), len(dropped))] + tail
+
+        key = self._key(dropped)
+        summary = self.summaries.get(key)
+        if summary is None:
+            response = await self.summarizer.ainvoke([
+                SystemMessage(content=(
+                    "Summarize the following worker reports for a supervisor who routes the remaining work."
+                    f" Keep facts, sources and open questions; stay under {self.summary_tokens * 3 // 4} words."
+                )),
+                HumanMessage(content="\n\n".join(
+                    f"[{m.name or m.type}]\n{m.content}" for m in dropped if not isinstance(m, ToolMessage)
+                )),
+            ])
+            summary = self._remember(key, truncate_text(str(response.content), self.summary_tokens))
+        return head + [self._digest_message(summary, len(dropped))] + tail
+
+    def state_modifier(self, prompt: Optional[str] = None) -> Callable[[dict], list[BaseMessage]]:
+        """A create_react_agent state_modifier that prepends ``prompt`` and compacts the agent's messages."""
+
+        def modify(state: dict) -> list[BaseMessage]:
+            messages = state["messages"]
+            if prompt:
+                messages = [SystemMessage(content=prompt)] + list(messages)
+            return self.compact(messages)
+
+        return modify
+
+
+def make_context_manager(llm: Optional[BaseChatModel] = None) -> ContextManager:
+    """Build the context manager configured in settings; ``llm`` summarizes when summaries are on."""
+    return ContextManager(
+        max_tokens=settings.context_max_tokens,
+        max_message_tokens=settings.context_max_message_tokens,
+        summarizer=llm if settings.context_summarize else None,
+    )
@@ -0,0 +1,174 @@
+from typing import Optional
+
+from errs import BadRequest
+
+##########################################################################################
+# Documents of the paper writing team
+#
+# A document is a list of blocks of a few hundred lines each. The line counts and byte sizes
+# of the blocks are kept in two Fenwick trees, so that finding the block of a line, or the
+# byte offset of a block, takes O(log n) steps, and so does updating them after an edit. A
+# range read only touches the blocks it spans. An edit (inserts and line replacements,
+# numbered as in the document before the edit) rewrites only the blocks it touches. A block
+# that grows past twice block_lines is split, which rebuilds the trees in O(n): that happens
+# at most once per block_lines lines added. dirty_from remembers the first line changed
+# since the document was last saved, so a save only rewrites the file from there on.
+
+
+def _size(lines: list[str]) -> int:
+    return sum(len(s.encode()) for s in lines)
+
+
+def _lines(text: str) -> list[str]:
+    return (text if text.endswith("\n") else text + "\n").splitlines(keepends=True)
+
+
+class _Sums:
+    """Prefix sums of a list of counts (a Fenwick tree)."""
+
+    def __init__(self, values: list[int]):
+        self.tree = [0] + values
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def add(self, i: int, delta: int):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """The sum of the first ``i`` values."""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, total: int) -> int:
+        """The largest ``i`` such that the first ``i`` values sum up to at most ``total``."""
+        i = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if i + step < len(self.tree) and self.tree[i + step] <= total:
+                i += step
+                total -= self.tree[i]
+            step >>= 1
+        return i
+
+
+class Document:
+    def __init__(self, text: str = "", block_lines: int = 256, saved: bool = False):
+        self.block_lines = block_lines
+        lines = text.splitlines(keepends=True)
+        self.blocks = [lines[i : i + block_lines] for i in range(0, len(lines), block_lines)]
+        self.sizes = [_size(block) for block in self.blocks]
+        # first line changed since the last save (0 when it was never saved), or None
+        self.dirty_from: Optional[int] = None if saved else 0
+        self._reindex()
+
+    def _reindex(self):
+        self.line_sums = _Sums([len(block) for block in self.blocks])
+        self.size_sums = _Sums(list(self.sizes))
+        self.line_count = sum(len(block) for block in self.blocks)
+        self.size = sum(self.sizes)
+
+    def _block(self, line: int) -> int:
+        # the last block starting at or before the line
+        return min(self.line_sums.find(line), len(self.blocks) - 1)
+
+    def read(self, start: Optional[int] = None, end: Optional[int] = None) -> str:
+        """Lines ``start`` to ``end`` (0-based, ``end`` excluded, like a slice)."""
+        start, end, _ = slice(start, end).indices(self.line_count)
+        if start >= end:
+            return ""
+        out: list[str] = []
+        b = self._block(start)
+        first = self.line_sums.prefix(b)
+        while b < len(self.blocks) and first < end:
+            out.extend(self.blocks[b][max(start - first, 0) : end - first])
+            first += len(self.blocks[b])
+            b += 1
+        return "".join(out)
+
+    def text(self) -> str:
+        return "".join("".join(block) for block in self.blocks)
+
+    def byte_offset(self, line: int) -> int:
+        if line >= self.line_count:
+            return self.size
+        b = self._block(line)
+        return self.size_sums.prefix(b) + _size(self.blocks[b][: line - self.line_sums.prefix(b)])
+
+    def edit(self, inserts: Optional[dict[int, str]] = None, replacements: Optional[dict[int, str]] = None):
+        """Insert text before lines and replace lines, all numbered from 1 as in the document before the edit.
+
+        Inserting at line_count + 1 appends. Several lines can be inserted or put in place of one.
+        """
+        inserts = inserts or {}
+        replacements = replacements or {}
+        for n in inserts:
+            if not 1 <= n <= self.line_count + 1:
+                raise BadRequest(f"Line number {n} is out of range.")
+        for n in replacements:
+            if not 1 <= n <= self.line_count:
+                raise BadRequest(f"Line number {n} is out of range.")
+        if not inserts and not replacements:
+            return
+
+        if not self.blocks:
+            self.blocks.append([])
+            self.sizes.append(0)
+            self._reindex()
+        # edits by block; an insert at the very end goes to the last block
+        by_block: dict[int, tuple[dict[int, str], dict[int, str]]] = {}
+        for n, text in inserts.items():
+            by_block.setdefault(self._block(n - 1), ({}, {}))[0][n - 1] = text
+        for n, text in replacements.items():
+            by_block.setdefault(self._block(n - 1), ({}, {}))[1][n - 1] = text
+
+        changed = min(min(inserts, default=self.line_count + 1), min(replacements, default=self.line_count + 1)) - 1
+        starts = {b: self.line_sums.prefix(b) for b in by_block}
+        split = False
+        # from the last block on, so that splitting one leaves the indexes of the others as they are
+        for b in sorted(by_block, reverse=True):
+            block_inserts, block_replacements = by_block[b]
+            block, first = self.blocks[b], starts[b]
+            lines: list[str] = []
+            for i, line in enumerate(block, first):
+                if i in block_inserts:
+                    lines.extend(_lines(block_inserts[i]))
+                lines.extend(_lines(block_replacements[i]) if i in block_replacements else [line])
+            end = first + len(block)
+            if end in block_inserts:
+                if lines and not lines[-1].endswith("\n"):
+                    lines[-1] += "\n"
+                    changed = min(changed, end - 1)
+                lines.extend(_lines(block_inserts[end]))
+            size = _size(lines)
+            self.line_count += len(lines) - len(block)
+            self.size += size - self.sizes[b]
+            if len(lines) <= 2 * self.block_lines:
+                self.line_sums.add(b, len(lines) - len(block))
+                self.size_sums.add(b, size - self.sizes[b])
+                self.blocks[b], self.sizes[b] = lines, size
+                continue
+            # keep blocks small enough for edits to stay cheap
+            pieces = [lines[i : i + self.block_lines] for i in range(0, len(lines), self.block_lines)]
+            self.blocks[b : b + 1] = pieces
+            self.sizes[b : b + 1] = [_size(piece) for piece in pieces]
+            split = True
+
+        if split:
+            self._reindex()
+        self.dirty_from = changed if self.dirty_from is None else min(self.dirty_from, changed)
+
+    def added_bytes(
+        self, inserts: Optional[dict[int, str]] = None, replacements: Optional[dict[int, str]] = None
+    ) -> int:
+        """Upper bound of how much an edit grows the document, for quotas."""
+        return sum(len(t.encode()) + 1 for t in (inserts or {}).values()) + sum(
+            len(t.encode()) + 1 for t in (replacements or {}).values()
+        )
@@ -1,15 +1,28 @@
-from typing import Literal
+from typing import Literal, Optional
 import asyncio
+from uuid import uuid4
 
-from langchain_core.messages import HumanMessage, AIMessageChunk
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
 
 from langgraph.graph import StateGraph, MessagesState, START
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
 from langgraph.types import Command
 
+from checkpoint import SqliteCheckpointer
+from context import ContextManager
+from registry import registry
+from routing import RoutingRule, routing_stats
+from settings import settings
+from singleflight import SingleFlight
+from speculation import Speculation, speculative_config
+from tiers import ModelTiers
 from tools import make_supervisor_node
-from research_team import research_graph
-from paper_writing_team import paper_writing_graph
+from workspace import run_id
+from research_team import get_research_graph
+from paper_writing_team import get_paper_writing_graph
 
 ##########################################################################################
 # Add Layers
@@ -21,56 +34,152 @@ from paper_writing_team import paper_writing_graph
 # define how this top-level state is shared between the different graphs.
 
 
-llm = ChatOpenAI(model="gpt-4o")
-
-teams_supervisor_node = make_supervisor_node(llm, ["research_team", "writing_team"])
-
-def call_research_team(state: MessagesState) -> Command[Literal["supervisor"]]:
-    last_message = state["messages"][-1]
-    response = research_graph.invoke({"messages": last_message})
-    
-    last_response = response["messages"][-1].content
-    messages = [
-                HumanMessage(
-                    content=last_response, name="research_team"
-                )
-            ]
-
-    return Command(
-        update={
-            "messages": messages
-        },
-        goto="supervisor",
-    )
-
-
-def call_paper_writing_team(state: MessagesState) -> Command[Literal["supervisor"]]:
-    last_message = state["messages"][-1]
-    response = paper_writing_graph.invoke({"messages": last_message})
-
-    last_response = response["messages"][-1].content
-    messages = [
-                HumanMessage(
-                    content=last_response, name="writing_team"
-                )
-            ]
-
-    return Command(
-        update={
-            "messages": messages
-        },
-        goto="supervisor",
+def make_super_graph(
+    llm: BaseChatModel | ModelTiers,
+    research_graph: CompiledStateGraph,
+    paper_writing_graph: CompiledStateGraph,
+    parallel: bool = False,
+    rules: Optional[list[RoutingRule]] = None,
+    checkpointer: Optional[BaseCheckpointSaver] = None,
+    context: Optional[ContextManager] = None,
+    research_share: Optional[SingleFlight] = None,
+    speculation: Optional[Speculation] = None,
+) -> CompiledStateGraph:
+    """Build the top-level graph.
+
+    The team graphs are called from inside its nodes with the node config, so when ``checkpointer``
+    is set they checkpoint into it too (under the ``research_team:``/``writing_team:`` namespaces)
+    and resume from there with the parent run.
+
+    Runs given a ``share_scope`` in their configurable (the runs of a batch) run the research team
+    once per distinct request through ``research_share``, and share its answer.
+
+    With ``speculation``, the research team starts at the same time as the supervisor's router
+    call on the turns that very likely go to it (see speculation.py).
+    """
+    members = ["research_team", "writing_team"]
+    teams_supervisor_node = make_supervisor_node(
+        llm, members, parallel=parallel, rules=rules, name="supervisor", context=context
     )
 
-
-# Define the graph.
-super_builder = StateGraph(MessagesState)
-super_builder.add_node("supervisor", teams_supervisor_node)
-super_builder.add_node("research_team", call_research_team)
-super_builder.add_node("writing_team", call_paper_writing_team)
-
-super_builder.add_edge(START, "supervisor")
-super_graph = super_builder.compile()
+    async def research(message, config: RunnableConfig) -> str:
+        async def run() -> str:
+            response = await research_graph.ainvoke({"messages": message}, config)
+            return response["messages"][-1].content
+
+        scope = (config.get("configurable") or {}).get("share_scope")
+        if scope and research_share is not None:
+            return await research_share.run(scope, str(message.content), run)
+        return await run()
+
+    async def supervisor_node(
+        state: MessagesState, config: RunnableConfig
+    ) -> Command[Literal["research_team", "writing_team", "__end__"]]:
+        last_message = state["messages"][-1]
+        key = (run_id(config), str(last_message.content))
+        speculate = speculation.predict("supervisor", state["messages"], members) == "research_team"
+        if speculate:
+            speculation.start(key, research(last_message, speculative_config(config, "research_team")))
+        try:
+            command = await teams_supervisor_node(state, config)
+        except BaseException:
+            if speculate:
+                speculation.settle(key, hit=False)
+            raise
+        if speculate:
+            goto = command.goto if isinstance(command.goto, (list, tuple)) else [command.goto]
+            speculation.settle(key, hit=any(getattr(g, "node", g) == "research_team" for g in goto))
+        return command
+
+    async def call_research_team(state: MessagesState, config: RunnableConfig) -> Command[Literal["supervisor"]]:
+        last_message = state["messages"][-1]
+
+        last_response = None
+        ahead = speculation.take((run_id(config), str(last_message.content))) if speculation is not None else None
+        if ahead is not None:
+            try:
+                last_response = await ahead
+            except Exception:  # pylint: disable=broad-exception-caught
+                # the speculative run failed: start over as if there had been none
+                speculation.counters["failed"] += 1
+        if last_response is None:
+            last_response = await research(last_message, config)
+        messages = [
+                    HumanMessage(
+                        content=last_response, name="research_team"
+                    )
+                ]
+
+        return Command(
+            update={
+                "messages": messages
+            },
+            goto="supervisor",
+        )
+
+
+    async def call_paper_writing_team(state: MessagesState, config: RunnableConfig) -> Command[Literal["supervisor"]]:
+        last_message = state["messages"][-1]
+        response = await paper_writing_graph.ainvoke({"messages": last_message}, config)
+
+        last_response = response["messages"][-1].content
+        messages = [
+                    HumanMessage(
+                        content=last_response, name="writing_team"
+                    )
+                ]
+
+        return Command(
+            update={
+                "messages": messages
+            },
+            goto="supervisor",
+        )
+
+
+    # Define the graph.
+    super_builder = StateGraph(MessagesState)
+    super_builder.add_node("supervisor", supervisor_node if speculation is not None else teams_supervisor_node)
+    super_builder.add_node("research_team", call_research_team)
+    super_builder.add_node("writing_team", call_paper_writing_team)
+
+    super_builder.add_edge(START, "supervisor")
+    return super_builder.compile(checkpointer=checkpointer)
+
+
+registry.register("checkpointer", lambda: SqliteCheckpointer(settings.checkpoint_db))
+registry.register(
+    "super_graph",
+    lambda: make_super_graph(
+        registry.get("model_tiers"),
+        get_research_graph(),
+        get_paper_writing_graph(),
+        checkpointer=registry.get("checkpointer"),
+        context=registry.get("context"),
+        research_share=registry.get("research_share"),
+        speculation=registry.get("speculation"),
+    ),
+)
+registry.register("research_share", SingleFlight)
+registry.register(
+    "speculation",
+    lambda: Speculation(routing_stats, settings.speculation_min_samples, settings.speculation_min_probability)
+    if settings.speculation
+    else None,
+)
+
+
+def get_super_graph() -> CompiledStateGraph:
+    return registry.get("super_graph")
+
+
+def run_config(thread_id: str, **configurable) -> RunnableConfig:
+    """Config of a question run, checkpointed under ``thread_id`` and traced."""
+    return {
+        "recursion_limit": 150,
+        "configurable": {"thread_id": thread_id, **configurable},
+        "callbacks": [registry.get("tracer")],
+    }
 
 
 # from IPython.display import Image
@@ -85,13 +194,13 @@ super_graph = super_builder.compile()
 # print(f"Graph has been saved to {output_path}")
 
 async def test_graph():
-    async for messages in super_graph.astream(
+    async for messages in get_super_graph().astream(
         {
             "messages": [
                 ("user", "Research AI agents and write a brief report about them.")
             ],
         },
-        {"recursion_limit": 150},
+        {"recursion_limit": 150, "configurable": {"thread_id": str(uuid4())}},
         stream_mode="messages"
     ):
         #print(messages)
@@ -101,7 +210,8 @@ async def test_graph():
         is_cared_checkpoints = checkpoint_ns.startswith("search:") or checkpoint_ns.startswith("note_taker:")
         if True or is_cared_checkpoints:
             for msg in messages:
-                if isinstance(msg, AIMessageChunk):
+                # cached replies arrive as one whole AIMessage instead of chunks
+                if isinstance(msg, AIMessage):
                     content = msg.content
                     if content:
                         print(content, end="", flush=True)
@@ -0,0 +1,402 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Optional
+from uuid import uuid4
+
+from errs import NotFound
+from graph import get_super_graph, run_config
+from log import get_logger
+from registry import registry
+from settings import settings
+from streaming import merge_deltas, message_events
+
+##########################################################################################
+# Background jobs
+#
+# A job is a question answered apart from any HTTP request: POST it, get its id, and fetch
+# its answer, documents and events later, or follow its events as they come. Jobs are queued
+# in a SQLite file (WAL mode) shared by all worker processes; each runs `job_workers` tasks
+# that claim queued jobs under a lease, renewed while the job runs. A job whose worker died
+# is claimed again once its lease expires and resumes from its last checkpoint (its thread
+# id is the job id). A job also holds the run lease of its thread (see api.py) while it runs;
+# one claimed while a question or upload holds it is given back, and claimed again later.
+# Events are the answer stream events (see streaming.py) plus
+#
+#   {"type": "status", "status": "running"}
+#
+# numbered from 0 per job and written in small batches, so a client can reattach from any
+# offset. `python jobs.py` runs workers without the API.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    answer TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS job_documents (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+"""
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+_COLUMNS = ("id", "question", "status", "created_at", "started_at", "finished_at", "attempts", "answer", "error")
+
+
+class JobStore:
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def submit(self, question: str) -> str:
+        job_id = uuid4().hex
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, question, status, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, question, QUEUED, time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else dict(zip(_COLUMNS, row))
+
+    def claim(self, owner: str, ttl: float) -> Optional[dict[str, Any]]:
+        """Take the oldest queued job, or a running one whose lease has expired."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, lease_expires_at = ?, attempts = attempts + 1,"
+                " started_at = COALESCE(started_at, ?)"
+                " WHERE id = (SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at <= ?)"
+                " ORDER BY created_at LIMIT 1)"
+                f" RETURNING {', '.join(_COLUMNS)}",
+                (RUNNING, owner, now + ttl, now, QUEUED, RUNNING, now),
+            ).fetchone()
+        return None if row is None else dict(zip(_COLUMNS, row))
+
+    def renew(self, job_id: str, owner: str, ttl: float) -> bool:
+        """Extend our lease; False if the job was taken over, or cancelled."""
+        with self.lock:
+            row = self.conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND owner = ? AND status = ?"
+                " RETURNING cancel_requested",
+                (time.time() + ttl, job_id, owner, RUNNING),
+            ).fetchone()
+        return row is not None and not row[0]
+
+    def finish(
+        self,
+        job_id: str,
+        owner: str,
+        status: str,
+        answer: Optional[str] = None,
+        error: Optional[str] = None,
+        documents: Optional[dict[str, str]] = None,
+    ) -> bool:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self.conn.execute(
+                    "UPDATE jobs SET status = ?, answer = ?, error = ?, finished_at = ?, lease_expires_at = NULL"
+                    " WHERE id = ? AND owner = ? AND status = ?",
+                    (status, answer, error, time.time(), job_id, owner, RUNNING),
+                ).rowcount
+                if updated:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO job_documents VALUES (?, ?, ?)",
+                        [(job_id, name, content) for name, content in (documents or {}).items()],
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return bool(updated)
+
+    def defer(self, job_id: str, owner: str, delay: float) -> bool:
+        """Give a claimed job back, to be claimed again in ``delay`` seconds, as if it had not been."""
+        with self.lock:
+            n = self.conn.execute(
+                "UPDATE jobs SET owner = NULL, lease_expires_at = ?, attempts = attempts - 1"
+                " WHERE id = ? AND owner = ? AND status = ?",
+                (time.time() + delay, job_id, owner, RUNNING),
+            ).rowcount
+        return bool(n)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job now, or ask the worker of a running one to stop."""
+        with self.lock:
+            n = self.conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED),
+            ).rowcount
+            n += self.conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING)
+            ).rowcount
+        return bool(n)
+
+    def next_seq(self, job_id: str) -> int:
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(seq) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def append_events(self, job_id: str, events: list[dict[str, Any]]):
+        with self.lock:
+            self.conn.executemany(
+                # a worker that lost its job may still write a few events
+                "INSERT OR IGNORE INTO job_events VALUES (?, ?, ?)",
+                [(job_id, e["seq"], json.dumps(e, ensure_ascii=False)) for e in events],
+            )
+
+    def events(self, job_id: str, offset: int = 0, limit: int = 1000) -> list[dict[str, Any]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT event FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def documents(self, job_id: str) -> dict[str, str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT name, content FROM job_documents WHERE job_id = ?", (job_id,)).fetchall()
+        return dict(rows)
+
+    def counts(self) -> dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class JobQueue:
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 2,
+        lease_ttl: float = 60,
+        poll_interval: float = 1.0,
+        flush_interval: float = 0.25,
+        run_lease_ttl: float = 120,
+    ):
+        self.logger = get_logger("jobs")
+        self.store = store
+        self.workers = workers
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.run_lease_ttl = run_lease_ttl
+        self.owner = uuid4().hex
+        self.tasks: list[asyncio.Task] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.stopping = False
+
+    def start(self):
+        self.stopping = False
+        self.wakeup = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # running jobs keep their lease until it expires, then another worker resumes them
+        self.stopping = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def submit(self, question: str) -> str:
+        job_id = await asyncio.to_thread(self.store.submit, question)
+        if self.wakeup is not None:
+            self.wakeup.set()
+        return job_id
+
+    async def _work(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, self.owner, self.lease_ttl)
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                if self.stopping:
+                    raise
+                # a cancellation meant for something else must not stop the worker
+                asyncio.current_task().uncancel()
+                self.logger.warning("job %s: cancelled, left to its lease", job["id"])
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.logger.exception("job %s failed", job["id"])
+
+    async def _run(self, job: dict[str, Any]):
+        job_id = job["id"]
+        # the lease /rest/v1/question and uploads take on a thread (see api.py): the job's thread
+        # id is its id, so a question asked on it must not run alongside the job
+        shared = registry.get("shared_state")
+        lease_owner = uuid4().hex
+        if not await asyncio.to_thread(shared.acquire, f"run:{job_id}", lease_owner, self.run_lease_ttl):
+            self.logger.info("job %s: its thread is in use, trying again later", job_id)
+            await asyncio.to_thread(self.store.defer, job_id, self.owner, self.poll_interval)
+            return
+        try:
+            await self._answer(job, lease_owner)
+        finally:
+            await asyncio.to_thread(shared.release, f"run:{job_id}", lease_owner)
+
+    async def _answer(self, job: dict[str, Any], lease_owner: str):
+        job_id = job["id"]
+        shared = registry.get("shared_state")
+        seq = await asyncio.to_thread(self.store.next_seq, job_id)
+        pending: list[dict[str, Any]] = []
+
+        async def flush():
+            nonlocal seq, pending
+            events = []
+            for e in merge_deltas(pending):
+                events.append({"seq": seq, **e})
+                seq += 1
+            pending = []
+            if events:
+                await asyncio.to_thread(self.store.append_events, job_id, events)
+
+        pending.append({"type": "status", "status": RUNNING, "attempt": job["attempts"]})
+        graph = get_super_graph()
+        config = run_config(job_id)
+        # a job claimed again after its worker died picks up after the last finished node
+        state = await graph.aget_state(config)
+        graph_input = None if state.next else {"messages": [("user", job["question"])]}
+
+        async def run() -> str:
+            flush_at = time.monotonic() + self.flush_interval
+            async for event in message_events(graph.astream(graph_input, config, stream_mode="messages")):
+                pending.append(event)
+                if time.monotonic() >= flush_at:
+                    flush_at = time.monotonic() + self.flush_interval
+                    await flush()
+            return (await graph.aget_state(config)).values["messages"][-1].content
+
+        # the run is a task of its own, so that the heartbeat stops it and nothing after it
+        running = asyncio.create_task(run())
+
+        # renew the leases meanwhile; stop the job if it was cancelled or taken over
+        async def heartbeat():
+            while not running.done():
+                await asyncio.sleep(min(self.lease_ttl, self.run_lease_ttl) / 3)
+                renewed = await asyncio.to_thread(self.store.renew, job_id, self.owner, self.lease_ttl)
+                if renewed:
+                    renewed = await asyncio.to_thread(shared.acquire, f"run:{job_id}", lease_owner, self.run_lease_ttl)
+                if not renewed:
+                    running.cancel()
+                    return
+
+        status, answer, error = DONE, None, None
+        beat = asyncio.create_task(heartbeat())
+        try:
+            answer = await running
+        except asyncio.CancelledError:
+            if self.stopping:
+                await asyncio.gather(running, return_exceptions=True)
+                await flush()
+                # the job resumes elsewhere, from its checkpoint and the documents on disk
+                workspaces = registry.peek("workspaces")
+                if workspaces is not None:
+                    await workspaces.close(job_id)
+                raise
+            status = CANCELLED
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.logger.exception("job %s failed", job_id)
+            status, error = FAILED, str(e)
+        finally:
+            beat.cancel()
+
+        documents = {}
+        workspaces = registry.peek("workspaces")
+        if workspaces is not None:
+            workspace = workspaces.get(job_id)
+            # a job resumed here also wrote documents before, which are only on disk
+            for name in await workspace.saved_names():
+                documents[name] = (await workspace.document(name)).text()
+            await workspaces.close(job_id)
+        pending.append({"type": "status", "status": status, **({"error": error} if error else {})})
+        await flush()
+        await asyncio.to_thread(self.store.finish, job_id, self.owner, status, answer, error, documents)
+
+    async def follow(self, job_id: str, offset: int = 0) -> AsyncIterator[dict[str, Any]]:
+        """Events of a job from ``offset`` on, then new ones as they are written, until it is over."""
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            if job is None:
+                raise NotFound(f"Job {job_id} not found")
+            events = await asyncio.to_thread(self.store.events, job_id, offset)
+            for e in events:
+                yield e
+            offset += len(events)
+            if events:
+                continue
+            if job["status"] not in (QUEUED, RUNNING):
+                return
+            await asyncio.sleep(self.flush_interval)
+
+    async def metrics(self) -> dict[str, Any]:
+        r: dict[str, Any] = {f"jobs_{k}": v for k, v in (await asyncio.to_thread(self.store.counts)).items()}
+        r["workers"] = len(self.tasks)
+        return r
+
+
+def make_job_queue() -> JobQueue:
+    return JobQueue(
+        JobStore(settings.job_db),
+        workers=settings.job_workers,
+        lease_ttl=settings.job_lease_ttl,
+        poll_interval=settings.job_poll_interval,
+        run_lease_ttl=settings.run_lease_ttl,
+    )
+
+
+registry.register("jobs", make_job_queue)
+
+
+def get_job_queue() -> JobQueue:
+    return registry.get("jobs")
+
+
+async def serve():
+    queue = get_job_queue()
+    queue.start()
+    await asyncio.gather(*queue.tasks)
+
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -1,5 +1,8 @@
+import atexit
 import logging
+import queue
 from logging import Logger
+from logging.handlers import QueueHandler, QueueListener
 
 from pydantic import BaseModel
 
@@ -9,13 +12,14 @@ app_logger = logging.getLogger("app")
 class LogConfig(BaseModel):
     level: str
     format: str
+    # write records from a background thread, so handlers never block the event loop
+    queued: bool = True
 
 
 def get_logger(name: str, level: str | int = "auto") -> logging.Logger:
     r = logging.getLogger(f"{app_logger.name}.{name}")
-    if level == "auto":
-        level = app_logger.getEffectiveLevel()
-    r.setLevel(level)
+    # "auto" follows the app logger, whether init_loggers has run yet or not
+    r.setLevel(logging.NOTSET if level == "auto" else level)
     return r
 
 
@@ -26,6 +30,13 @@ def init_loggers(cfg: LogConfig) -> Logger:
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    app_logger.addHandler(console_handler)
+    if cfg.queued:
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, console_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        app_logger.addHandler(QueueHandler(log_queue))
+    else:
+        app_logger.addHandler(console_handler)
 
     return app_logger
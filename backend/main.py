@@ -1,6 +1,13 @@
 import uvicorn
 
-from api import fastapi_app
+from settings import settings
 
 if __name__ == "__main__":
-    uvicorn.run(fastapi_app, host="0.0.0.0", port=4080)
\ No newline at end of file
+    # The app is passed by name so that each worker process imports it itself.
+    uvicorn.run(
+        "api:fastapi_app",
+        host=settings.host,
+        port=settings.port,
+        workers=settings.workers,
+        timeout_graceful_shutdown=settings.graceful_timeout,
+    )
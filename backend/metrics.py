@@ -0,0 +1,135 @@
+import asyncio
+
+from registry import registry
+from routing import routing_stats
+from tracing import MetricsWriter, write_trace_metrics
+
+##########################################################################################
+# /metrics
+#
+# Prometheus text format for the traces (see tracing.py) and the counters kept by the caches,
+# the schedulers and the routing rules. Only components that have been built are reported, so
+# scraping builds nothing. Values are per worker process, except the run counters, which are
+# shared by the workers (see shared.py). Those, and the job counts, are SQLite queries, run in a
+# thread so that a scrape does not hold up the event loop.
+
+
+async def render_metrics() -> str:
+    out = MetricsWriter()
+
+    tracer = registry.peek("tracer")
+    if tracer is not None:
+        write_trace_metrics(out, tracer)
+
+    for supervisor, paths in routing_stats.snapshot().items():
+        for path, count in paths.items():
+            out.add(
+                "routing_decisions_total",
+                "counter",
+                "Routing decisions by path.",
+                count,
+                supervisor=supervisor,
+                path=path,
+            )
+
+    response_cache = registry.peek("response_cache")
+    if response_cache is not None:
+        for key, value in sorted(response_cache.metrics().items()):
+            out.add("response_cache", "gauge", "Response cache counters and size.", value, stat=key)
+
+    search = registry.peek("search")
+    if search is not None:
+        for key, value in sorted(search.metrics().items()):
+            out.add("search_cache", "gauge", "Search cache counters and size.", value, stat=key)
+
+    seen = set()
+    for name in ("llm_scheduler", "llm_small_scheduler", "search_scheduler"):
+        scheduler = registry.peek(name)
+        # the small model may share the large one's scheduler
+        if scheduler is None or id(scheduler) in seen:
+            continue
+        seen.add(id(scheduler))
+        for key, value in sorted(scheduler.metrics().items()):
+            out.add(
+                "scheduler",
+                "gauge",
+                "Scheduler queue depth, waits (seconds) and admissions.",
+                value,
+                scheduler=scheduler.name,
+                stat=key,
+            )
+
+    tiers = registry.peek("model_tiers")
+    if tiers is not None:
+        for (role, tier), count in sorted(tiers.calls.items()):
+            out.add(
+                "model_tier_calls_total",
+                "counter",
+                "Node calls by role and the model tier serving them.",
+                count,
+                role=role,
+                tier=tier,
+            )
+        for key, value in sorted(tiers.metrics().items()):
+            out.add(
+                "model_tiers",
+                "gauge",
+                "Model tier degradations, fallbacks, state and latency p90 (seconds).",
+                value,
+                stat=key,
+            )
+
+    sandbox = registry.peek("sandbox")
+    if sandbox is not None:
+        for key, value in sorted(sandbox.metrics().items()):
+            out.add("sandbox", "gauge", "Sandbox calls, failures and workers.", value, stat=key)
+
+    batches = registry.peek("batches")
+    if batches is not None:
+        for key, value in sorted(batches.metrics().items()):
+            out.add("batches", "gauge", "Batches kept and their questions by status.", value, stat=key)
+
+    jobs = registry.peek("jobs")
+    if jobs is not None:
+        for key, value in sorted((await jobs.metrics()).items()):
+            out.add(
+                "jobs",
+                "gauge",
+                "Background jobs by status, over all workers, and job tasks of this worker.",
+                value,
+                stat=key,
+            )
+
+    research_share = registry.peek("research_share")
+    if research_share is not None:
+        for key, value in sorted(research_share.metrics().items()):
+            out.add(
+                "research_share",
+                "gauge",
+                "Research runs of batches, and answers shared between their questions.",
+                value,
+                stat=key,
+            )
+
+    speculation = registry.peek("speculation")
+    if speculation is not None:
+        for key, value in sorted(speculation.metrics().items()):
+            out.add(
+                "speculation",
+                "gauge",
+                "Speculative research runs: started, hits, misses, hit rate and seconds wasted.",
+                value,
+                stat=key,
+            )
+
+    workspaces = registry.peek("workspaces")
+    if workspaces is not None:
+        for key, value in sorted(workspaces.metrics().items()):
+            out.add("workspaces", "gauge", "Documents held in memory by the runs under way.", value, stat=key)
+
+    shared = registry.peek("shared_state")
+    if shared is not None:
+        for name, value in sorted((await asyncio.to_thread(shared.counters, "runs:")).items()):
+            out.add("runs_total", "counter", "Question runs, over all workers.", value, state=name.split(":", 1)[1])
+
+    return out.text()
@@ -2,8 +2,9 @@ from __future__ import annotations
 
 import base64
 import mimetypes
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Optional, Protocol
 
 from charset_normalizer import from_bytes
 from fastapi import Request, UploadFile
@@ -36,14 +37,21 @@ def guess_mime_type(p: str) -> str:
     return r or "application/octet-stream"
 
 
-def detect_encoding(file_bytes: bytes) -> str:
+def detect_encoding(file_bytes: bytes, sample_bytes: int = 65536) -> str:
     """
     Detect the encoding of a given byte sequence using charset-normalizer.
 
-    :param file_bytes: The content of the file in bytes.
+    :param file_bytes: The content of the file in bytes, or its head.
+    :param sample_bytes: Only the first sample_bytes are looked at.
     :return: Detected encoding as a string.
     """
-    result = from_bytes(file_bytes).best()
+    sample = file_bytes[:sample_bytes]
+    result = from_bytes(sample).best()
+    if result is None and len(file_bytes) > sample_bytes:
+        # the sample may end within a multi-byte character: end it at a line break instead
+        cut = sample.rfind(b"\n")
+        if cut > 0:
+            result = from_bytes(sample[: cut + 1]).best()
     return result.encoding if result is not None else ""
 
 
@@ -98,16 +106,26 @@ async def transfer_file(
     return got, head
 
 
+class AsyncReader(Protocol):
+    async def read(self, size: int = -1) -> bytes: ...
+
+
 async def transfer_stream(
-    src: UploadFile, dst_fs: AsyncFileSystem, dst_p: str, buf_size: int = 65536
+    src: UploadFile | AsyncReader,
+    dst_fs: AsyncFileSystem | None,
+    dst_p: str,
+    buf_size: int = 65536,
 ) -> tuple[int, bytes]:
+    """
+    Copy src to dst_p chunk by chunk. With no dst_fs, src is only read through.
+    """
     if buf_size is None or buf_size <= 2048:
         buf_size = 2048
 
     got = 0
     head: bytes = b""
 
-    async with dst_fs.open(dst_p, "wb") as dst_f:
+    async with dst_fs.open(dst_p, "wb") if dst_fs is not None else nullcontext() as dst_f:
         while True:
             chunk = await src.read(buf_size)  # Use the async read method
             if not chunk:
@@ -115,7 +133,8 @@ async def transfer_stream(
             if not head:
                 head = chunk
 
-            await dst_f.write(chunk)
+            if dst_f is not None:
+                await dst_f.write(chunk)
             got += len(chunk)
 
     return got, head
@@ -1,119 +1,119 @@
-from typing import Literal
 import asyncio
-from langchain_core.messages import HumanMessage, AIMessageChunk
-from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
+from typing import Optional
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.language_models.chat_models import BaseChatModel
 from langgraph.prebuilt import create_react_agent
 
 from langgraph.graph import StateGraph, MessagesState, START
-from langgraph.types import Command
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
 
-from tools import write_document, edit_document, read_document, create_outline, python_repl_tool, make_supervisor_node
+from context import ContextManager
+from registry import registry
+from tiers import ModelTiers, for_role
+from tools import read_document, retrieve, make_supervisor_node, make_worker_node
 
 ##############################################################################
 # Document Writing Team
 
-# Create the document writing team below using a similar approach. 
+# Create the document writing team below using a similar approach.
 # This time, we will give each agent access to different file-writing tools.
 #
 # Note that we are giving file-system access to our agent here, which is not safe in all cases.
 
 
-llm = ChatOpenAI(model="gpt-4o")
-
-doc_writer_agent = create_react_agent(
-    llm,
-    tools=[write_document, edit_document, read_document],
-    state_modifier=(
-        "You can read, write and edit documents based on note-taker's outlines. "
-        "Don't ask follow-up questions."
-    ),
-)
-
-
-def doc_writing_node(state: MessagesState) -> Command[Literal["doc_writing_team_supervisor"]]:
-    result = doc_writer_agent.invoke(state)
-
-    last_response = result["messages"][-1].content
-    return Command(
-        update={
-            "messages": [
-                HumanMessage(content=last_response, name="doc_writer")
-            ]
-        },
-        # We want our workers to ALWAYS "report back" to the doc_writing_team_supervisor when done
-        goto="doc_writing_team_supervisor",
+def make_paper_writing_graph(
+    llm: BaseChatModel | ModelTiers,
+    checkpointer: Optional[BaseCheckpointSaver] = None,
+    context: Optional[ContextManager] = None,
+) -> CompiledStateGraph:
+    def state_modifier(prompt: Optional[str] = None):
+        return context.state_modifier(prompt) if context else prompt
+
+    # Not in the graph for now (see below); they need write_document, edit_document and
+    # python_repl_tool from tools.
+    #
+    # doc_writer_agent = for_role(
+    #     llm,
+    #     "writer",
+    #     lambda model: create_react_agent(
+    #         model,
+    #         tools=[write_document, edit_document, read_document, retrieve],
+    #         state_modifier=state_modifier(
+    #             "You can read, write and edit documents based on note-taker's outlines. "
+    #             "Don't ask follow-up questions."
+    #         ),
+    #     ),
+    # )
+    # # We want our workers to ALWAYS "report back" to the doc_writing_team_supervisor when done
+    # doc_writing_node = make_worker_node(
+    #     doc_writer_agent, "doc_writer", "doc_writing_team_supervisor", context=context
+    # )
+    #
+    # chart_generating_agent = for_role(
+    #     llm,
+    #     "writer",
+    #     lambda model: create_react_agent(
+    #         model, tools=[read_document, python_repl_tool], state_modifier=state_modifier()
+    #     ),
+    # )
+    # # We want our workers to ALWAYS "report back" to the doc_writing_team_supervisor when done
+    # chart_generating_node = make_worker_node(
+    #     chart_generating_agent, "chart_generator", "doc_writing_team_supervisor", context=context
+    # )
+
+    note_taking_agent = for_role(
+        llm,
+        "notes",
+        lambda model: create_react_agent(
+            model,
+            tools=[read_document, retrieve],
+            state_modifier=state_modifier(
+                # was: "You can read documents and create outlines for the document writer. "
+                "You can read documents and create outlines. "
+                "Don't ask follow-up questions."
+            ),
+        ),
     )
-
-
-note_taking_agent = create_react_agent(
-    llm,
-    tools=[read_document],
-    state_modifier=(
-        "You can read documents and create outlines. "#"You can read documents and create outlines for the document writer. "
-        "Don't ask follow-up questions."
-    ),
-)
-
-
-def note_taking_node(state: MessagesState, config: RunnableConfig) -> Command[Literal["doc_writing_team_supervisor"]]:
-    result = note_taking_agent.invoke(state, config)
-
-    last_response = result["messages"][-1].content
-    return Command(
-        update={
-            "messages": [
-                HumanMessage(content=last_response, name="note_taker")
-            ]
-        },
-        # We want our workers to ALWAYS "report back" to the doc_writing_team_supervisor when done
-        goto="doc_writing_team_supervisor",
+    # We want our workers to ALWAYS "report back" to the doc_writing_team_supervisor when done
+    note_taking_node = make_worker_node(
+        note_taking_agent, "note_taker", "doc_writing_team_supervisor", context=context
     )
 
+    doc_writing_supervisor_node = make_supervisor_node(
+        llm, ["note_taker"], name="doc_writing_team_supervisor", context=context
+    )
 
-chart_generating_agent = create_react_agent(
-    llm, tools=[read_document, python_repl_tool]
-)
-
+    # With the objects themselves created, we can form the graph.
 
-def chart_generating_node(state: MessagesState) -> Command[Literal["doc_writing_team_supervisor"]]:
-    result = chart_generating_agent.invoke(state)
+    # Create the graph here
+    paper_writing_builder = StateGraph(MessagesState)
+    paper_writing_builder.add_node("doc_writing_team_supervisor", doc_writing_supervisor_node)
+    #paper_writing_builder.add_node("doc_writer", doc_writing_node)
+    paper_writing_builder.add_node("note_taker", note_taking_node)
+    #paper_writing_builder.add_node("chart_generator", chart_generating_node)
 
-    last_response = result["messages"][-1].content
-    return Command(
-        update={
-            "messages": [
-                HumanMessage(
-                    content=last_response, name="chart_generator"
-                )
-            ]
-        },
-        # We want our workers to ALWAYS "report back" to the doc_writing_team_supervisor when done
-        goto="doc_writing_team_supervisor",
-    )
+    paper_writing_builder.add_edge(START, "doc_writing_team_supervisor")
+    # Without a checkpointer of its own, the graph uses its parent's when run as a sub-graph.
+    return paper_writing_builder.compile(checkpointer=checkpointer)
 
 
-doc_writing_supervisor_node = make_supervisor_node(
-    llm, ["note_taker"]
+registry.register(
+    "paper_writing_graph",
+    lambda: make_paper_writing_graph(registry.get("model_tiers"), context=registry.get("context")),
 )
 
-# With the objects themselves created, we can form the graph.
 
-# Create the graph here
-paper_writing_builder = StateGraph(MessagesState)
-paper_writing_builder.add_node("doc_writing_team_supervisor", doc_writing_supervisor_node)
-#paper_writing_builder.add_node("doc_writer", doc_writing_node)
-paper_writing_builder.add_node("note_taker", note_taking_node)
-#paper_writing_builder.add_node("chart_generator", chart_generating_node)
+def get_paper_writing_graph() -> CompiledStateGraph:
+    return registry.get("paper_writing_graph")
 
-paper_writing_builder.add_edge(START, "doc_writing_team_supervisor")
-paper_writing_graph = paper_writing_builder.compile()
 
 # from IPython.display import Image
 
-# output_path = "paper_writing_graph.png" 
+# output_path = "paper_writing_graph.png"
 
-# png = Image(paper_writing_graph.get_graph().draw_mermaid_png())
+# png = Image(get_paper_writing_graph().get_graph().draw_mermaid_png())
 # png_data = png.data
 # with open(output_path, "wb") as file:
 #     file.write(png_data)
@@ -121,7 +121,7 @@ paper_writing_graph = paper_writing_builder.compile()
 # print(f"Graph has been saved to {output_path}")
 
 async def test_paper_writing_team():
-    async for messages in paper_writing_graph.astream(
+    async for messages in get_paper_writing_graph().astream(
         {
             "messages": [
                 (
@@ -143,4 +143,4 @@ async def test_paper_writing_team():
 
 if __name__ == "__main__":
     asyncio.run(test_paper_writing_team())
-    print()
\ No newline at end of file
+    print()
@@ -0,0 +1,176 @@
+import threading
+from typing import Any, Callable
+
+from settings import settings
+
+##########################################################################################
+# Shared components
+#
+# Models, graphs and tool backends are registered here by name and built on first use, so
+# importing the API costs no client construction or graph compilation, and every module gets
+# the same instances (one OpenAI client and connection pool per model). Benchmarks replace
+# components with set() before anything asks for them.
+
+
+class Registry:
+    def __init__(self):
+        self.factories: dict[str, Callable[[], Any]] = {}
+        self.instances: dict[str, Any] = {}
+        # reentrant: factories get the components they depend on while being built
+        self.lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self.lock:
+            self.factories[name] = factory
+
+    def get(self, name: str) -> Any:
+        try:
+            return self.instances[name]
+        except KeyError:
+            pass
+        with self.lock:
+            if name not in self.instances:
+                if name not in self.factories:
+                    raise KeyError(f"Nothing registered as '{name}'")
+                self.instances[name] = self.factories[name]()
+            return self.instances[name]
+
+    def set(self, name: str, instance: Any) -> None:
+        with self.lock:
+            self.instances[name] = instance
+
+    def reset(self, name: str | None = None) -> None:
+        """Forget built instances (all of them without ``name``); they are rebuilt on next use."""
+        with self.lock:
+            if name is None:
+                self.instances.clear()
+            else:
+                self.instances.pop(name, None)
+
+    def peek(self, name: str) -> Any:
+        """The instance if it has been built, without building it."""
+        return self.instances.get(name)
+
+    def built(self) -> list[str]:
+        return list(self.instances)
+
+
+registry = Registry()
+
+
+def make_chat_model(model: str, scheduler):
+    # imported here: langchain_openai and openai take most of the import time of the backend
+    from langchain_openai import ChatOpenAI  # pylint: disable=import-outside-toplevel
+
+    from scheduler import UsageCallback  # pylint: disable=import-outside-toplevel
+
+    registry.get("response_cache")
+    return ChatOpenAI(
+        model=model,
+        rate_limiter=scheduler,
+        callbacks=[UsageCallback(scheduler)] if scheduler else None,
+        # report token usage when streaming too, for the scheduler's tokens/min budget
+        stream_usage=True,
+    )
+
+
+def make_llm():
+    return make_chat_model(settings.llm_model, registry.get("llm_scheduler"))
+
+
+def make_small_llm():
+    if settings.llm_small_model == settings.llm_model:
+        return registry.get("llm")
+    return make_chat_model(settings.llm_small_model, registry.get("llm_small_scheduler"))
+
+
+def make_model_scheduler(model: str, requests_per_minute: float, tokens_per_minute: float):
+    from scheduler import Scheduler  # pylint: disable=import-outside-toplevel
+
+    if not settings.scheduler:
+        return None
+    return Scheduler(
+        model,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        burst_seconds=settings.scheduler_burst_seconds,
+        priority_boost=settings.scheduler_priority_boost,
+        max_request_tokens=settings.scheduler_max_request_tokens,
+    )
+
+
+def make_llm_scheduler():
+    return make_model_scheduler(settings.llm_model, settings.llm_requests_per_minute, settings.llm_tokens_per_minute)
+
+
+def make_small_llm_scheduler():
+    if settings.llm_small_model == settings.llm_model:
+        return registry.get("llm_scheduler")
+    return make_model_scheduler(
+        settings.llm_small_model, settings.llm_small_requests_per_minute, settings.llm_small_tokens_per_minute
+    )
+
+
+def make_model_tiers():
+    from tiers import ModelTiers, Tier  # pylint: disable=import-outside-toplevel
+
+    window = settings.llm_slo_window
+    return ModelTiers(
+        [
+            Tier("small", registry.get("llm_small"), registry.get("llm_small_scheduler"), window),
+            Tier("large", registry.get("llm"), registry.get("llm_scheduler"), window),
+        ],
+        roles={
+            "router": settings.llm_router_tier,
+            "research": settings.llm_research_tier,
+            "notes": settings.llm_notes_tier,
+            "writer": settings.llm_writer_tier,
+        },
+        fallback=settings.llm_fallback,
+        slo_seconds=settings.llm_slo_seconds,
+        max_queue_wait=settings.llm_max_queue_wait,
+        cooldown=settings.llm_fallback_cooldown,
+    )
+
+
+def make_response_cache():
+    from cache import init_response_cache  # pylint: disable=import-outside-toplevel
+
+    return init_response_cache()
+
+
+def make_context():
+    from context import make_context_manager  # pylint: disable=import-outside-toplevel
+
+    return make_context_manager(registry.get("llm"))
+
+
+def make_shared_state():
+    from shared import SharedState  # pylint: disable=import-outside-toplevel
+
+    return SharedState(settings.shared_state_db)
+
+
+def make_tracer():
+    from tracing import Tracer  # pylint: disable=import-outside-toplevel
+
+    return Tracer(
+        settings.trace_jsonl or None,
+        input_cost_per_mtok=settings.llm_input_cost_per_mtok,
+        output_cost_per_mtok=settings.llm_output_cost_per_mtok,
+        prices={
+            settings.llm_small_model: (settings.llm_small_input_cost_per_mtok, settings.llm_small_output_cost_per_mtok),
+            settings.llm_model: (settings.llm_input_cost_per_mtok, settings.llm_output_cost_per_mtok),
+        },
+    )
+
+
+registry.register("llm", make_llm)
+registry.register("llm_scheduler", make_llm_scheduler)
+registry.register("llm_small", make_small_llm)
+registry.register("llm_small_scheduler", make_small_llm_scheduler)
+registry.register("model_tiers", make_model_tiers)
+registry.register("response_cache", make_response_cache)
+registry.register("context", make_context)
+registry.register("shared_state", make_shared_state)
+registry.register("tracer", make_tracer)
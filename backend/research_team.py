@@ -1,80 +1,91 @@
-from typing import Literal
 import asyncio
-from langchain_core.messages import HumanMessage, AIMessageChunk
-from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
+from typing import Optional
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.language_models.chat_models import BaseChatModel
 from langgraph.prebuilt import create_react_agent
 
 from langgraph.graph import StateGraph, MessagesState, START
-from langgraph.types import Command
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
 
-from tools import tavily_tool, scrape_webpages, make_supervisor_node
+from context import ContextManager
+from registry import registry
+from routing import RoutingRule
+from tiers import ModelTiers, for_role
+from tools import tavily_tool, scrape_webpages, retrieve, make_supervisor_node, make_worker_node
 
 #######################################################################################################################
 # Define Agent Teams
 # Now we can get to define our hierarchical teams. "Choose your player!"
 
 # Research Team
-# The research team will have a search agent and a web scraping "research_agent" as the two worker nodes. 
+# The research team will have a search agent and a web scraping "research_agent" as the two worker nodes.
 # Let's create those, as well as the team research_team_supervisor.
 
-llm = ChatOpenAI(model="gpt-4o")
-
-search_agent = create_react_agent(llm, tools=[tavily_tool])
 
+def make_research_graph(
+    llm: BaseChatModel | ModelTiers,
+    parallel: bool = False,
+    rules: Optional[list[RoutingRule]] = None,
+    checkpointer: Optional[BaseCheckpointSaver] = None,
+    context: Optional[ContextManager] = None,
+) -> CompiledStateGraph:
+    state_modifier = context.state_modifier() if context else None
 
-def search_node(state: MessagesState) -> Command[Literal["research_team_supervisor"]]:
-    result = search_agent.invoke(state)
-
-    last_response = result["messages"][-1].content
-    return Command(
-        update={
-            "messages": [
-                HumanMessage(content=last_response, name="search")
-            ]
-        },
-        # We want our workers to ALWAYS "report back" to the research_team_supervisor when done
-        goto="research_team_supervisor",
+    search_agent = for_role(
+        llm,
+        "research",
+        lambda model: create_react_agent(model, tools=[tavily_tool, retrieve], state_modifier=state_modifier),
     )
+    # We want our workers to ALWAYS "report back" to the research_team_supervisor when done
+    search_node = make_worker_node(search_agent, "search", "research_team_supervisor", context=context)
 
+    web_scraper_agent = for_role(
+        llm,
+        "research",
+        lambda model: create_react_agent(model, tools=[scrape_webpages, retrieve], state_modifier=state_modifier),
+    )
+    # We want our workers to ALWAYS "report back" to the research_team_supervisor when done
+    web_scraper_node = make_worker_node(web_scraper_agent, "web_scraper", "research_team_supervisor", context=context)
+
+    research_supervisor_node = make_supervisor_node(
+        llm,
+        ["search", "web_scraper"],
+        parallel=parallel,
+        rules=rules,
+        name="research_team_supervisor",
+        context=context,
+    )
 
-web_scraper_agent = create_react_agent(llm, tools=[scrape_webpages])
-
+    # Now that we've created the necessary components, defining their interactions is easy.
+    # Add the nodes to the team graph, and define the edges, which determine the transition criteria.
 
-def web_scraper_node(state: MessagesState, config: RunnableConfig) -> Command[Literal["research_team_supervisor"]]:
-    result = web_scraper_agent.invoke(state, config)
+    research_builder = StateGraph(MessagesState)
+    research_builder.add_node("research_team_supervisor", research_supervisor_node)
+    research_builder.add_node("search", search_node)
+    research_builder.add_node("web_scraper", web_scraper_node)
 
-    last_response = result["messages"][-1].content
-    return Command(
-        update={
-            "messages": [
-                HumanMessage(content=last_response, name="web_scraper")
-            ]
-        },
-        # We want our workers to ALWAYS "report back" to the research_team_supervisor when done
-        goto="research_team_supervisor",
-    )
+    research_builder.add_edge(START, "research_team_supervisor")
+    # Without a checkpointer of its own, the graph uses its parent's when run as a sub-graph.
+    return research_builder.compile(checkpointer=checkpointer)
 
 
-research_supervisor_node = make_supervisor_node(llm, ["search", "web_scraper"])
+registry.register(
+    "research_graph", lambda: make_research_graph(registry.get("model_tiers"), context=registry.get("context"))
+)
 
-# Now that we've created the necessary components, defining their interactions is easy. 
-# Add the nodes to the team graph, and define the edges, which determine the transition criteria.
 
-research_builder = StateGraph(MessagesState)
-research_builder.add_node("research_team_supervisor", research_supervisor_node)
-research_builder.add_node("search", search_node)
-research_builder.add_node("web_scraper", web_scraper_node)
+def get_research_graph() -> CompiledStateGraph:
+    return registry.get("research_graph")
 
-research_builder.add_edge(START, "research_team_supervisor")
-research_graph = research_builder.compile()
 
 ###############################################################################
 # from IPython.display import Image
 
-# output_path = "research_graph.png" 
+# output_path = "research_graph.png"
 
-# png = Image(research_graph.get_graph().draw_mermaid_png())
+# png = Image(get_research_graph().get_graph().draw_mermaid_png())
 # png_data = png.data
 # with open(output_path, "wb") as file:
 #     file.write(png_data)
@@ -85,7 +96,7 @@ research_graph = research_builder.compile()
 # We can give this team work directly. Try it out below.
 
 async def test_research_team():
-    async for messages in research_graph.astream(
+    async for messages in get_research_graph().astream(
         {"messages": [("user", "when is Taylor Swift's next tour?")]},
         {"recursion_limit": 100},
         stream_mode="messages"
@@ -100,4 +111,4 @@ async def test_research_team():
 
 if __name__ == "__main__":
     asyncio.run(test_research_team())
-    print()
\ No newline at end of file
+    print()
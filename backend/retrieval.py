@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import itertools
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from errs import QuotaExceeded
+
+##########################################################################################
+# Retrieval over what a run fetched
+#
+# Search results and scraped pages (and uploaded documents) are cut into passages of about
+# chunk_chars characters, at paragraph, line, sentence or word boundaries, and added to the
+# index of the run (see workspace.py). Agents then ask for the passages relevant to what they
+# are after (the retrieve tool) instead of reading whole pages.
+#
+# The index is BM25 over postings kept in NumPy arrays. New passages go to a buffer, merged
+# into term-sorted arrays by the next search; a search scores the postings of all query terms
+# in one vectorized pass. With an Embeddings model, the next search also embeds the new
+# passages, in one batch, into a matrix of unit vectors, and the score mixes BM25 (scaled to
+# [0, 1]) with cosine similarity, by semantic_weight.
+
+_TOKEN = re.compile(r"\w+")
+# where to cut a passage, best first
+_BREAKS = ("\n\n", "\n", ". ", " ")
+
+
+def tokens(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class Chunker:
+    """Cuts text, fed piece by piece, into passages of about ``size`` characters."""
+
+    def __init__(self, size: int = 1200):
+        self.size = size
+        self.buffer = ""
+
+    def _cut(self) -> int:
+        for sep in _BREAKS:
+            at = self.buffer.rfind(sep, self.size // 2, self.size)
+            if at != -1:
+                return at + len(sep)
+        return self.size
+
+    def feed(self, text: str) -> list[str]:
+        """The passages completed by ``text``."""
+        self.buffer += text
+        passages = []
+        while len(self.buffer) > self.size:
+            cut = self._cut()
+            passage, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:]
+            if passage:
+                passages.append(passage)
+        return passages
+
+    def close(self) -> list[str]:
+        passage, self.buffer = self.buffer.strip(), ""
+        return [passage] if passage else []
+
+
+def chunk_text(text: str, size: int = 1200) -> list[str]:
+    chunker = Chunker(size)
+    return chunker.feed(text) + chunker.close()
+
+
+@dataclass
+class Passage:
+    source: str
+    title: str
+    text: str
+
+    def format(self) -> str:
+        return f'<Passage source="{self.source}" title="{self.title}">\n{self.text}\n</Passage>'
+
+
+class RunIndex:
+    def __init__(
+        self,
+        embeddings: Optional[Embeddings] = None,
+        chunk_chars: int = 1200,
+        max_passages: int = 100000,
+        semantic_weight: float = 0.5,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        self.embeddings = embeddings
+        self.chunk_chars = chunk_chars
+        self.max_passages = max_passages
+        self.semantic_weight = semantic_weight
+        self.k1 = k1
+        self.b = b
+        self.passages: list[Passage] = []
+        self.sources: dict[str, int] = {}
+        self.vocab: dict[str, int] = {}
+        # hashes of the passages indexed, so a page fetched twice is indexed once
+        self.seen: set[bytes] = set()
+        # sources removed: their passages are never returned, and keep their slots
+        self.removed: set[int] = set()
+
+        # postings sorted by term: those of term t are [indptr[t], indptr[t + 1])
+        self.terms = np.zeros(0, np.int32)
+        self.docs = np.zeros(0, np.int32)
+        self.tfs = np.zeros(0, np.float32)
+        self.indptr = np.zeros(1, np.int64)
+        self.lengths = np.zeros(0, np.float32)
+        self.source_ids = np.zeros(0, np.int32)
+        # passages added since the last merge
+        self.pending: list[tuple[np.ndarray, np.ndarray, int, int]] = []
+
+        self.vectors: Optional[np.ndarray] = None
+        # searches running at the same time embed the new passages once
+        self.embed_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def add(self, source: str, title: str, text: str) -> int:
+        """Index ``text`` from ``source`` as passages; returns how many are new."""
+        return sum(self.add_passage(source, title, passage) for passage in chunk_text(text, self.chunk_chars))
+
+    def add_passage(self, source: str, title: str, text: str) -> bool:
+        key = _key(source, text)
+        if key in self.seen:
+            return False
+        if len(self.passages) >= self.max_passages:
+            raise QuotaExceeded(f"The retrieval index of a run is limited to {self.max_passages} passages")
+        self.seen.add(key)
+        counts = Counter(tokens(text))
+        self.vocab.update(zip(set(counts).difference(self.vocab), itertools.count(len(self.vocab))))
+        terms = np.fromiter(map(self.vocab.__getitem__, counts), np.int32, len(counts))
+        tfs = np.fromiter(counts.values(), np.float32, len(counts))
+        # ids of removed sources are not reused
+        source_id = self.sources.setdefault(source, len(self.sources) + len(self.removed))
+        self.pending.append((terms, tfs, sum(counts.values()), source_id))
+        self.passages.append(Passage(source, title, text))
+        return True
+
+    def remove_source(self, source: str) -> int:
+        """Stop returning the passages of ``source``; returns how many there were."""
+        source_id = self.sources.pop(source, None)
+        if source_id is None:
+            return 0
+        self.removed.add(source_id)
+        removed = [p for p in self.passages if p.source == source]
+        self.seen.difference_update(_key(p.source, p.text) for p in removed)
+        return len(removed)
+
+    def _merge(self):
+        if not self.pending:
+            return
+        first = len(self.lengths)
+        docs = [np.full(len(terms), first + i, np.int32) for i, (terms, _, _, _) in enumerate(self.pending)]
+        terms = np.concatenate([self.terms] + [p[0] for p in self.pending])
+        order = np.argsort(terms, kind="stable")
+        self.terms = terms[order]
+        self.docs = np.concatenate([self.docs] + docs)[order]
+        self.tfs = np.concatenate([self.tfs] + [p[1] for p in self.pending])[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(self.terms, minlength=len(self.vocab)))])
+        self.lengths = np.concatenate([self.lengths, np.array([p[2] for p in self.pending], np.float32)])
+        self.source_ids = np.concatenate([self.source_ids, np.array([p[3] for p in self.pending], np.int32)])
+        self.pending = []
+
+    def _bm25(self, query: str) -> np.ndarray:
+        n = len(self.lengths)
+        ids = [self.vocab[t] for t in set(tokens(query)) if t in self.vocab]
+        if not ids or n == 0:
+            return np.zeros(n, np.float32)
+        postings = [np.arange(self.indptr[t], self.indptr[t + 1]) for t in ids]
+        df = np.array([len(p) for p in postings], np.float32)
+        idf = np.repeat(np.log1p((n - df + 0.5) / (df + 0.5)), df.astype(np.int64))
+        at = np.concatenate(postings)
+        docs, tf = self.docs[at], self.tfs[at]
+        norm = self.k1 * (1 - self.b + self.b * self.lengths[docs] / self.lengths.mean())
+        return np.bincount(docs, weights=idf * tf * (self.k1 + 1) / (tf + norm), minlength=n).astype(np.float32)
+
+    async def _embed_new(self):
+        async with self.embed_lock:
+            done = 0 if self.vectors is None else len(self.vectors)
+            if done == len(self.passages):
+                return
+            texts = [p.text for p in self.passages[done:]]
+            vectors = _unit(np.asarray(await self.embeddings.aembed_documents(texts), np.float32))
+            self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+
+    async def search(self, query: str, k: int = 5, sources: Optional[Iterable[str]] = None) -> list[Passage]:
+        """The ``k`` passages most relevant to ``query``, of the given sources only if any."""
+        self._merge()
+        if not self.passages:
+            return []
+        scores = self._bm25(query)
+        if self.embeddings is not None:
+            await self._embed_new()
+            top = scores.max()
+            q = _unit(np.asarray(await self.embeddings.aembed_query(query), np.float32))
+            cosine = self.vectors[: len(scores)] @ q
+            scores = (1 - self.semantic_weight) * (scores / top if top > 0 else scores) + self.semantic_weight * cosine
+        if self.removed:
+            scores = np.where(np.isin(self.source_ids, list(self.removed)), 0, scores)
+        if sources is not None:
+            wanted = [self.sources[s] for s in sources if s in self.sources]
+            scores = np.where(np.isin(self.source_ids, wanted), scores, 0)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [self.passages[i] for i in best if scores[i] > 0]
+
+    def metrics(self) -> dict[str, Any]:
+        arrays = (self.terms, self.docs, self.tfs, self.indptr, self.lengths, self.source_ids)
+        return {
+            "passages": len(self.passages),
+            "terms": len(self.vocab),
+            "postings": len(self.terms) + sum(len(p[0]) for p in self.pending),
+            "bytes": sum(a.nbytes for a in arrays)
+            + (self.vectors.nbytes if self.vectors is not None else 0),
+        }
+
+
+def _key(source: str, text: str) -> bytes:
+    return hashlib.sha1(f"{source}\x00{text}".encode("utf-8", errors="replace")).digest()
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class LocalEmbeddings(Embeddings):
+    """all-MiniLM-L6-v2, run in process by onnxruntime (through chromadb, downloaded on first use)."""
+
+    def __init__(self):
+        # imported here: only needed when local embeddings are on
+        from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2  # pylint: disable=import-outside-toplevel
+
+        self.model = ONNXMiniLM_L6_V2()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [vector.tolist() for vector in self.model(texts)]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
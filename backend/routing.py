@@ -0,0 +1,101 @@
+from collections import Counter, deque
+from typing import Callable, Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+##########################################################################################
+# Deterministic routing
+#
+# Many supervisor turns have an obvious answer, e.g. a team with a single worker that has
+# not acted yet, or that just reported back. Rules decide those turns without the router
+# LLM call. A rule gets the conversation and the supervisor's members and returns a member
+# name, a list of members (parallel supervisors), "FINISH", or None when it is not sure.
+# The first rule with an answer wins; when none has one, the supervisor asks the LLM.
+
+RoutingDecision = str | list[str]
+RoutingRule = Callable[[Sequence[BaseMessage], list[str]], Optional[RoutingDecision]]
+
+
+def reported_members(messages: Sequence[BaseMessage], members: list[str]) -> set[str]:
+    return {m.name for m in messages if m.name in members}
+
+
+def sole_member_on_start(messages: Sequence[BaseMessage], members: list[str]) -> Optional[RoutingDecision]:
+    """A team with a single worker that has not acted yet hands the task to it."""
+    if len(members) == 1 and not reported_members(messages, members):
+        return members[0]
+    return None
+
+
+def finish_after_sole_member(messages: Sequence[BaseMessage], members: list[str]) -> Optional[RoutingDecision]:
+    """A team with a single worker is done once that worker has reported back."""
+    if len(members) == 1 and messages and messages[-1].name == members[0]:
+        return "FINISH"
+    return None
+
+
+def first_member_on_start(messages: Sequence[BaseMessage], members: list[str]) -> Optional[RoutingDecision]:
+    """The first step after START goes to the first member, e.g. research before writing."""
+    if not reported_members(messages, members):
+        return members[0]
+    return None
+
+
+DEFAULT_RULES: list[RoutingRule] = [sole_member_on_start, finish_after_sole_member]
+
+
+def routing_turn(messages: Sequence[BaseMessage], members: list[str]) -> str:
+    """What a supervisor turn comes after: "start" (a new task), or "after:<member>" that just reported."""
+    if messages and messages[-1].name in members:
+        return f"after:{messages[-1].name}"
+    return "start"
+
+
+def apply_rules(
+    rules: Sequence[RoutingRule], messages: Sequence[BaseMessage], members: list[str]
+) -> tuple[Optional[str], Optional[RoutingDecision]]:
+    """Return the name of the first rule that decides the turn and its decision."""
+    for rule in rules:
+        decision = rule(messages, members)
+        if decision is not None:
+            return rule.__name__, decision
+    return None, None
+
+
+class RoutingStats:
+    """Counts routing decisions per supervisor and per path ("llm" or "rule:<name>"), and keeps the
+    last ``window`` decisions per supervisor and turn (see speculation.py)."""
+
+    def __init__(self, window: int = 100):
+        self.counts: Counter[tuple[str, str]] = Counter()
+        self.window = window
+        self.decisions: dict[tuple[str, str], deque[str]] = {}
+
+    def record(self, supervisor: str, path: str):
+        self.counts[(supervisor, path)] += 1
+
+    def record_decision(self, supervisor: str, turn: str, decision: RoutingDecision):
+        if isinstance(decision, list):
+            decision = "+".join(sorted(set(decision)))
+        self.decisions.setdefault((supervisor, turn), deque(maxlen=self.window)).append(decision)
+
+    def likely(self, supervisor: str, turn: str) -> tuple[Optional[str], float, int]:
+        """The most frequent recent decision of a supervisor on a turn, its share and the number of decisions."""
+        recent = self.decisions.get((supervisor, turn))
+        if not recent:
+            return None, 0.0, 0
+        decision, count = Counter(recent).most_common(1)[0]
+        return decision, count / len(recent), len(recent)
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        r: dict[str, dict[str, int]] = {}
+        for (supervisor, path), count in sorted(self.counts.items()):
+            r.setdefault(supervisor, {})[path] = count
+        return r
+
+    def reset(self):
+        self.counts.clear()
+        self.decisions.clear()
+
+
+routing_stats = RoutingStats()
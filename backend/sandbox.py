@@ -0,0 +1,286 @@
+import asyncio
+import atexit
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+##########################################################################################
+# Sandbox for python_repl_tool
+#
+# Code from the chart generator runs in a pool of worker processes instead of the server:
+# a slow or runaway script only costs its worker, which is killed after the timeout or when it
+# goes over its CPU or memory limit, and replaced. Workers are started ahead of use with
+# numpy and matplotlib (Agg backend) already imported, since those imports take most of a
+# second. Each call gets a fresh namespace and runs in the working directory it is given;
+# figures left open are saved there as PNG files and returned, by path, with any images the
+# code wrote.
+#
+# Workers do not inherit the server's environment, which holds the API keys: they get the
+# variables of SAFE_ENV only, start in the temporary directory, and each call runs with its
+# working directory as HOME and the environment reset to what the worker started with. This
+# keeps the keys out of reach of the code, not the server's files; for that, run the server
+# under a user that can only read what it needs, or in a container.
+#
+# Parent and worker exchange one JSON line per call over the worker's stdin and a copy of its
+# original stdout; the worker's fd 1 is pointed at stderr, so nothing the code prints can
+# break the protocol.
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".svg", ".gif")
+# the only variables of the server's environment a worker gets
+SAFE_ENV = ("PATH", "LANG", "LC_ALL", "LC_CTYPE", "TZ")
+
+
+def worker_env() -> dict[str, str]:
+    env = {name: os.environ[name] for name in SAFE_ENV if name in os.environ}
+    env.update(
+        HOME=tempfile.gettempdir(),
+        MPLBACKEND="Agg",
+        MPLCONFIGDIR=os.path.join(tempfile.gettempdir(), "sandbox-matplotlib"),
+        OPENBLAS_NUM_THREADS="1",
+        OMP_NUM_THREADS="1",
+    )
+    return env
+
+
+@dataclass
+class Image:
+    # relative to the working directory of the call
+    path: str
+    size: int
+
+
+@dataclass
+class Execution:
+    ok: bool
+    stdout: str = ""
+    error: Optional[str] = None
+    images: list[Image] = field(default_factory=list)
+    duration: float = 0.0
+
+
+class Worker:
+    def __init__(self, preload: tuple[str, ...], memory_mb: int, cpu_seconds: float):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__), json.dumps(
+                {"preload": list(preload), "memory_mb": memory_mb, "cpu_seconds": cpu_seconds}
+            )],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=worker_env(),
+            cwd=tempfile.gettempdir(),
+            text=True,
+        )
+        self.calls = 0
+        # the worker says so once its imports are done
+        self.ready = threading.Event()
+        threading.Thread(target=self._wait_ready, daemon=True).start()
+
+    def _wait_ready(self):
+        self.proc.stdout.readline()
+        self.ready.set()
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def run(self, code: str, cwd: str, timeout: float) -> dict:
+        if not self.ready.wait(timeout) or not self.alive():
+            raise RuntimeError("sandbox worker did not start")
+        self.calls += 1
+        timer = threading.Timer(timeout, self.kill)
+        timer.start()
+        try:
+            self.proc.stdin.write(json.dumps({"code": code, "cwd": cwd}) + "\n")
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        except (BrokenPipeError, OSError):
+            line = ""
+        finally:
+            timer.cancel()
+        if not line:
+            self.kill()
+            raise TimeoutError(f"Execution stopped after {timeout:.0f}s or by its CPU/memory limits")
+        return json.loads(line)
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class SandboxPool:
+    def __init__(
+        self,
+        size: int = 2,
+        timeout: float = 60,
+        cpu_seconds: float = 30,
+        memory_mb: int = 1024,
+        max_calls: int = 50,
+        preload: tuple[str, ...] = ("numpy", "matplotlib.pyplot"),
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_calls = max_calls
+        self.preload = preload
+        self.idle: queue.Queue[Worker] = queue.Queue()
+        self.workers: list[Worker] = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.stats: Counter[str] = Counter()
+        self.busy = 0
+        for _ in range(size):
+            self._spawn()
+        atexit.register(self.close)
+
+    def _spawn(self):
+        worker = Worker(self.preload, self.memory_mb, self.cpu_seconds)
+        with self.lock:
+            self.workers.append(worker)
+        self.idle.put(worker)
+
+    def _retire(self, worker: Worker):
+        self.stats["restarts"] += 1
+        worker.kill()
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+        if not self.closed:
+            self._spawn()
+
+    def run(self, code: str, cwd: str) -> Execution:
+        """Run ``code`` in an idle worker, waiting for one if all are busy. Blocks; call it from a thread."""
+        os.makedirs(cwd, exist_ok=True)
+        worker = self.idle.get()
+        started = time.perf_counter()
+        with self.lock:
+            self.busy += 1
+        try:
+            result = worker.run(code, os.path.abspath(cwd), self.timeout)
+        except (TimeoutError, RuntimeError) as e:
+            self.stats["killed"] += 1
+            self._retire(worker)
+            return Execution(ok=False, error=str(e), duration=time.perf_counter() - started)
+        finally:
+            with self.lock:
+                self.busy -= 1
+        self.stats["calls"] += 1
+        if result["error"] is not None:
+            self.stats["errors"] += 1
+        if worker.calls >= self.max_calls:
+            self._retire(worker)
+        else:
+            self.idle.put(worker)
+
+        images = []
+        for path in result.get("images", []):
+            try:
+                images.append(Image(os.path.relpath(path, cwd), os.path.getsize(path)))
+            except OSError:
+                pass
+        return Execution(
+            ok=result["error"] is None,
+            stdout=result["stdout"],
+            error=result["error"],
+            images=images,
+            duration=time.perf_counter() - started,
+        )
+
+    async def arun(self, code: str, cwd: str) -> Execution:
+        # in a thread, so that waiting for a worker or for the code never holds up the event loop
+        return await asyncio.to_thread(self.run, code, cwd)
+
+    def metrics(self) -> dict[str, Any]:
+        r: dict[str, Any] = dict(self.stats)
+        r["workers"] = len(self.workers)
+        r["busy"] = self.busy
+        return r
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.kill()
+
+
+####################################################################
+# worker process
+
+
+def _serve(options: dict):  # pragma: no cover - runs in the worker process
+    import contextlib  # pylint: disable=import-outside-toplevel
+    import importlib  # pylint: disable=import-outside-toplevel
+    import io  # pylint: disable=import-outside-toplevel
+    import resource  # pylint: disable=import-outside-toplevel
+    import signal  # pylint: disable=import-outside-toplevel
+    import traceback  # pylint: disable=import-outside-toplevel
+
+    # keep the real stdout for replies; anything else writing to fd 1 goes to stderr
+    replies = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    for module in options["preload"]:
+        with contextlib.suppress(ImportError):
+            importlib.import_module(module)
+    plt = sys.modules.get("matplotlib.pyplot")
+
+    memory = options["memory_mb"] * 2**20
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    def over_cpu(_signum, _frame):
+        raise TimeoutError("CPU time limit exceeded")
+
+    signal.signal(signal.SIGXCPU, over_cpu)
+    env = dict(os.environ)
+    replies.write("ready\n")
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        cwd = request["cwd"]
+        os.chdir(cwd)
+        # nothing a previous call set is left for this one
+        os.environ.clear()
+        os.environ.update(env, HOME=cwd)
+        before = {e.path: e.stat().st_mtime for e in os.scandir(cwd) if e.name.lower().endswith(IMAGE_EXTENSIONS)}
+
+        # the soft limit counts total CPU time of the process, so move it up for each call
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = usage.ru_utime + usage.ru_stime
+        resource.setrlimit(resource.RLIMIT_CPU, (int(used + options["cpu_seconds"]) + 1, resource.RLIM_INFINITY))
+
+        stdout = io.StringIO()
+        error = None
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout):
+                exec(compile(request["code"], "<code>", "exec"), {"__name__": "__main__"})  # pylint: disable=exec-used
+        except BaseException as e:  # pylint: disable=broad-exception-caught
+            error = "".join(traceback.format_exception_only(type(e), e)).strip()
+        finally:
+            resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+
+        if plt is not None:
+            for number in plt.get_fignums():
+                path = os.path.join(cwd, f"figure_{number}.png")
+                with contextlib.suppress(Exception):
+                    plt.figure(number).savefig(path)
+            plt.close("all")
+        images = [
+            e.path
+            for e in os.scandir(cwd)
+            if e.name.lower().endswith(IMAGE_EXTENSIONS) and before.get(e.path) != e.stat().st_mtime
+        ]
+        replies.write(json.dumps({"stdout": stdout.getvalue(), "error": error, "images": sorted(images)}) + "\n")
+
+
+if __name__ == "__main__":
+    _serve(json.loads(sys.argv[1]))
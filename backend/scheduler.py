@@ -0,0 +1,242 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+from langchain_core.runnables.config import var_child_runnable_config
+
+from log import get_logger
+
+##########################################################################################
+# Scheduling of model and tool calls
+#
+# A burst of questions fans out into many supervisor and agent calls at once. Unchecked, they
+# all hit the provider's rate limits and retry together. A Scheduler sits in front of one
+# model (as its rate_limiter, so cache hits skip it) or one tool backend and admits calls
+# within a requests/min and a tokens/min budget. Waiting calls are served in arrival order,
+# except that a call from a run that is under way queues as if it had arrived priority_boost
+# seconds before the run's first call. Runs under way finish first, oldest first, rather than
+# all slowing down together, and a new run only waits for runs that started at most
+# priority_boost seconds after it.
+#
+# Providers enforce per-minute limits over much shorter windows (60,000 requests/min can mean
+# 1,000 per second), so the buckets save up little: by default a tenth of a second's worth.
+#
+# Token counts are only known once a call is done, so tokens/min works on credit: calls are
+# admitted while the bucket is not in deficit, and UsageCallback charges the tokens each call
+# reports afterwards. The tokens bucket holds at least max_request_tokens, whatever the burst:
+# otherwise a tenth of a second of tokens/min (45 tokens at 27,000/min) leaves every call after
+# a large one waiting for the whole deficit to refill, though the provider's window had room.
+
+# when the last call of the current task was admitted (time.monotonic()), so that tiers.py can
+# leave the wait out of call latencies
+admitted_at: ContextVar[float] = ContextVar("admitted_at", default=0.0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst_seconds: float = 0.1, min_capacity: float = 1.0):
+        self.rate = per_minute / 60
+        self.capacity = max(min_capacity, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available (call refill first)."""
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+
+def current_run_id() -> Optional[str]:
+    """Thread id of the graph run the current call belongs to, if any."""
+    config = var_child_runnable_config.get() or {}
+    return (config.get("configurable") or {}).get("thread_id") or (config.get("metadata") or {}).get("thread_id")
+
+
+class Scheduler(BaseRateLimiter):
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = 0.1,
+        priority_boost: float = 10,
+        max_runs: int = 10000,
+        max_request_tokens: float = 8192,
+    ):
+        self.logger = get_logger("scheduler")
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = (
+            TokenBucket(tokens_per_minute, burst_seconds, min(max_request_tokens, tokens_per_minute))
+            if tokens_per_minute
+            else None
+        )
+        self.priority_boost = priority_boost
+        self.max_runs = max_runs
+
+        self.lock = threading.Lock()
+        self.queue: list[tuple[float, int, asyncio.Future]] = []
+        self.seq = itertools.count()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        # when each run asked for its first call, most recently active last
+        self.runs: OrderedDict[str, float] = OrderedDict()
+
+        self.stats: Counter[str] = Counter()
+        self.waits: deque[float] = deque(maxlen=1000)
+        self.max_depth = 0
+
+    def _admit_now(self) -> bool:
+        """Take a request if the budgets allow it now; call with the lock held."""
+        now = time.monotonic()
+        self.requests.refill(now)
+        if self.tokens is not None:
+            self.tokens.refill(now)
+        if self.requests.wait_time(1) > 0 or (self.tokens is not None and self.tokens.tokens < 0):
+            return False
+        self.requests.take(1)
+        return True
+
+    def _next_admission(self) -> float:
+        wait = self.requests.wait_time(1)
+        if self.tokens is not None and self.tokens.tokens < 0:
+            wait = max(wait, self.tokens.wait_time(0))
+        return wait
+
+    def _priority(self) -> tuple[float, bool]:
+        now = time.monotonic()
+        run_id = current_run_id()
+        if run_id is None:
+            return now, False
+        started = self.runs.get(run_id)
+        if started is None:
+            self.runs[run_id] = now
+            while len(self.runs) > self.max_runs:
+                self.runs.popitem(last=False)
+            return now, False
+        self.runs.move_to_end(run_id)
+        return started - self.priority_boost, True
+
+    def _record_admission(self, in_progress: bool, waited: float):
+        admitted_at.set(time.monotonic())
+        self.stats["admitted"] += 1
+        self.stats["admitted_in_progress" if in_progress else "admitted_new"] += 1
+        if waited > 0:
+            self.stats["queued"] += 1
+        self.waits.append(waited)
+
+    def _dispatch(self):
+        """Admit queued calls in order while the budgets allow, then set a timer for the next one."""
+        with self.lock:
+            self.timer = None
+            while self.queue:
+                _, _, future = self.queue[0]
+                if future.done() or future.get_loop().is_closed():  # the caller is gone
+                    heapq.heappop(self.queue)
+                    continue
+                if not self._admit_now():
+                    break
+                heapq.heappop(self.queue)
+                future.get_loop().call_soon_threadsafe(_resolve, future)
+            if self.queue:
+                self.timer_loop = self.queue[0][2].get_loop()
+                self.timer = self.timer_loop.call_later(self._next_admission(), self._dispatch)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        started = time.monotonic()
+        with self.lock:
+            key, in_progress = self._priority()
+            if not self.queue and self._admit_now():
+                self._record_admission(in_progress, 0.0)
+                return True
+            if not blocking:
+                return False
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            heapq.heappush(self.queue, (key, next(self.seq), future))
+            self.max_depth = max(self.max_depth, len(self.queue))
+            # the timer of a loop that has been closed since will never fire
+            schedule = self.timer is None or self.timer_loop is not loop or loop.is_closed()
+        if schedule:
+            self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the next _dispatch drops the cancelled entry
+            self.stats["cancelled"] += 1
+            raise
+        waited = time.monotonic() - started
+        self._record_admission(in_progress, waited)
+        if waited > 5:
+            self.logger.info("%s: call waited %.1fs, %d queued", self.name, waited, len(self.queue))
+        return True
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        # synchronous callers don't queue; they poll, behind the queued async callers
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                _, in_progress = self._priority()
+                if not self.queue and self._admit_now():
+                    self._record_admission(in_progress, time.monotonic() - started)
+                    return True
+                wait = self._next_admission() if not self.queue else 0.05
+            if not blocking:
+                return False
+            time.sleep(min(max(wait, 0.001), 0.05))
+
+    def charge(self, tokens: float):
+        if self.tokens is None or tokens <= 0:
+            return
+        with self.lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.take(tokens)
+        self.stats["tokens"] += int(tokens)
+
+    def metrics(self) -> dict[str, Any]:
+        waits = sorted(self.waits)
+        r: dict[str, Any] = dict(self.stats)
+        r["queue_depth"] = len(self.queue)
+        r["max_queue_depth"] = self.max_depth
+        r["wait_p50"] = waits[len(waits) // 2] if waits else 0.0
+        r["wait_p99"] = waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0
+        r["wait_max"] = waits[-1] if waits else 0.0
+        return r
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Charges the tokens reported by each model call to the model's scheduler."""
+
+    run_inline = True
+
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        tokens = 0
+        for generations in response.generations:
+            for g in generations:
+                usage = getattr(getattr(g, "message", None), "usage_metadata", None)
+                if usage:
+                    tokens += usage.get("total_tokens", 0)
+        self.scheduler.charge(tokens)
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from bs4 import BeautifulSoup
+
+from log import get_logger
+
+##########################################################################################
+# Web page scraping for the web_scraper agent
+#
+# Pages are fetched concurrently through one pooled HTTP client, with a cap on in-flight
+# requests per host. Extracted text is kept in a local SQLite store together with the
+# page's ETag / Last-Modified validators, so a page seen before is revalidated with a
+# conditional GET and a 304 costs neither the download nor the parsing. Only the main text
+# of a page is kept (scripts, navigation, headers, footers etc. are dropped), all of it: it
+# goes to the run's retrieval index, and agents read the passages they need (see tools.py).
+
+_BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe",
+    "nav", "header", "footer", "aside", "form", "button", "select",
+]
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+
+
+@dataclass
+class Page:
+    url: str
+    title: str = ""
+    text: str = ""
+    error: Optional[str] = None
+    cached: bool = False
+
+
+def extract_text(body: str, content_type: str, max_chars: Optional[int] = None) -> tuple[str, str]:
+    """Return the title and the main text of a page, trimmed to ``max_chars`` if given."""
+    if "html" not in content_type:
+        text = body
+        title = ""
+    else:
+        soup = BeautifulSoup(body, "html.parser")
+        title = soup.title.get_text(strip=True) if soup.title else ""
+        for tag in soup(_BOILERPLATE_TAGS):
+            tag.decompose()
+        root = soup.find("main") or soup.find("article") or soup.body or soup
+        text = root.get_text("\n", strip=True)
+
+    text = _BLANK_LINES.sub("\n\n", text).strip()
+    if max_chars is not None and len(text) > max_chars:
+        text = text[:max_chars] + "\n[truncated]"
+    return title, text
+
+
+class PageStore:
+    """Extracted pages and their cache validators, on local disk."""
+
+    def __init__(self, path: str):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, title TEXT, text TEXT, fetched_at REAL)"
+        )
+
+    def get(self, url: str) -> Optional[tuple[Optional[str], Optional[str], str, str]]:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT etag, last_modified, title, text FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], title: str, text: str):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, title, text, time.time()),
+            )
+
+
+class Scraper:
+    def __init__(
+        self,
+        store: Optional[PageStore] = None,
+        timeout: float = 15.0,
+        max_connections: int = 32,
+        per_host: int = 4,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_chars: Optional[int] = None,
+        user_agent: Optional[str] = None,
+    ):
+        self.logger = get_logger("scraper")
+        self.store = store
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.user_agent = user_agent or os.getenv("USER_AGENT") or "HierarchicalAgentTeams/1.0"
+
+        # the client and the semaphores belong to the event loop that created them
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+
+    def _client_for_loop(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._host_limits = {}
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={"User-Agent": self.user_agent},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch(self, url: str) -> Page:
+        client = self._client_for_loop()
+        host = urlsplit(url).netloc
+        limit = self._host_limits.setdefault(host, asyncio.Semaphore(self.per_host))
+
+        cached = await asyncio.to_thread(self.store.get, url) if self.store else None
+        headers = {}
+        if cached:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        try:
+            async with limit:
+                async with client.stream("GET", url, headers=headers) as resp:
+                    if resp.status_code == 304 and cached:
+                        return Page(url=url, title=cached[2], text=cached[3], cached=True)
+                    resp.raise_for_status()
+
+                    # stop reading at max_bytes
+                    chunks, got = [], 0
+                    async for chunk in resp.aiter_bytes():
+                        chunks.append(chunk)
+                        got += len(chunk)
+                        if got >= self.max_bytes:
+                            break
+                    body = b"".join(chunks).decode(resp.encoding or "utf-8", errors="replace")
+                    content_type = resp.headers.get("content-type", "text/html")
+                    etag = resp.headers.get("etag")
+                    last_modified = resp.headers.get("last-modified")
+        except httpx.HTTPError as e:
+            self.logger.info("Failed to scrape %s: %r", url, e)
+            return Page(url=url, error=f"{type(e).__name__}: {e}")
+
+        # parsing a large page takes a while: keep it off the event loop
+        title, text = await asyncio.to_thread(extract_text, body, content_type, self.max_chars)
+        if self.store and (etag or last_modified):
+            await asyncio.to_thread(self.store.put, url, etag, last_modified, title, text)
+        return Page(url=url, title=title, text=text)
+
+    async def scrape(self, urls: list[str]) -> list[Page]:
+        return await asyncio.gather(*(self.fetch(url) for url in dict.fromkeys(urls)))
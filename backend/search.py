@@ -0,0 +1,145 @@
+import asyncio
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Optional, Protocol
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from log import get_logger
+from shared import SharedState
+
+##########################################################################################
+# Web search for the search agent
+#
+# Concurrent questions often search for the same thing. CachedSearch answers repeated
+# queries from a TTL/size-bounded cache keyed by the normalized query, and lets concurrent
+# identical queries share one backend call (single flight) instead of paying for each.
+# With a SharedState store, results are also shared with the other worker processes.
+
+SearchResults = list[dict[str, str]]
+
+
+class SearchBackend(Protocol):
+    async def search(self, query: str, max_results: int) -> SearchResults: ...
+
+
+class TavilyBackend:
+    """Tavily search, returning the url and content of each result like TavilySearchResults does."""
+
+    def __init__(self, search_depth: str = "advanced", rate_limiter: Optional[BaseRateLimiter] = None):
+        self.search_depth = search_depth
+        self.rate_limiter = rate_limiter
+        self._wrapper = None
+
+    async def search(self, query: str, max_results: int) -> SearchResults:
+        if self._wrapper is None:
+            # created on first use: the wrapper insists on TAVILY_API_KEY being set
+            from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper  # pylint: disable=import-outside-toplevel
+
+            self._wrapper = TavilySearchAPIWrapper()
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aacquire()
+        return await self._wrapper.results_async(query, max_results=max_results, search_depth=self.search_depth)
+
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_query(query: str) -> str:
+    """Case, punctuation and spacing don't change what a query asks for."""
+    return " ".join(_PUNCTUATION.sub(" ", query.lower()).split())
+
+
+class CachedSearch:
+    def __init__(
+        self,
+        backend: SearchBackend,
+        max_results: int = 5,
+        ttl: float = 3600,
+        max_entries: int = 1000,
+        store: Optional[SharedState] = None,
+    ):
+        self.logger = get_logger("search")
+        self.backend = backend
+        self.store = store
+        self.max_results = max_results
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.entries: OrderedDict[str, tuple[float, SearchResults]] = OrderedDict()
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.stats: Counter[str] = Counter()
+
+    def _get(self, key: str) -> Optional[SearchResults]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return results
+
+    def _put(self, key: str, results: SearchResults):
+        self.entries[key] = (time.monotonic() + self.ttl, results)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def search(self, query: str) -> SearchResults:
+        key = normalize_query(query)
+
+        results = self._get(key)
+        if results is not None:
+            self.stats["hit"] += 1
+            return results
+
+        while (future := self.in_flight.get(key)) is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the call we were waiting for was cancelled with its caller: make our own
+
+        self.stats["miss"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            results = await self._search_shared(key, query)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the waiters get the error; don't warn about it never being retrieved
+            future.exception()
+            raise
+        else:
+            self._put(key, results)
+            future.set_result(results)
+            return results
+        finally:
+            del self.in_flight[key]
+
+    async def _search_shared(self, key: str, query: str) -> SearchResults:
+        if self.store is None:
+            return await self.backend.search(query, self.max_results)
+
+        store_key = f"search:{self.max_results}:{key}"
+        results = await asyncio.to_thread(self.store.get, store_key)
+        if results is not None:
+            self.stats["shared_hit"] += 1
+            return results
+        results = await self.backend.search(query, self.max_results)
+        await asyncio.to_thread(self.store.set, store_key, results, self.ttl)
+        return results
+
+    def metrics(self) -> dict[str, int]:
+        r = dict(self.stats)
+        r["entries"] = len(self.entries)
+        r["in_flight"] = len(self.in_flight)
+        return r
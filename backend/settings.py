@@ -0,0 +1,167 @@
+import os
+
+from dotenv import load_dotenv
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+# The OpenAI and Tavily clients read their keys from the environment, not from settings. Every
+# module imports settings first, so .env is loaded before any client is created.
+load_dotenv(dotenv_path=os.path.join(os.getcwd(), ".env"))
+
+
+class Settings(BaseSettings):
+    """Backend settings, read from environment variables or the .env file (names are case-insensitive)."""
+
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+    # Chat models (see registry.py and tiers.py): a large model and a small fast one, and the
+    # tier each role of node gets: routers (the supervisors), research agents, the note taker
+    # and the writers (document writer and chart generator)
+    llm_model: str = "gpt-4o"
+    llm_small_model: str = "gpt-4o-mini"
+    llm_router_tier: str = "small"
+    llm_research_tier: str = "large"
+    llm_notes_tier: str = "small"
+    llm_writer_tier: str = "large"
+    # A tier whose last llm_slo_window calls have a p90 time to first token over llm_slo_seconds
+    # (see tiers.py), that gets overload errors, or whose calls wait over llm_max_queue_wait
+    # seconds in the scheduler, is replaced by the next faster tier for llm_fallback_cooldown
+    # seconds
+    llm_fallback: bool = True
+    llm_slo_seconds: float = 10
+    llm_slo_window: int = 20
+    llm_max_queue_wait: float = 5
+    llm_fallback_cooldown: float = 60
+    # Budgets of the models and of the search tool (see scheduler.py); set them a little
+    # under the provider's limits so that calls queue here instead of failing with 429 there
+    scheduler: bool = True
+    llm_requests_per_minute: float = 450
+    llm_tokens_per_minute: float = 27000
+    llm_small_requests_per_minute: float = 450
+    llm_small_tokens_per_minute: float = 180000
+    search_requests_per_minute: float = 90
+    # how much of the budgets can be saved up for a burst, in seconds' worth, and at least the
+    # tokens of one large model call (prompt and completion)
+    scheduler_burst_seconds: float = 0.1
+    scheduler_max_request_tokens: int = 8192
+    # calls from runs under way are served as if they had queued this many seconds earlier
+    scheduler_priority_boost: float = 10
+    # Prices of the models in USD per million tokens, for the cost metrics (see tracing.py)
+    llm_input_cost_per_mtok: float = 2.5
+    llm_output_cost_per_mtok: float = 10.0
+    llm_small_input_cost_per_mtok: float = 0.15
+    llm_small_output_cost_per_mtok: float = 0.6
+    # File receiving one JSON line per traced node, model and tool call; empty to keep only metrics
+    trace_jsonl: str = ""
+    # Build the graphs in the background right after startup instead of on the first question
+    warm_start: bool = True
+
+    # Serving (see main.py). Each worker is a process with its own event loop; on shutdown,
+    # streams still open after graceful_timeout seconds are cut, and resume with their thread id.
+    host: str = "0.0.0.0"
+    port: int = 4080
+    workers: int = 1
+    graceful_timeout: float = 30
+    # State shared by the workers: search cache, counters and run leases (see shared.py)
+    shared_state_db: str = "data/shared.sqlite"
+    # A run is leased to the worker streaming it, so another worker can't resume it meanwhile
+    run_lease_ttl: float = 120
+
+    # Batches of questions (see batch.py): runs at once over all batches, questions per batch,
+    # and finished batches kept for polling
+    batch_workers: int = 8
+    batch_max_questions: int = 200
+    batch_max_batches: int = 100
+
+    # Speculative start of the research team (see speculation.py): while the top supervisor
+    # decides, start the team its recent decisions on such turns went to, if at least
+    # speculation_min_probability of them did, over speculation_min_samples decisions or more
+    speculation: bool = False
+    speculation_min_samples: int = 20
+    speculation_min_probability: float = 0.8
+
+    # Background jobs (see jobs.py): queue shared by the workers, tasks running jobs in each
+    # worker (0 to leave them to `python jobs.py`), and how long a job stays with a worker
+    # that stopped renewing its lease
+    job_db: str = "data/jobs.sqlite"
+    job_workers: int = 2
+    job_lease_ttl: float = 60
+    job_poll_interval: float = 1.0
+
+    # python_repl_tool (see sandbox.py): worker processes, limits per call, and the directory
+    # holding one working directory per run
+    sandbox_workers: int = 2
+    sandbox_timeout: float = 60
+    sandbox_cpu_seconds: float = 30
+    sandbox_memory_mb: int = 1024
+    sandbox_dir: str = "data/sandbox"
+
+    # Documents of the paper writing team (see workspace.py): a workspace per run, limited to
+    # workspace_max_bytes and workspace_max_files, written behind to workspace_dir unless
+    # workspace_spill is off
+    workspace_dir: str = "data/workspaces"
+    workspace_spill: bool = True
+    workspace_spill_delay: float = 1.0
+    workspace_max_bytes: int = 5 * 2**20
+    workspace_max_files: int = 100
+
+    # Retrieval index of each run over what it searched and scraped (see retrieval.py): passage
+    # size, passages returned by default and at most per run, and optional embeddings mixed into
+    # the BM25 scores: "local" (all-MiniLM-L6-v2 run by onnxruntime, downloaded on first use)
+    # or "openai" (retrieval_embedding_model)
+    retrieval_chunk_chars: int = 1200
+    retrieval_k: int = 5
+    retrieval_max_passages: int = 100000
+    retrieval_embeddings: str = ""
+    retrieval_embedding_model: str = "text-embedding-3-small"
+    retrieval_semantic_weight: float = 0.5
+
+    # Documents uploaded to a run (see upload.py), each at most upload_max_bytes
+    upload_max_bytes: int = 200 * 2**20
+
+    # SQLite database holding the graph checkpoints, so that question runs can be resumed
+    checkpoint_db: str = "data/checkpoints.sqlite"
+
+    # Response cache shared by all chat models (see cache.py)
+    response_cache: bool = True
+    response_cache_db: str = "data/response_cache.sqlite"
+    response_cache_ttl: float = 24 * 3600
+    response_cache_max_entries: int = 10000
+    # Optional embedding-similarity tier; costs one embedding call per exact-match miss
+    response_cache_semantic: bool = False
+    response_cache_similarity: float = 0.97
+    response_cache_embedding_model: str = "text-embedding-3-small"
+
+    # Budget for the messages sent to the model on each supervisor/agent turn (see context.py)
+    context_max_tokens: int = 8000
+    context_max_message_tokens: int = 2000
+    # Summarize dropped messages with the model instead of keeping their opening lines
+    context_summarize: bool = False
+
+    # tavily_tool (see search.py)
+    search_max_results: int = 5
+    search_cache_ttl: float = 3600
+    search_cache_max_entries: int = 1000
+
+    # scrape_webpages tool (see scraper.py)
+    scrape_cache_db: str = "data/scrape_cache.sqlite"
+    scrape_timeout: float = 15.0
+    scrape_per_host: int = 4
+
+    # Answer streams (see streaming.py): a frame is sent once it holds this many characters,
+    # or this many seconds after its first token
+    sse_frame_chars: int = 512
+    sse_frame_delay: float = 0.05
+    # seconds between client disconnect checks
+    sse_disconnect_interval: float = 1.0
+    # events buffered for a slow client, past which the run waits for it
+    sse_max_pending_events: int = 10000
+
+    log_level: str = "INFO"
+    log_format: str = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    # Access log (see accesslog.py): share of requests logged (failed ones always are), and
+    # how much of each request body is kept
+    access_log_sample_rate: float = 1.0
+    access_log_body_bytes: int = 1024
+
+
+settings = Settings()
@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+##########################################################################################
+# State shared by the worker processes
+#
+# With several uvicorn workers, anything kept in process memory is per worker: a search cached
+# by one worker is fetched again by the next, and two workers could resume the same run. The
+# SQLite file behind SharedState is opened by every worker (WAL mode, so readers don't block the
+# writer) and holds expiring key-value entries, counters and leases. Times are wall-clock, as
+# they are compared across processes.
+
+
+class SharedState:
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, json.dumps(value), expires_at))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def purge(self) -> int:
+        """Drop expired entries and leases."""
+        now = time.time()
+        with self.lock:
+            n = self.conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,)).rowcount
+            self.conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        return n
+
+    def incr(self, name: str, amount: float = 1) -> float:
+        with self.lock:
+            return float(
+                self.conn.execute(
+                    "INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value"
+                    " RETURNING value",
+                    (name, float(amount)),
+                ).fetchone()[0]
+            )
+
+    def counters(self, prefix: str = "") -> dict[str, float]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name, value FROM counters WHERE name LIKE ? ESCAPE '\\'",
+                (prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",),
+            ).fetchall()
+        return dict(rows)
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Take the lease ``name`` for ``ttl`` seconds, unless another owner holds it; renews our own."""
+        now = time.time()
+        with self.lock:
+            # the upsert only takes over a lease that has expired or is ours, in one statement
+            row = self.conn.execute(
+                "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE"
+                " SET owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE leases.owner = excluded.owner OR leases.expires_at <= ?"
+                " RETURNING owner",
+                (name, owner, now + ttl, now),
+            ).fetchone()
+        return row is not None
+
+    def release(self, name: str, owner: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,50 @@
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable
+
+##########################################################################################
+# Work shared by the runs of a batch
+#
+# Questions of a batch often send the research team the same request. SingleFlight runs the
+# work for a (scope, key) once: callers arriving while it is under way, or after it is done,
+# get its result. A scope is one batch; forget() drops its results when the batch is over. If
+# the run fails, or its caller is cancelled, the waiting callers do the work themselves.
+
+
+class SingleFlight:
+    def __init__(self):
+        self.futures: dict[tuple[str, str], asyncio.Future] = {}
+        self.stats: Counter[str] = Counter()
+
+    async def run(self, scope: str, key: str, work: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.futures.get((scope, key))
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            try:
+                result = await asyncio.shield(future)
+                self.stats["shared"] += 1
+                return result
+            except Exception:  # pylint: disable=broad-exception-caught
+                self.stats["fallback"] += 1
+                return await work()
+
+        future = self.futures[(scope, key)] = asyncio.get_running_loop().create_future()
+        # nobody may be waiting for a failure
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.stats["run"] += 1
+        try:
+            result = await work()
+        except BaseException as e:
+            self.futures.pop((scope, key), None)
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Shared work was cancelled"))
+            raise
+        future.set_result(result)
+        return result
+
+    def forget(self, scope: str):
+        for key in [k for k in self.futures if k[0] == scope]:
+            del self.futures[key]
+
+    def metrics(self) -> dict[str, Any]:
+        r: dict[str, Any] = dict(self.stats)
+        r["entries"] = len(self.futures)
+        return r
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Optional
+from uuid import uuid4
+
+from langchain_core.runnables import RunnableConfig
+
+from log import get_logger
+from routing import RoutingStats, routing_turn
+
+##########################################################################################
+# Speculative start of the next team
+#
+# The top supervisor's first turn almost always sends the question to the research team,
+# which only starts once the router call is back. With speculation on, when the recent
+# decisions of a supervisor on the same kind of turn (see routing.RoutingStats) went to one
+# member at least min_probability of the time, over at least min_samples decisions, that
+# member's work starts at the same time as the router call:
+#
+#   - the router picks it (hit): the member's node takes the speculative result instead of
+#     starting over;
+#   - the router picks something else (miss), or fails: the speculative run is cancelled,
+#     and the time it ran is counted as wasted.
+#
+# A speculative run is checkpointed and streamed under a namespace of its own with the
+# member's name ("research_team:<id>"), so clients see it as the team's work; on a miss,
+# they have seen the start of work that was then dropped.
+
+
+class Speculation:
+    def __init__(self, stats: RoutingStats, min_samples: int = 20, min_probability: float = 0.8, max_age: float = 300):
+        self.logger = get_logger("speculation")
+        self.stats = stats
+        self.min_samples = min_samples
+        self.min_probability = min_probability
+        # finished runs nobody took after this many seconds (their run was interrupted) are dropped
+        self.max_age = max_age
+        self.runs: dict[tuple[str, str], tuple[asyncio.Task, float]] = {}
+        self.counters: Counter[str] = Counter()
+        self.wasted_seconds = 0.0
+
+    def predict(self, supervisor: str, messages: list, members: list[str]) -> Optional[str]:
+        """The member the supervisor's turn will very likely go to, if any."""
+        decision, probability, samples = self.stats.likely(supervisor, routing_turn(messages, members))
+        if decision in members and samples >= self.min_samples and probability >= self.min_probability:
+            return decision
+        return None
+
+    def start(self, key: tuple[str, str], work: Awaitable[Any]):
+        self.drop(key)
+        now = time.perf_counter()
+        stale = [k for k, (task, started) in self.runs.items() if task.done() and now - started > self.max_age]
+        for k in stale:
+            self.drop(k)
+        if stale:
+            self.logger.info("dropped %d speculative runs nobody took", len(stale))
+        task = asyncio.ensure_future(work)
+        # a failure is reported to whoever takes the run
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.runs[key] = (task, time.perf_counter())
+        self.counters["started"] += 1
+
+    def settle(self, key: tuple[str, str], hit: bool):
+        """Keep the run for its node on a hit, cancel it on a miss."""
+        if hit:
+            if key in self.runs:
+                self.counters["hit"] += 1
+            return
+        if self.drop(key):
+            self.counters["miss"] += 1
+
+    def drop(self, key: tuple[str, str]) -> bool:
+        run = self.runs.pop(key, None)
+        if run is None:
+            return False
+        task, started = run
+        if not task.done():
+            task.cancel()
+            self.counters["cancelled"] += 1
+        self.wasted_seconds += time.perf_counter() - started
+        return True
+
+    def take(self, key: tuple[str, str]) -> Optional[asyncio.Task]:
+        run = self.runs.pop(key, None)
+        return run[0] if run is not None else None
+
+    def metrics(self) -> dict[str, Any]:
+        r: dict[str, Any] = dict(self.counters)
+        r["running"] = len(self.runs)
+        r["wasted_seconds"] = self.wasted_seconds
+        settled = self.counters["hit"] + self.counters["miss"]
+        r["hit_rate"] = self.counters["hit"] / settled if settled else 0.0
+        return r
+
+
+def speculative_config(config: RunnableConfig, node: str) -> RunnableConfig:
+    """The config of a run of ``node``'s work started ahead of the node, under a namespace of its own."""
+    configurable = dict(config.get("configurable") or {})
+    parent_ns = configurable.get("checkpoint_ns") or ""
+    # the namespace the node's own task would have, one level up from the supervisor's
+    ns = "|".join(parent_ns.split("|")[:-1] + [f"{node}:{uuid4()}"])
+    configurable["checkpoint_ns"] = ns
+    configurable.pop("checkpoint_id", None)
+    metadata = {**(config.get("metadata") or {}), "langgraph_node": node, "langgraph_checkpoint_ns": ns}
+    return {**config, "configurable": configurable, "metadata": metadata}
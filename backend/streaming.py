@@ -0,0 +1,226 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Sequence
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+
+##########################################################################################
+# Server-sent events for answer streams
+#
+# Model tokens arrive one by one. Sending each as its own SSE frame costs a write, a JSON
+# encoding and a client event per token; sse_frames coalesces them into frames of at most
+# max_chars characters or max_delay seconds, whichever comes first. Each SSE event is a JSON
+# object:
+#
+#   {"type": "delta", "ns": "research_team|search", "node": "agent", "role": "ai", "delta": "..."}
+#   {"type": "tool_call", "ns": "research_team|search", "node": "agent", "name": "tavily_search_results_json"}
+#   {"type": "tool_result", "ns": "research_team|search", "node": "tools", "name": "...", "status": "success",
+#    "chars": 5120, "preview": "..."}
+#   {"type": "error", "message": "..."}
+#   {"type": "done"}
+#
+# where "ns" is the checkpoint namespace of the emitting node without task ids, so clients
+# (or the server, see message_events) can filter by team and worker. The team graphs and
+# their agents are called with their node's config, so their tokens and tool messages reach
+# the top-level stream; a tool call is reported as soon as the model starts writing it, which
+# is often long before the first answer token.
+
+
+# streamed tokens come as chunks, whose type is their class name; whole messages (from the
+# response cache, or models that don't stream) have the role as type
+_CHUNK_ROLES = {
+    "AIMessageChunk": "ai",
+    "HumanMessageChunk": "human",
+    "SystemMessageChunk": "system",
+    "ToolMessageChunk": "tool",
+    "FunctionMessageChunk": "function",
+}
+
+
+def message_role(msg: BaseMessage) -> str:
+    if msg.type in ("chat", "ChatMessageChunk"):
+        return msg.role
+    return _CHUNK_ROLES.get(msg.type, msg.type)
+
+
+def namespace_path(checkpoint_ns: str) -> str:
+    """``research_team:<task id>|search:<task id>|agent:<task id>`` -> ``research_team|search``
+
+    The last part is the emitting node itself, reported separately as "node".
+    """
+    return "|".join(part.split(":", 1)[0] for part in checkpoint_ns.split("|")[:-1] if part)
+
+
+def matches_namespaces(path: str, namespaces: Optional[Sequence[str]]) -> bool:
+    if not namespaces:
+        return True
+    parts = path.split("|")
+    # a team or worker anywhere in the path, or a path prefix, compared by whole segments
+    return any(ns in parts or path == ns or path.startswith(ns + "|") for ns in namespaces)
+
+
+# structured output of the supervisors (see tools.make_supervisor_node), not tools
+ROUTING_TOOLS = ("Router", "ParallelRouter")
+
+
+def _tool_call_names(msg: AIMessage) -> list[str]:
+    if isinstance(msg, AIMessageChunk):
+        # the name comes with the first chunk of each call
+        return [c["name"] for c in msg.tool_call_chunks if c.get("name")]
+    return [c["name"] for c in msg.tool_calls]
+
+
+async def message_events(
+    stream: AsyncIterator[tuple[BaseMessage, dict[str, Any]]],
+    namespaces: Optional[Sequence[str]] = None,
+    preview_chars: int = 200,
+) -> AsyncIterator[dict[str, Any]]:
+    """Turn a ``stream_mode="messages"`` graph stream into delta and tool events, keeping the given namespaces only."""
+    paths: dict[str, tuple[str, bool]] = {}
+    async for msg, meta in stream:
+        # cached replies arrive as one whole AIMessage instead of chunks
+        if isinstance(msg, AIMessage):
+            calls = [name for name in _tool_call_names(msg) if name not in ROUTING_TOOLS]
+            if not msg.content and not calls:
+                continue
+        elif not isinstance(msg, ToolMessage):
+            continue
+        # checkpoint_ns stops at the top-level node; langgraph_checkpoint_ns has the full path
+        checkpoint_ns = meta.get("langgraph_checkpoint_ns") or meta.get("checkpoint_ns", "")
+        path_and_match = paths.get(checkpoint_ns)
+        if path_and_match is None:
+            path = namespace_path(checkpoint_ns)
+            path_and_match = paths[checkpoint_ns] = (path, matches_namespaces(path, namespaces))
+        path, match = path_and_match
+        if not match:
+            continue
+        node = meta.get("langgraph_node", "")
+        content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content)
+        if isinstance(msg, ToolMessage):
+            yield {
+                "type": "tool_result",
+                "ns": path,
+                "node": node,
+                "name": msg.name,
+                "status": msg.status,
+                "chars": len(content),
+                "preview": content[:preview_chars],
+            }
+            continue
+        for name in calls:
+            yield {"type": "tool_call", "ns": path, "node": node, "name": name}
+        if content:
+            yield {"type": "delta", "ns": path, "node": node, "role": message_role(msg), "delta": content}
+
+
+def encode_event(event: dict[str, Any]) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def merge_deltas(events: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Join consecutive deltas of the same namespace, node and role."""
+    merged: list[dict[str, Any]] = []
+    for e in events:
+        last = merged[-1] if merged else None
+        if (
+            last is not None
+            and e["type"] == "delta" == last["type"]
+            and e["ns"] == last["ns"]
+            and e["node"] == last["node"]
+            and e["role"] == last["role"]
+        ):
+            last["delta"] += e["delta"]
+            if "seq" in e:
+                # numbered events (see jobs.py) keep the number of the last one merged
+                last["seq"] = e["seq"]
+        else:
+            merged.append(dict(e))
+    return merged
+
+
+async def sse_frames(
+    events: AsyncIterator[dict[str, Any]],
+    max_chars: int = 512,
+    max_delay: float = 0.05,
+    is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    disconnect_interval: float = 1.0,
+    max_pending: int = 10000,
+) -> AsyncIterator[str]:
+    """Coalesce events into SSE frames, then finish with an optional error event and a done event.
+
+    The events are consumed by a separate task, so the model is not held up by a slow client,
+    unless it falls ``max_pending`` events behind: the task then waits for the next frame to
+    be sent, rather than buffering without bound. ``is_disconnected`` is polled at most once
+    per ``disconnect_interval`` seconds; a disconnect also cancels this generator outright
+    (Starlette's StreamingResponse listens for it), which cancels the run.
+    """
+    pending: list[dict[str, Any]] = []
+    pending_chars = 0
+    first_at = 0.0
+    has_data = asyncio.Event()
+    full = asyncio.Event()
+    room = asyncio.Event()
+    room.set()
+    error: Optional[BaseException] = None
+
+    async def produce():
+        nonlocal pending_chars, first_at, error
+        try:
+            async for e in events:
+                if not pending:
+                    first_at = time.monotonic()
+                    has_data.set()
+                pending.append(e)
+                pending_chars += len(e.get("delta", ""))
+                if pending_chars >= max_chars:
+                    full.set()
+                if len(pending) >= max_pending:
+                    full.set()
+                    room.clear()
+                    await room.wait()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            error = e
+        finally:
+            has_data.set()
+            full.set()
+
+    producer = asyncio.create_task(produce())
+    next_check = time.monotonic() + disconnect_interval
+    try:
+        while True:
+            await has_data.wait()
+            if not full.is_set():
+                # give the frame until max_delay after its first event to fill up
+                timeout = first_at + max_delay - time.monotonic()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(full.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+
+            batch = pending[:]
+            del pending[:]
+            pending_chars = 0
+            room.set()
+            finished = producer.done()
+            if not finished:
+                has_data.clear()
+                full.clear()
+
+            if batch:
+                yield "".join(encode_event(e) for e in merge_deltas(batch))
+            if finished:
+                break
+
+            if is_disconnected is not None and time.monotonic() >= next_check:
+                next_check = time.monotonic() + disconnect_interval
+                if await is_disconnected():
+                    return
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    if error is not None:
+        yield encode_event({"type": "error", "message": str(error)})
+    yield encode_event({"type": "done"})
@@ -0,0 +1,199 @@
+import itertools
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ensure_config, merge_configs
+
+from log import get_logger
+from scheduler import Scheduler, admitted_at
+
+##########################################################################################
+# Model tiers
+#
+# Nodes get their model by role instead of all sharing one: "router" (the supervisors, which
+# only pick the next worker), "research" (search and scraping agents), "notes" (the note
+# taker) and "writer" (document writer and chart generator). Each role is assigned a tier,
+# and tiers are listed fastest first, e.g. a small model and a large one (see settings.py).
+#
+# ModelTiers watches the model calls of each tier. A tier is degraded for `cooldown` seconds
+# when the p90 latency of its last `window` calls breaches slo_seconds, when a call fails
+# with an overload error (429, 503, timeout), or when its scheduler makes calls queue longer
+# than max_queue_wait. The latency of a call is its time to first token, from when its
+# scheduler admitted it, so neither the length of the answer nor the queue wait counts; calls
+# served by the response cache stream nothing and are left out. Meanwhile, the roles assigned
+# to it run on the next faster tier. The tier is picked on each node call, so runs under way
+# switch too.
+
+OVERLOAD_STATUS = (429, 503, 529)
+
+
+def is_overload(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status in OVERLOAD_STATUS or isinstance(error, TimeoutError) or "Timeout" in type(error).__name__
+
+
+class Tier:
+    def __init__(self, name: str, model: BaseChatModel, scheduler: Optional[Scheduler] = None, window: int = 20):
+        self.name = name
+        self.model = model
+        self.scheduler = scheduler
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.degraded_until = 0.0
+        self.callback: Optional["TierCallback"] = None
+
+    def p90(self) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, len(latencies) * 9 // 10)] if latencies else 0.0
+
+    def queue_wait(self, calls: int = 10) -> float:
+        """Median wait of the scheduler's last ``calls`` admissions."""
+        if self.scheduler is None:
+            return 0.0
+        waits = sorted(itertools.islice(reversed(self.scheduler.waits), calls))
+        return waits[len(waits) // 2] if waits else 0.0
+
+
+class TierCallback(BaseCallbackHandler):
+    """Reports the time to first token and failures of a tier's model calls to ModelTiers."""
+
+    # inline, in the task making the call, to see when its scheduler admitted it
+    run_inline = True
+
+    def __init__(self, tiers: "ModelTiers", tier: Tier):
+        self.tiers = tiers
+        self.tier = tier
+        self.started: dict[UUID, float] = {}
+        self.first_token: dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.started[run_id] = time.monotonic()
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        started = self.started.get(run_id)
+        if started is not None and run_id not in self.first_token:
+            self.first_token[run_id] = time.monotonic() - max(started, admitted_at.get())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self.started.pop(run_id, None)
+        # nothing streamed: a cache hit, or a call made without streaming
+        first_token = self.first_token.pop(run_id, None)
+        if first_token is not None:
+            self.tiers.record(self.tier, first_token)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.first_token.pop(run_id, None)
+        if self.started.pop(run_id, None) is not None:
+            self.tiers.record(self.tier, None, error)
+
+
+class TieredRunnable(Runnable):
+    """Runs, on each call, the variant built (on first use) for the tier ModelTiers picks for ``role``."""
+
+    def __init__(self, tiers: "ModelTiers", role: str, build: Callable[[BaseChatModel], Runnable]):
+        self.tiers = tiers
+        self.role = role
+        self.build = build
+        self.variants: dict[str, Runnable] = {}
+
+    def _pick(self, config: Optional[RunnableConfig]) -> tuple[Runnable, RunnableConfig]:
+        tier = self.tiers.pick(self.role)
+        variant = self.variants.get(tier.name)
+        if variant is None:
+            variant = self.variants[tier.name] = self.build(tier.model)
+        return variant, merge_configs(ensure_config(config), {"callbacks": [tier.callback]})
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        runnable, config = self._pick(config)
+        return runnable.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        runnable, config = self._pick(config)
+        return await runnable.ainvoke(input, config, **kwargs)
+
+
+class ModelTiers:
+    def __init__(
+        self,
+        tiers: Sequence[Tier],
+        roles: dict[str, str],
+        fallback: bool = True,
+        slo_seconds: float = 30,
+        min_calls: int = 5,
+        max_queue_wait: float = 5,
+        cooldown: float = 60,
+    ):
+        self.logger = get_logger("tiers")
+        self.tiers = list(tiers)
+        self.index = {tier.name: i for i, tier in enumerate(self.tiers)}
+        unknown = {tier for tier in roles.values() if tier not in self.index}
+        if unknown:
+            raise ValueError(f"Unknown model tiers {sorted(unknown)}, expected one of {list(self.index)}")
+        self.roles = roles
+        self.fallback = fallback
+        self.slo_seconds = slo_seconds
+        self.min_calls = min_calls
+        self.max_queue_wait = max_queue_wait
+        self.cooldown = cooldown
+        for tier in self.tiers:
+            tier.callback = TierCallback(self, tier)
+        # node calls by (role, tier)
+        self.calls: Counter[tuple[str, str]] = Counter()
+        self.stats: Counter[str] = Counter()
+
+    def _degrade(self, tier: Tier, reason: str):
+        if tier.degraded_until > time.monotonic():
+            return
+        tier.degraded_until = time.monotonic() + self.cooldown
+        # measured afresh when its roles come back
+        tier.latencies.clear()
+        self.stats[f"{tier.name}:degraded:{reason}"] += 1
+        self.logger.warning("model tier %s degraded (%s) for %.0fs", tier.name, reason, self.cooldown)
+
+    def _degraded(self, tier: Tier) -> bool:
+        if tier.queue_wait() > self.max_queue_wait:
+            self._degrade(tier, "queue")
+        return tier.degraded_until > time.monotonic()
+
+    def pick(self, role: str) -> Tier:
+        assigned = self.index[self.roles.get(role, self.tiers[-1].name)]
+        index = assigned
+        while self.fallback and index > 0 and self._degraded(self.tiers[index]):
+            index -= 1
+        tier = self.tiers[index]
+        self.calls[(role, tier.name)] += 1
+        if index != assigned:
+            self.stats["fallbacks"] += 1
+        return tier
+
+    def record(self, tier: Tier, seconds: Optional[float], error: Optional[BaseException] = None):
+        if error is not None:
+            if is_overload(error):
+                self._degrade(tier, "overload")
+            return
+        tier.latencies.append(seconds)
+        if len(tier.latencies) >= self.min_calls and tier.p90() > self.slo_seconds:
+            self._degrade(tier, "slo")
+
+    def runnable(self, role: str, build: Callable[[BaseChatModel], Runnable]) -> TieredRunnable:
+        return TieredRunnable(self, role, build)
+
+    def metrics(self) -> dict[str, Any]:
+        r: dict[str, Any] = dict(self.stats)
+        now = time.monotonic()
+        for tier in self.tiers:
+            r[f"{tier.name}:degraded"] = int(tier.degraded_until > now)
+            r[f"{tier.name}:latency_p90"] = tier.p90()
+        return r
+
+
+def for_role(llm: BaseChatModel | ModelTiers, role: str, build: Callable[[BaseChatModel], Runnable]) -> Runnable:
+    """``build(llm)``; with model tiers, a runnable choosing the tier for ``role`` on each call."""
+    if isinstance(llm, ModelTiers):
+        return llm.runnable(role, build)
+    return build(llm)
@@ -4,15 +4,25 @@ import os
 
 from typing_extensions import TypedDict
 
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.tools import tool
 from langchain_core.language_models.chat_models import BaseChatModel
-
-from langchain_experimental.utilities import PythonREPL
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import Runnable, RunnableConfig
 
 from langgraph.graph import MessagesState, END
-from langgraph.types import Command
+from langgraph.types import Command, Send
+
+from context import ContextManager
+from errs import BaseError
+from registry import registry
+from retrieval import RunIndex
+from routing import DEFAULT_RULES, RoutingRule, apply_rules, routing_stats, routing_turn
+from scheduler import Scheduler
+from scraper import PageStore, Scraper
+from search import CachedSearch, TavilyBackend
+from settings import settings
+from tiers import ModelTiers, for_role
+from workspace import Workspace, run_id
 
 
 
@@ -20,112 +30,263 @@ from langgraph.types import Command
 # The research team can use a search engine and url scraper to find information on the web. Feel free to 
 # add additional functionality below to boost the team performance!
 
-tavily_tool = TavilySearchResults(max_results=5)
+def make_search_scheduler():
+    if not settings.scheduler:
+        return None
+    return Scheduler(
+        "tavily",
+        requests_per_minute=settings.search_requests_per_minute,
+        burst_seconds=settings.scheduler_burst_seconds,
+        priority_boost=settings.scheduler_priority_boost,
+    )
+
+
+registry.register("search_scheduler", make_search_scheduler)
+registry.register(
+    "search",
+    lambda: CachedSearch(
+        TavilyBackend(rate_limiter=registry.get("search_scheduler")),
+        max_results=settings.search_max_results,
+        ttl=settings.search_cache_ttl,
+        max_entries=settings.search_cache_max_entries,
+        store=registry.get("shared_state"),
+    ),
+)
+
+
+@tool("tavily_search_results_json")
+async def tavily_tool(query: str, config: RunnableConfig) -> List[Dict[str, str]] | str:
+    """A search engine optimized for comprehensive, accurate, and trusted results.
+    Useful for when you need to answer questions about current events.
+    Input should be a search query."""
+    try:
+        results = await registry.get("search").search(query)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return repr(e)
+    try:
+        index = get_workspace(config).index
+        for result in results:
+            index.add(result["url"], result.get("title", ""), result.get("content", ""))
+    except BaseError:
+        pass
+    return results
+
+
+registry.register(
+    "scraper",
+    lambda: Scraper(
+        PageStore(settings.scrape_cache_db),
+        timeout=settings.scrape_timeout,
+        per_host=settings.scrape_per_host,
+    ),
+)
+
+
+# Pages and search results go to the run's retrieval index (see retrieval.py), and agents read
+# the passages relevant to their task instead of whole pages
+
+def make_retrieval_embeddings():
+    if settings.retrieval_embeddings == "local":
+        from retrieval import LocalEmbeddings  # pylint: disable=import-outside-toplevel
+
+        return LocalEmbeddings()
+    if settings.retrieval_embeddings == "openai":
+        from langchain_openai import OpenAIEmbeddings  # pylint: disable=import-outside-toplevel
+
+        return OpenAIEmbeddings(model=settings.retrieval_embedding_model)
+    return None
+
+
+registry.register("retrieval_embeddings", make_retrieval_embeddings)
 
 
 @tool
-def scrape_webpages(urls: List[str]) -> str:
-    """Use requests and bs4 to scrape the provided web pages for detailed information."""
-    loader = WebBaseLoader(urls)
-    docs = loader.load()
-    return "\n\n".join(
-        [
-            f'<Document name="{doc.metadata.get("title", "")}">\n{doc.page_content}\n</Document>'
-            for doc in docs
-        ]
+async def scrape_webpages(
+    urls: List[str],
+    config: RunnableConfig,
+    query: Annotated[Optional[str], "What to look for in the pages; their most relevant passages are returned."] = None,
+) -> str:
+    """Scrape the provided web pages for detailed information. The pages are indexed for the retrieve tool."""
+    pages = await registry.get("scraper").scrape(urls)
+    index = get_workspace(config).index
+    lines = []
+    for page in pages:
+        if page.error:
+            lines.append(f"- {page.url}: {page.error}")
+            continue
+        try:
+            added = index.add(page.url, page.title, page.text)
+        except BaseError as e:
+            lines.append(f"- {page.url}: {e.detail}")
+            continue
+        lines.append(f'- "{page.title}" ({page.url}): {added} new passages')
+    if query:
+        passages = await index.search(query, settings.retrieval_k, sources=[page.url for page in pages])
+        return "\n\n".join([f"Scraped {len(pages)} pages:"] + ["\n".join(lines)] + [p.format() for p in passages])
+    return "\n".join(
+        [f"Scraped {len(pages)} pages:"] + lines + ["Use the retrieve tool to read the passages relevant to your task."]
     )
 
 
+@tool
+async def retrieve(
+    query: Annotated[str, "What to look for."],
+    config: RunnableConfig,
+    k: Annotated[int, "How many passages to return."] = settings.retrieval_k,
+) -> str:
+    """Search the pages scraped, the search results found so far and the documents uploaded for
+    the passages most relevant to the query. Each passage comes with its source URL (or uploaded
+    document name), for citing."""
+    passages = await get_workspace(config).search(query, max(1, min(k, 20)))
+    if not passages:
+        return "No relevant passages found. Search or scrape pages first."
+    return "\n\n".join(p.format() for p in passages)
+
+
 # Document writing team tools
 # Next up, we will give some tools for the doc writing team to use. We define some bare-bones file-access tools below.
 # Note that this gives the agents access to your file-system, which can be unsafe. 
 # We also haven't optimized the tool descriptions for performance.
 
 
-# _TEMP_DIRECTORY = TemporaryDirectory()
-# WORKING_DIRECTORY = Path(_TEMP_DIRECTORY.name)
-WORKING_DIRECTORY = Path(os.getcwd())
+# Each run writes to a workspace of its own, kept in memory and written behind to
+# settings.workspace_dir (see workspace.py)
+
+def make_index() -> RunIndex:
+    return RunIndex(
+        registry.get("retrieval_embeddings"),
+        chunk_chars=settings.retrieval_chunk_chars,
+        max_passages=settings.retrieval_max_passages,
+        semantic_weight=settings.retrieval_semantic_weight,
+    )
+
+
+def make_workspaces():
+    from workspace import LocalAsyncFileSystem, Workspaces  # pylint: disable=import-outside-toplevel
+
+    return Workspaces(
+        LocalAsyncFileSystem(asynchronous=True) if settings.workspace_spill else None,
+        os.path.abspath(settings.workspace_dir),
+        max_bytes=settings.workspace_max_bytes,
+        max_files=settings.workspace_max_files,
+        spill_delay=settings.workspace_spill_delay,
+        make_index=make_index,
+    )
+
+
+registry.register("workspaces", make_workspaces)
+
+
+def get_workspace(config: RunnableConfig) -> Workspace:
+    return registry.get("workspaces").get(run_id(config))
+
 
 @tool
-def create_outline(
+async def create_outline(
     points: Annotated[List[str], "List of main points or sections."],
     file_name: Annotated[str, "File path to save the outline."],
+    config: RunnableConfig,
 ) -> Annotated[str, "Path of the saved outline file."]:
     """Create and save an outline."""
-    with (WORKING_DIRECTORY / file_name).open("w") as file:
-        for i, point in enumerate(points):
-            file.write(f"{i + 1}. {point}\n")
+    try:
+        get_workspace(config).write(file_name, "".join(f"{i + 1}. {point}\n" for i, point in enumerate(points)))
+    except BaseError as e:
+        return f"Error: {e.detail}"
     return f"Outline saved to {file_name}"
 
 
 @tool
-def read_document(
+async def read_document(
     file_name: Annotated[str, "File path to read the document from."],
+    config: RunnableConfig,
     start: Annotated[Optional[int], "The start line. Default is 0"] = None,
     end: Annotated[Optional[int], "The end line. Default is None"] = None,
 ) -> str:
-    """Read the specified document."""
-    with (WORKING_DIRECTORY / file_name).open("r") as file:
-        lines = file.readlines()
-    if start is not None:
-        start = 0
-    return "\n".join(lines[start:end])
+    """Read the specified document, or lines start to end of it (0-indexed, end excluded)."""
+    try:
+        document = await get_workspace(config).document(file_name)
+    except FileNotFoundError:
+        return f"Error: Document {file_name} does not exist."
+    except BaseError as e:
+        return f"Error: {e.detail}"
+    return document.read(start, end)
 
 
 @tool
-def write_document(
+async def write_document(
     content: Annotated[str, "Text content to be written into the document."],
     file_name: Annotated[str, "File path to save the document."],
+    config: RunnableConfig,
 ) -> Annotated[str, "Path of the saved document file."]:
     """Create and save a text document."""
-    with (WORKING_DIRECTORY / file_name).open("w") as file:
-        file.write(content)
+    try:
+        get_workspace(config).write(file_name, content)
+    except BaseError as e:
+        return f"Error: {e.detail}"
     return f"Document saved to {file_name}"
 
 
 @tool
-def edit_document(
+async def edit_document(
     file_name: Annotated[str, "Path of the document to be edited."],
     inserts: Annotated[
         Dict[int, str],
         "Dictionary where key is the line number (1-indexed) and value is the text to be inserted at that line.",
     ],
+    config: RunnableConfig,
+    replacements: Annotated[
+        Optional[Dict[int, str]],
+        "Dictionary where key is the line number (1-indexed) and value is the text replacing that line.",
+    ] = None,
 ) -> Annotated[str, "Path of the edited document file."]:
-    """Edit a document by inserting text at specific line numbers."""
+    """Edit a document by inserting text at specific line numbers and replacing lines.
+    Line numbers are those of the document before the edit."""
+    try:
+        await get_workspace(config).edit(file_name, inserts, replacements)
+    except FileNotFoundError:
+        return f"Error: Document {file_name} does not exist."
+    except BaseError as e:
+        return f"Error: {e.detail}"
+    return f"Document edited and saved to {file_name}"
 
-    with (WORKING_DIRECTORY / file_name).open("r") as file:
-        lines = file.readlines()
 
-    sorted_inserts = sorted(inserts.items())
+# The chart generator's code runs in a pool of worker processes, with time, CPU and memory
+# limits (see sandbox.py), in a directory of its own for each run
 
-    for line_number, text in sorted_inserts:
-        if 1 <= line_number <= len(lines) + 1:
-            lines.insert(line_number - 1, text + "\n")
-        else:
-            return f"Error: Line number {line_number} is out of range."
+def make_sandbox():
+    from sandbox import SandboxPool  # pylint: disable=import-outside-toplevel
 
-    with (WORKING_DIRECTORY / file_name).open("w") as file:
-        file.writelines(lines)
+    return SandboxPool(
+        size=settings.sandbox_workers,
+        timeout=settings.sandbox_timeout,
+        cpu_seconds=settings.sandbox_cpu_seconds,
+        memory_mb=settings.sandbox_memory_mb,
+    )
 
-    return f"Document edited and saved to {file_name}"
 
+registry.register("sandbox", make_sandbox)
 
-# Warning: This executes code locally, which can be unsafe when not sandboxed
 
-repl = PythonREPL()
+def sandbox_directory(config: RunnableConfig) -> Path:
+    return Path(settings.sandbox_dir) / run_id(config)
 
 
-@tool
-def python_repl_tool(
+@tool(response_format="content_and_artifact")
+async def python_repl_tool(
     code: Annotated[str, "The python code to execute to generate your chart."],
+    config: RunnableConfig,
 ):
     """Use this to execute python code. If you want to see the output of a value,
-    you should print it out with `print(...)`. This is visible to the user."""
-    try:
-        result = repl.run(code)
-    except BaseException as e:
-        return f"Failed to execute. Error: {repr(e)}"
-    return f"Successfully executed:\n\`\`\`python\n{code}\n\`\`\`\nStdout: {result}"
+    you should print it out with `print(...)`. This is visible to the user.
+    Each call starts from a fresh namespace. Open matplotlib figures are saved as PNG files."""
+    cwd = sandbox_directory(config)
+    result = await registry.get("sandbox").arun(code, str(cwd))
+    # the images stay on disk; the message carries their paths, not their bytes
+    images = [str(cwd / image.path) for image in result.images]
+    if not result.ok:
+        return f"Failed to execute. Error: {result.error}\nStdout: {result.stdout}", images
+    saved = f"\nImages: {', '.join(image.path for image in result.images)}" if images else ""
+    return f"Successfully executed:\n\`\`\`python\n{code}\n\`\`\`\nStdout: {result.stdout}{saved}", images
 
 # Helper Utilities
 # We are going to create a few utility functions to make it more concise when we want to:
@@ -135,31 +296,114 @@ def python_repl_tool(
 # These will simplify the graph compositional code at the end for us so it's easier to see what's going on.
 
 
-def make_supervisor_node(llm: BaseChatModel, members: list[str]) -> str:
+def make_supervisor_node(
+    llm: BaseChatModel | ModelTiers,
+    members: list[str],
+    parallel: bool = False,
+    rules: Optional[list[RoutingRule]] = None,
+    name: str = "supervisor",
+    context: Optional[ContextManager] = None,
+) -> str:
+    """Build an LLM-based router node.
+
+    With ``parallel=True`` the router may pick several workers at once; they are dispatched with
+    ``Send`` in the same step, and since every worker reports back to the supervisor, their reports
+    are merged into the state before the next routing decision.
+
+    ``rules`` (see routing.py, ``DEFAULT_RULES`` when omitted) decide obvious turns without the LLM;
+    each decision is counted in ``routing_stats`` under ``name``.
+
+    ``context`` bounds the conversation sent to the router LLM on each turn. With model tiers,
+    the router runs on the "router" tier.
+    """
+    if rules is None:
+        rules = DEFAULT_RULES
     options = ["FINISH"] + members
-    system_prompt = (
-        "You are a supervisor tasked with managing a conversation between the"
-        f" following workers: {members}. Given the following user request,"
-        " respond with the worker to act next. Each worker will perform a"
-        " task and respond with their results and status. When finished,"
-        " respond with FINISH."
-    )
+    if parallel:
+        system_prompt = (
+            "You are a supervisor tasked with managing a conversation between the"
+            f" following workers: {members}. Given the following user request,"
+            " respond with the workers to act next. Workers that don't depend on"
+            " each other's results can be listed together and will run at the same"
+            " time. Each worker will perform a task and respond with their results"
+            " and status. When finished, respond with FINISH."
+        )
+    else:
+        system_prompt = (
+            "You are a supervisor tasked with managing a conversation between the"
+            f" following workers: {members}. Given the following user request,"
+            " respond with the worker to act next. Each worker will perform a"
+            " task and respond with their results and status. When finished,"
+            " respond with FINISH."
+        )
 
     class Router(TypedDict):
         """Worker to route to next. If no workers needed, route to FINISH."""
 
         next: Literal[*options]
 
-    def supervisor_node(state: MessagesState) -> Command[Literal[*members, "__end__"]]:
+    class ParallelRouter(TypedDict):
+        """Workers to route to next, run at the same time. If no workers needed, route to FINISH."""
+
+        next: List[Literal[*options]]
+
+    router = for_role(llm, "router", lambda model: model.with_structured_output(ParallelRouter if parallel else Router))
+
+    async def supervisor_node(state: MessagesState, config: RunnableConfig) -> Command[Literal[*members, "__end__"]]:
         """An LLM-based router."""
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ] + state["messages"]
-        response = llm.with_structured_output(Router).invoke(messages)
-        goto = response["next"]
+        rule_name, decision = apply_rules(rules, state["messages"], members)
+        if rule_name is not None:
+            routing_stats.record(name, f"rule:{rule_name}")
+        else:
+            routing_stats.record(name, "llm")
+            history = state["messages"]
+            if context is not None:
+                history = await context.acompact(history)
+            messages = [
+                {"role": "system", "content": system_prompt},
+            ] + history
+            response = await router.ainvoke(messages, config)
+            decision = response["next"]
+        routing_stats.record_decision(name, routing_turn(state["messages"], members), decision)
+
+        if parallel:
+            if isinstance(decision, str):
+                decision = [decision]
+            workers = list(dict.fromkeys(decision))
+            if not workers or "FINISH" in workers:
+                return Command(goto=END)
+            return Command(goto=[Send(worker, {"messages": state["messages"]}) for worker in workers])
+
+        goto = decision[0] if isinstance(decision, list) else decision
         if goto == "FINISH":
             goto = END
 
         return Command(goto=goto)
 
     return supervisor_node
+
+
+def make_worker_node(agent: Runnable, name: str, supervisor: str, context: Optional[ContextManager] = None):
+    """Wrap a react agent as a graph node that reports its final answer back to the supervisor.
+
+    ``context`` bounds the conversation handed to the agent.
+    """
+
+    async def worker_node(state: MessagesState, config: RunnableConfig) -> Command[Literal[supervisor]]:
+        if context is not None:
+            state = {"messages": await context.acompact(state["messages"])}
+        result = await agent.ainvoke(state, config)
+
+        last_response = result["messages"][-1].content
+        return Command(
+            update={
+                "messages": [
+                    HumanMessage(content=last_response, name=name)
+                ]
+            },
+            # We want our workers to ALWAYS "report back" to the supervisor when done
+            goto=supervisor,
+        )
+
+    worker_node.__name__ = f"{name}_node"
+    return worker_node
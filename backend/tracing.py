@@ -0,0 +1,358 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langgraph.errors import GraphBubbleUp
+
+from streaming import namespace_path
+
+##########################################################################################
+# Tracing
+#
+# Tracer is a callback handler passed in the config of each graph run. It times every graph
+# node, model call and tool call, keyed by the node's namespace path ("research_team|search")
+# and node name, and keeps running totals for the /metrics endpoint. With a JSONL path, it
+# also writes one line per span to that file, from a background thread.
+#
+# Model calls report time to first token (equal to their duration when not streamed), prompt
+# and completion tokens, and cost at the configured per-token prices of their model. Cached replies carry
+# no usage, so they cost nothing.
+
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+@dataclass
+class Histogram:
+    counts: list[int] = field(default_factory=lambda: [0] * (len(BUCKETS) + 1))
+    total: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+@dataclass
+class ModelTotals:
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    ttft_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+
+@dataclass
+class ToolTotals:
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    ns: str
+    node: str
+    thread_id: Optional[str]
+    started: float
+    first_token: Optional[float] = None
+
+
+def span_context(metadata: Optional[dict[str, Any]]) -> tuple[str, str, Optional[str]]:
+    metadata = metadata or {}
+    return (
+        namespace_path(metadata.get("langgraph_checkpoint_ns") or metadata.get("checkpoint_ns", "")),
+        metadata.get("langgraph_node", ""),
+        metadata.get("thread_id"),
+    )
+
+
+class Tracer(BaseCallbackHandler):
+    # called on the event loop instead of in an executor thread: every handler method is cheap
+    run_inline = True
+
+    def __init__(
+        self,
+        jsonl_path: Optional[str] = None,
+        input_cost_per_mtok: float = 0.0,
+        output_cost_per_mtok: float = 0.0,
+        prices: Optional[dict[str, tuple[float, float]]] = None,
+    ):
+        self.input_cost = input_cost_per_mtok / 1e6
+        self.output_cost = output_cost_per_mtok / 1e6
+        # (input, output) per million tokens by model name, for the models priced differently
+        self.prices = {model: (i / 1e6, o / 1e6) for model, (i, o) in (prices or {}).items()}
+        self.lock = threading.Lock()
+        self.spans: dict[UUID, Span] = {}
+        self.nodes: defaultdict[tuple[str, str], Histogram] = defaultdict(Histogram)
+        self.node_errors: defaultdict[tuple[str, str], int] = defaultdict(int)
+        self.models: defaultdict[tuple[str, str, str], ModelTotals] = defaultdict(ModelTotals)
+        self.tools: defaultdict[tuple[str, str, str], ToolTotals] = defaultdict(ToolTotals)
+
+        self.writer: Optional[logging.Logger] = None
+        self.listener: Optional[QueueListener] = None
+        if jsonl_path:
+            self.writer, self.listener = self._jsonl_writer(jsonl_path)
+
+    @staticmethod
+    def _jsonl_writer(path: str) -> tuple[logging.Logger, QueueListener]:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = logging.FileHandler(path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, handler)
+        listener.start()
+        writer = logging.getLogger(f"trace.{id(listener)}")
+        writer.propagate = False
+        writer.setLevel(logging.INFO)
+        writer.addHandler(QueueHandler(log_queue))
+        return writer, listener
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def _start(self, run_id: UUID, kind: str, name: str, metadata: Optional[dict[str, Any]]):
+        ns, node, thread_id = span_context(metadata)
+        self.spans[run_id] = Span(kind, name, ns, node, thread_id, time.perf_counter())
+
+    def _write(self, span: Span, duration: float, error: Optional[BaseException], **extra: Any):
+        if self.writer is None:
+            return
+        record = {
+            "ts": time.time(),
+            "kind": span.kind,
+            "name": span.name,
+            "ns": span.ns,
+            "node": span.node,
+            "thread_id": span.thread_id,
+            "duration": round(duration, 6),
+            **extra,
+        }
+        if error is not None:
+            record["error"] = repr(error)
+        self.writer.info(json.dumps(record, default=str))
+
+    ####################################################################
+    # graph nodes
+
+    def on_chain_start(
+        self,
+        serialized: Optional[dict[str, Any]],
+        inputs: Any,
+        *,
+        run_id: UUID,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        # a node's own run carries the node name; the runnables inside it only inherit the metadata
+        name = kwargs.get("name")
+        if metadata and name and name == metadata.get("langgraph_node") and not name.startswith("__"):
+            self._start(run_id, "node", name, metadata)
+
+    def _end_node(self, run_id: UUID, error: Optional[BaseException]):
+        span = self.spans.pop(run_id, None)
+        if span is None:
+            return
+        duration = time.perf_counter() - span.started
+        with self.lock:
+            self.nodes[(span.ns, span.node)].observe(duration)
+            if error is not None:
+                self.node_errors[(span.ns, span.node)] += 1
+        self._write(span, duration, error)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_node(run_id, None)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        # interrupts and commands to a parent graph are raised, but they are not failures
+        self._end_node(run_id, None if isinstance(error, GraphBubbleUp) else error)
+
+    ####################################################################
+    # model calls
+
+    def on_chat_model_start(
+        self,
+        serialized: Optional[dict[str, Any]],
+        messages: Any,
+        *,
+        run_id: UUID,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        model = (metadata or {}).get("ls_model_name") or kwargs.get("name") or "model"
+        self._start(run_id, "llm", model, metadata)
+
+    def on_llm_start(self, serialized: Optional[dict[str, Any]], prompts: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, **kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        span = self.spans.get(run_id)
+        if span is not None and span.first_token is None:
+            span.first_token = time.perf_counter()
+
+    def _end_model(self, run_id: UUID, response: Optional[LLMResult], error: Optional[BaseException]):
+        span = self.spans.pop(run_id, None)
+        if span is None:
+            return
+        now = time.perf_counter()
+        duration = now - span.started
+        ttft = (span.first_token or now) - span.started
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations if response is not None else []:
+            for g in generations:
+                usage = getattr(getattr(g, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        input_cost, output_cost = self.prices.get(span.name, (self.input_cost, self.output_cost))
+        cost = prompt_tokens * input_cost + completion_tokens * output_cost
+        with self.lock:
+            totals = self.models[(span.ns, span.node, span.name)]
+            totals.calls += 1
+            totals.errors += error is not None
+            totals.seconds += duration
+            totals.ttft_seconds += ttft
+            totals.prompt_tokens += prompt_tokens
+            totals.completion_tokens += completion_tokens
+            totals.cost += cost
+        self._write(
+            span,
+            duration,
+            error,
+            ttft=round(ttft, 6),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=round(cost, 8),
+        )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_model(run_id, response, None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_model(run_id, None, error)
+
+    ####################################################################
+    # tool calls
+
+    def on_tool_start(
+        self,
+        serialized: Optional[dict[str, Any]],
+        input_str: str,
+        *,
+        run_id: UUID,
+        metadata: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start(run_id, "tool", name, metadata)
+
+    def _end_tool(self, run_id: UUID, error: Optional[BaseException]):
+        span = self.spans.pop(run_id, None)
+        if span is None:
+            return
+        duration = time.perf_counter() - span.started
+        with self.lock:
+            totals = self.tools[(span.ns, span.node, span.name)]
+            totals.calls += 1
+            totals.errors += error is not None
+            totals.seconds += duration
+        self._write(span, duration, error)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_tool(run_id, None)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_tool(run_id, error)
+
+    ####################################################################
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "nodes": {k: (Histogram(list(v.counts), v.total, v.count)) for k, v in self.nodes.items()},
+                "node_errors": dict(self.node_errors),
+                "models": {k: ModelTotals(**vars(v)) for k, v in self.models.items()},
+                "tools": {k: ToolTotals(**vars(v)) for k, v in self.tools.items()},
+            }
+
+
+####################################################################
+# Prometheus text format
+
+
+def _label_value(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in labels.items()) + "}" if labels else ""
+
+
+class MetricsWriter:
+    """Collects samples grouped by metric, as the text format wants each metric's lines together."""
+
+    def __init__(self, prefix: str = "hat"):
+        self.prefix = prefix
+        self.families: dict[str, list[str]] = {}
+
+    def _family(self, name: str, kind: str, help_text: str) -> list[str]:
+        lines = self.families.get(name)
+        if lines is None:
+            lines = self.families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        return lines
+
+    def add(self, name: str, kind: str, help_text: str, value: float, **labels: Any):
+        name = f"{self.prefix}_{name}"
+        self._family(name, kind, help_text).append(f"{name}{_labels(**labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, h: Histogram, **labels: Any):
+        name = f"{self.prefix}_{name}"
+        lines = self._family(name, "histogram", help_text)
+        cumulative = 0
+        for bound, count in zip(list(BUCKETS) + ["+Inf"], h.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(**labels)} {h.total}")
+        lines.append(f"{name}_count{_labels(**labels)} {h.count}")
+
+    def text(self) -> str:
+        return "".join(line + "\n" for lines in self.families.values() for line in lines)
+
+
+def write_trace_metrics(out: MetricsWriter, tracer: Tracer):
+    snapshot = tracer.snapshot()
+    for (ns, node), h in sorted(snapshot["nodes"].items()):
+        out.histogram("node_duration_seconds", "Wall time of graph nodes.", h, ns=ns, node=node)
+    for (ns, node), n in sorted(snapshot["node_errors"].items()):
+        out.add("node_errors_total", "counter", "Graph nodes that raised.", n, ns=ns, node=node)
+    for (ns, node, model), m in sorted(snapshot["models"].items()):
+        labels = {"ns": ns, "node": node, "model": model}
+        out.add("llm_calls_total", "counter", "Model calls.", m.calls, **labels)
+        out.add("llm_errors_total", "counter", "Failed model calls.", m.errors, **labels)
+        out.add("llm_seconds_total", "counter", "Wall time of model calls.", m.seconds, **labels)
+        out.add("llm_ttft_seconds_total", "counter", "Time to first token of model calls.", m.ttft_seconds, **labels)
+        tokens = "Tokens used by model calls."
+        out.add("llm_tokens_total", "counter", tokens, m.prompt_tokens, **labels, type="prompt")
+        out.add("llm_tokens_total", "counter", tokens, m.completion_tokens, **labels, type="completion")
+        out.add("llm_cost_usd_total", "counter", "Cost of model calls at the configured prices.", m.cost, **labels)
+    for (ns, node, tool), t in sorted(snapshot["tools"].items()):
+        out.add("tool_calls_total", "counter", "Tool calls.", t.calls, ns=ns, node=node, tool=tool)
+        out.add("tool_errors_total", "counter", "Failed tool calls.", t.errors, ns=ns, node=node, tool=tool)
+        out.add("tool_seconds_total", "counter", "Wall time of tool calls.", t.seconds, ns=ns, node=node, tool=tool)
@@ -0,0 +1,256 @@
+import base64
+import binascii
+import codecs
+import posixpath
+import re
+from typing import Any, AsyncIterator, Optional
+from uuid import uuid4
+
+from errs import BadRequest, QuotaExceeded
+from misc import AsyncReader, detect_encoding, parse_data_url, transfer_stream
+from retrieval import Chunker
+from workspace import UPLOAD_DIR, Workspace, document_name
+
+##########################################################################################
+# Uploaded documents
+#
+# POST /rest/v1/runs/<thread_id>/uploads gives a run documents of its own, as a multipart form
+# (any number of files) or as a base64 data URL. The request body is read as it arrives and
+# never held whole:
+#
+#   body chunks -> MultipartReader / DataUrlReader (the bytes of one file)
+#               -> TextReader (encoding detected on the head, then decoded incrementally;
+#                  passages indexed as they complete, see retrieval.Chunker)
+#               -> transfer_stream (written as UTF-8 to a temporary file in the workspace,
+#                  moved to uploads/<name> once complete)
+#
+# So by the end of the upload the file is indexed for the retrieve tool, and, within the
+# workspace quota, readable as a document. What the upload holds at a time is a chunk and a
+# passage or so; the index itself grows with the file, by about 2.5 times its size (up to
+# retrieval_max_passages), plus a transient of about as much when the first search merges
+# the new postings. A failed upload leaves neither its file nor its passages behind. Other
+# workers, and later runs, index the file from uploads/ on their next search (see
+# workspace.py), so with WORKSPACE_SPILL off, uploads only reach the worker that took them.
+
+_FILENAME = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]*)"?', re.IGNORECASE)
+_BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+
+
+def multipart_boundary(content_type: str) -> Optional[bytes]:
+    if not content_type.lower().startswith("multipart/form-data"):
+        return None
+    m = _BOUNDARY.search(content_type)
+    if m is None:
+        raise BadRequest("A multipart body needs a boundary")
+    return m.group(1).encode("latin-1")
+
+
+def upload_name(filename: str) -> str:
+    """Where an uploaded file goes in the workspace: uploads/<its base name>."""
+    name = posixpath.basename(filename.replace("\\", "/")).strip()
+    return document_name(posixpath.join(UPLOAD_DIR, name or "upload.txt"))
+
+
+class MultipartReader:
+    """The files of a multipart/form-data body: next_part() moves to the next one, read() reads it."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], boundary: bytes, max_header_bytes: int = 16384):
+        self.chunks = aiter(chunks)
+        self.delimiter = b"\r\n--" + boundary
+        self.max_header_bytes = max_header_bytes
+        # the first boundary has no line break before it
+        self.buffer = b"\r\n"
+        # the preamble is read (and skipped) like a part
+        self.in_part = True
+        self.done = False
+
+    async def _more(self) -> bool:
+        chunk = await anext(self.chunks, None)
+        if chunk is None:
+            return False
+        self.buffer += chunk
+        return True
+
+    async def next_part(self) -> Optional[dict[str, str]]:
+        """The headers of the next part (lower case names), None after the last one."""
+        while await self.read():
+            pass
+        if self.done:
+            return None
+        while len(self.buffer) < 2:
+            if not await self._more():
+                raise BadRequest("The multipart body ends before its closing boundary")
+        if self.buffer.startswith(b"--"):
+            self.done = True
+            return None
+        while (end := self.buffer.find(b"\r\n\r\n")) == -1:
+            if len(self.buffer) > self.max_header_bytes or not await self._more():
+                raise BadRequest("Invalid multipart part headers")
+        headers = {}
+        for line in self.buffer[2:end].decode("utf-8", errors="replace").split("\r\n"):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        self.buffer = self.buffer[end + 4 :]
+        self.in_part = True
+        return headers
+
+    async def read(self, size: int = 65536) -> bytes:
+        """Up to ``size`` bytes of the current part, b"" at its end."""
+        while self.in_part:
+            at = self.buffer.find(self.delimiter)
+            if at == 0:
+                self.buffer = self.buffer[len(self.delimiter) :]
+                self.in_part = False
+                break
+            # without a delimiter, keep what could be its start
+            n = min(size, at if at != -1 else len(self.buffer) - len(self.delimiter) + 1)
+            if n > 0:
+                data, self.buffer = self.buffer[:n], self.buffer[n:]
+                return data
+            if not await self._more():
+                raise BadRequest("The multipart body ends before its closing boundary")
+        return b""
+
+
+class DataUrlReader:
+    """The bytes of a base64 data URL body, decoded as it arrives."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], max_header_bytes: int = 1024):
+        self.chunks = aiter(chunks)
+        self.max_header_bytes = max_header_bytes
+        self.buffer = b""
+        self.ended = False
+        self.mime_type = ""
+
+    async def _more(self) -> bool:
+        chunk = await anext(self.chunks, None)
+        if chunk is None:
+            self.ended = True
+            return False
+        self.buffer += chunk
+        return True
+
+    async def open(self) -> str:
+        """Reads the header of the data URL; returns its MIME type."""
+        while (comma := self.buffer.find(b",")) == -1:
+            if len(self.buffer) > self.max_header_bytes or not await self._more():
+                raise BadRequest("The body is not a data URL")
+        try:
+            self.mime_type, _, _ = parse_data_url(self.buffer[: comma + 1].decode("ascii"))
+        except (ValueError, IndexError) as e:
+            raise BadRequest(f"Invalid data URL: {e}") from e
+        self.buffer = self.buffer[comma + 1 :].translate(None, b" \t\r\n")
+        return self.mime_type
+
+    async def read(self, size: int = 65536) -> bytes:
+        want = max(4, size // 3 * 4)
+        while len(self.buffer) < want and await self._more():
+            self.buffer = self.buffer.translate(None, b" \t\r\n")
+        n = len(self.buffer) if self.ended else min(want, len(self.buffer)) // 4 * 4
+        encoded, self.buffer = self.buffer[:n], self.buffer[n:]
+        try:
+            return base64.b64decode(encoded, validate=True)
+        except binascii.Error as e:
+            raise BadRequest(f"Invalid base64 in data URL: {e}") from e
+
+
+class TextReader:
+    """Reads ``src`` as text: decodes it, indexes its passages in the workspace, and returns it as UTF-8."""
+
+    def __init__(self, src: AsyncReader, workspace: Workspace, name: str, max_bytes: int, sample_bytes: int = 65536):
+        self.src = src
+        self.index = workspace.index
+        self.chunker = Chunker(self.index.chunk_chars)
+        self.name = name
+        self.title = posixpath.basename(name)
+        self.max_bytes = max_bytes
+        self.sample_bytes = sample_bytes
+        self.decoder: Any = None
+        self.encoding = ""
+        self.size = 0
+        self.passages = 0
+        self.ended = False
+
+    def _start(self, sample: bytes):
+        encoding = detect_encoding(sample, self.sample_bytes) if sample else "utf-8"
+        if not encoding:
+            raise BadRequest(f"{self.title} is not a text document")
+        # ASCII so far can still turn out to be UTF-8
+        self.encoding = "utf-8" if codecs.lookup(encoding).name == "ascii" else encoding
+        self.decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+
+    def _index(self, passages: list[str]):
+        self.passages += sum(self.index.add_passage(self.name, self.title, p) for p in passages)
+
+    async def read(self, size: int = 65536) -> bytes:
+        head = b""
+        while not self.ended:
+            data = await self.src.read(size)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                raise QuotaExceeded(f"Uploads are limited to {self.max_bytes} bytes")
+            if self.decoder is None:
+                # the encoding is detected on the head of the file
+                head += data
+                if data and len(head) < self.sample_bytes:
+                    continue
+                self._start(head)
+                data = head
+            if not data:
+                self.ended = True
+                text = self.decoder.decode(b"", final=True)
+                self._index(self.chunker.feed(text) + self.chunker.close())
+                return text.encode()
+            text = self.decoder.decode(data)
+            self._index(self.chunker.feed(text))
+            if text:
+                return text.encode()
+        return b""
+
+
+async def ingest(workspace: Workspace, src: AsyncReader, filename: str, max_bytes: int) -> dict[str, Any]:
+    """Writes an uploaded file to the workspace and indexes it, as it is read."""
+    name = upload_name(filename)
+    fs = workspace.fs
+    # the passages of an earlier file of that name are replaced
+    workspace.index.remove_source(name)
+    workspace.uploads.pop(name, None)
+    reader = TextReader(src, workspace, name, max_bytes)
+    partial = workspace.path(f".{UPLOAD_DIR}/{uuid4().hex}")
+    try:
+        await transfer_stream(reader, fs, partial)
+        if fs is not None:
+            await fs._mv(partial, workspace.path(name))  # pylint: disable=protected-access
+            info = await fs._info(workspace.path(name))  # pylint: disable=protected-access
+            workspace.uploads[name] = (info["size"], info["mtime"])
+    except BaseException:
+        workspace.index.remove_source(name)
+        if fs is not None:
+            try:
+                await fs._rm(partial)  # pylint: disable=protected-access
+            except FileNotFoundError:
+                pass
+        raise
+    # a document of that name read before is stale
+    workspace.forget(name)
+    return {"name": name, "bytes": reader.size, "encoding": reader.encoding, "passages": reader.passages}
+
+
+async def ingest_body(
+    workspace: Workspace, chunks: AsyncIterator[bytes], content_type: str, filename: str, max_bytes: int
+) -> list[dict[str, Any]]:
+    """The files of a multipart or data URL request body, ingested one after the other."""
+    boundary = multipart_boundary(content_type)
+    if boundary is None:
+        reader = DataUrlReader(chunks)
+        await reader.open()
+        return [await ingest(workspace, reader, filename, max_bytes)]
+
+    parts = MultipartReader(chunks, boundary)
+    uploaded = []
+    while (headers := await parts.next_part()) is not None:
+        m = _FILENAME.search(headers.get("content-disposition", ""))
+        # form fields other than files, and empty file fields, are skipped
+        if m is not None and m.group(1):
+            uploaded.append(await ingest(workspace, parts, m.group(1), max_bytes))
+    return uploaded
@@ -0,0 +1,374 @@
+import asyncio
+import codecs
+import os
+import posixpath
+import re
+import shutil
+import stat
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from fsspec.asyn import AsyncFileSystem  # type: ignore
+
+from document import Document
+from errs import BadRequest, QuotaExceeded
+from log import get_logger
+from misc import read_file_text, write_file_text
+from retrieval import Chunker, Passage, RunIndex
+
+##########################################################################################
+# Per-run workspaces for the document tools
+#
+# Each run (thread id) gets its own set of documents, so concurrent questions can't read or
+# overwrite each other's outline. Documents (see document.py) live in memory while the run is
+# under way, within a quota of bytes and files per run. With a file system, changed documents
+# are written behind (spill_delay seconds after a change, from their first changed line on)
+# under <root>/<run id>/, and documents not in memory are read from there, so an interrupted run
+# resumed later, or by another worker, finds its documents again. When a run completes its
+# workspace is written out and dropped from memory.
+#
+# A workspace also holds the run's retrieval index (see retrieval.py), built on first use and
+# dropped with it: it is cheap to rebuild, and its sources may be stale by the next run. The
+# files uploaded to the run (see upload.py) are saved under uploads/; before each search, those
+# not in this process's index yet, or changed since, are indexed from there, so uploads reach
+# every worker sharing the file system, and runs after the one they were uploaded for.
+
+UPLOAD_DIR = "uploads"
+
+
+def run_directory(thread_id: str) -> str:
+    """A thread id made safe to use as a directory name (thread ids come from the client)."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", thread_id).lstrip(".") or "shared"
+
+
+def run_id(config: Optional[dict]) -> str:
+    return run_directory(str(((config or {}).get("configurable") or {}).get("thread_id") or ""))
+
+
+def document_name(name: str) -> str:
+    name = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if name in ("", ".") or name == ".." or name.startswith("../"):
+        raise BadRequest(f"Invalid document name: {name}")
+    return name
+
+
+class _LocalFile:
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self.f: Any = None
+
+    async def __aenter__(self):
+        if "w" in self.mode:
+            await asyncio.to_thread(os.makedirs, os.path.dirname(self.path), exist_ok=True)
+        self.f = await asyncio.to_thread(open, self.path, self.mode)
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.to_thread(self.f.close)
+
+    async def read(self, size: int = -1) -> bytes:
+        return await asyncio.to_thread(self.f.read, size)
+
+    async def write(self, data: bytes) -> int:
+        return await asyncio.to_thread(self.f.write, data)
+
+    async def seek(self, offset: int) -> int:
+        return await asyncio.to_thread(self.f.seek, offset)
+
+    async def truncate(self) -> int:
+        return await asyncio.to_thread(self.f.truncate)
+
+
+class LocalAsyncFileSystem(AsyncFileSystem):
+    """Local files for the misc.py helpers, with the blocking calls made in threads."""
+
+    def open(self, path, mode="rb", **kwargs):  # pylint: disable=arguments-differ
+        return _LocalFile(path, mode)
+
+    async def _rm(self, path, recursive=False, **kwargs):  # pylint: disable=arguments-differ
+        if recursive:
+            await asyncio.to_thread(shutil.rmtree, path, True)
+        else:
+            await asyncio.to_thread(os.remove, path)
+
+    async def _mv(self, path1, path2, **kwargs):  # pylint: disable=arguments-differ
+        await asyncio.to_thread(os.makedirs, os.path.dirname(path2), exist_ok=True)
+        await asyncio.to_thread(os.replace, path1, path2)
+
+    async def _info(self, path, **kwargs):
+        s = await asyncio.to_thread(os.stat, path)
+        kind = "directory" if stat.S_ISDIR(s.st_mode) else "file"
+        return {"name": path, "type": kind, "size": s.st_size, "mtime": s.st_mtime}
+
+    async def _ls(self, path, detail=True, **kwargs):
+        names = await asyncio.to_thread(os.listdir, path)
+        entries = [await self._info(os.path.join(path, name)) for name in sorted(names)]
+        return entries if detail else [e["name"] for e in entries]
+
+
+class Workspace:
+    def __init__(
+        self,
+        run: str,
+        fs: Optional[AsyncFileSystem] = None,
+        root: str = "",
+        max_bytes: int = 5 * 2**20,
+        max_files: int = 100,
+        spill_delay: float = 1.0,
+        make_index: Callable[[], RunIndex] = RunIndex,
+    ):
+        self.run = run
+        self.fs = fs
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.spill_delay = spill_delay
+        self.files: dict[str, Document] = {}
+        self.dirty: set[str] = set()
+        self.size = 0
+        self.spill_task: Optional[asyncio.Task] = None
+        self.make_index = make_index
+        self._index: Optional[RunIndex] = None
+        # (size, mtime) of the uploaded files in the index
+        self.uploads: dict[str, tuple[int, float]] = {}
+
+    @property
+    def index(self) -> RunIndex:
+        if self._index is None:
+            self._index = self.make_index()
+            self.uploads = {}
+        return self._index
+
+    async def search(self, query: str, k: int = 5) -> list[Passage]:
+        await self.index_uploads()
+        return await self.index.search(query, k)
+
+    async def index_uploads(self) -> int:
+        """Index the uploaded files not in the index yet, or changed since; returns the passages added."""
+        if self.fs is None:
+            return 0
+        index = self.index
+        try:
+            entries = await self.fs._ls(self.path(UPLOAD_DIR), detail=True)  # pylint: disable=protected-access
+        except FileNotFoundError:
+            return 0
+        added = 0
+        for entry in entries:
+            name = posixpath.join(UPLOAD_DIR, posixpath.basename(entry["name"]))
+            stamp = (entry["size"], entry["mtime"])
+            if entry["type"] != "file" or self.uploads.get(name) == stamp:
+                continue
+            self.uploads[name] = stamp
+            index.remove_source(name)
+            try:
+                added += await self._index_file(name)
+            except QuotaExceeded as e:
+                get_logger("workspace").warning("upload %s of run %s only partly indexed: %s", name, self.run, e)
+                break
+        return added
+
+    async def _index_file(self, name: str, buf_size: int = 65536) -> int:
+        """Index a file of the workspace (UTF-8 text), a chunk at a time."""
+        index, title = self.index, posixpath.basename(name)
+        chunker = Chunker(index.chunk_chars)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        added = 0
+        async with self.fs.open(self.path(name), "rb") as f:
+            while chunk := await f.read(buf_size):
+                added += sum(index.add_passage(name, title, p) for p in chunker.feed(decoder.decode(chunk)))
+        passages = chunker.feed(decoder.decode(b"", final=True)) + chunker.close()
+        return added + sum(index.add_passage(name, title, p) for p in passages)
+
+    def path(self, name: str) -> str:
+        return posixpath.join(self.root, self.run, name)
+
+    async def document(self, name: str) -> Document:
+        name = document_name(name)
+        if name not in self.files:
+            if self.fs is None:
+                raise FileNotFoundError(name)
+            text, _ = await read_file_text(self.fs, self.path(name))
+            # another coroutine may have written it meanwhile
+            if name not in self.files:
+                self._put(name, Document(text, saved=True))
+        return self.files[name]
+
+    def write(self, name: str, text: str):
+        name = document_name(name)
+        self._put(name, Document(text))
+        self._changed(name)
+
+    async def edit(
+        self, name: str, inserts: Optional[dict[int, str]] = None, replacements: Optional[dict[int, str]] = None
+    ):
+        document = await self.document(name)
+        if self.size + document.added_bytes(inserts, replacements) > self.max_bytes:
+            raise QuotaExceeded(f"Workspace is limited to {self.max_bytes} bytes")
+        old = document.size
+        document.edit(inserts, replacements)
+        self.size += document.size - old
+        self._changed(document_name(name))
+
+    def _put(self, name: str, document: Document):
+        old = self.files[name].size if name in self.files else 0
+        if name not in self.files and len(self.files) >= self.max_files:
+            raise QuotaExceeded(f"Workspace is limited to {self.max_files} documents")
+        if self.size - old + document.size > self.max_bytes:
+            raise QuotaExceeded(f"Workspace is limited to {self.max_bytes} bytes")
+        self.files[name] = document
+        self.size += document.size - old
+
+    def forget(self, name: str):
+        """Drop a document from memory, unsaved changes included, so the next read loads it again."""
+        name = document_name(name)
+        document = self.files.pop(name, None)
+        if document is not None:
+            self.size -= document.size
+            self.dirty.discard(name)
+
+    def _changed(self, name: str):
+        self.dirty.add(name)
+        if self.fs is not None and self.spill_task is None:
+            self.spill_task = asyncio.get_running_loop().create_task(self._spill_later())
+
+    def names(self) -> list[str]:
+        return sorted(self.files)
+
+    async def saved_names(self) -> list[str]:
+        """The documents of the run, those only on disk included (uploads aside)."""
+        names = set(self.files)
+        if self.fs is None:
+            return sorted(names)
+        prefix = self.path("")
+        folders = [prefix]
+        while folders:
+            try:
+                entries = await self.fs._ls(folders.pop(), detail=True)  # pylint: disable=protected-access
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                name = entry["name"][len(prefix) :]
+                # uploads, and the partial files of those under way
+                if posixpath.basename(name).startswith(".") or name == UPLOAD_DIR:
+                    continue
+                if entry["type"] == "directory":
+                    folders.append(entry["name"] + "/")
+                else:
+                    names.add(name)
+        return sorted(names)
+
+    async def _spill_later(self):
+        await asyncio.sleep(self.spill_delay)
+        self.spill_task = None
+        await self.spill()
+
+    async def spill(self):
+        """Save the documents changed since the last spill, each from its first changed line on."""
+        if self.fs is None:
+            return
+        while self.dirty:
+            name = self.dirty.pop()
+            document = self.files[name]
+            line, document.dirty_from = document.dirty_from, None
+            if line is None:
+                continue
+            try:
+                await self._save(name, document, line)
+            except BaseException:
+                document.dirty_from = line if document.dirty_from is None else min(line, document.dirty_from)
+                self.dirty.add(name)
+                raise
+
+    async def _save(self, name: str, document: Document, line: int):
+        path = self.path(name)
+        if line > 0:
+            offset, tail = document.byte_offset(line), document.read(line).encode()
+            try:
+                async with self.fs.open(path, "r+b") as f:
+                    await f.seek(offset)
+                    await f.write(tail)
+                    await f.truncate()
+                return
+            except FileNotFoundError:
+                pass
+        await write_file_text(self.fs, path, document.text())
+
+    async def close(self):
+        task, self.spill_task = self.spill_task, None
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+        await self.spill()
+
+
+class Workspaces:
+    """The workspaces of the runs under way, at most max_runs of them in memory."""
+
+    def __init__(
+        self,
+        fs: Optional[AsyncFileSystem] = None,
+        root: str = "",
+        max_bytes: int = 5 * 2**20,
+        max_files: int = 100,
+        spill_delay: float = 1.0,
+        max_runs: int = 1000,
+        make_index: Callable[[], RunIndex] = RunIndex,
+    ):
+        self.logger = get_logger("workspace")
+        self.fs = fs
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.spill_delay = spill_delay
+        self.max_runs = max_runs
+        self.make_index = make_index
+        self.runs: OrderedDict[str, Workspace] = OrderedDict()
+        self.evicting: set[asyncio.Task] = set()
+
+    def get(self, run: str) -> Workspace:
+        run = run_directory(run)
+        workspace = self.runs.get(run)
+        if workspace is None:
+            workspace = self.runs[run] = Workspace(
+                run, self.fs, self.root, self.max_bytes, self.max_files, self.spill_delay, self.make_index
+            )
+            while len(self.runs) > self.max_runs:
+                _, evicted = self.runs.popitem(last=False)
+                task = asyncio.get_running_loop().create_task(evicted.close())
+                self.evicting.add(task)
+                task.add_done_callback(self.evicting.discard)
+        else:
+            self.runs.move_to_end(run)
+        return workspace
+
+    async def close(self, run: str):
+        """Write out the workspace of a completed run and drop it from memory."""
+        run = run_directory(run)
+        workspace = self.runs.pop(run, None)
+        if workspace is None:
+            return
+        try:
+            await workspace.close()
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.logger.exception("failed to write out the workspace of run %s", run)
+
+    async def delete(self, run: str):
+        """Forget a run's documents, on disk too."""
+        run = run_directory(run)
+        workspace = self.runs.pop(run, None)
+        if workspace is not None and workspace.spill_task is not None:
+            workspace.spill_task.cancel()
+        if self.fs is not None:
+            await self.fs._rm(posixpath.join(self.root, run), recursive=True)  # pylint: disable=protected-access
+
+    def metrics(self) -> dict[str, Any]:
+        indexes = [w._index for w in self.runs.values() if w._index is not None]  # pylint: disable=protected-access
+        return {
+            "runs": len(self.runs),
+            "documents": sum(len(w.files) for w in self.runs.values()),
+            "lines": sum(d.line_count for w in self.runs.values() for d in w.files.values()),
+            "bytes": sum(w.size for w in self.runs.values()),
+            "dirty": sum(len(w.dirty) for w in self.runs.values()),
+            "passages": sum(len(index) for index in indexes),
+            "index_bytes": sum(index.metrics()["bytes"] for index in indexes),
+        }